@@ -0,0 +1,135 @@
+"""Annotation building time for the frames of a large multi-frame file.
+
+Times `create_ann_jsons`, which shares the interned tag JSONs between all frames,
+and the previous per-frame object graph: a sly.Tag list, a TagCollection and a
+sly.Annotation per frame, serialized with to_json() for the upload. The tags are
+extracted from a synthetic enhanced CT file with "All tags".
+
+The app globals need the stand-in API, the benchmark runs in a new process.
+
+Usage: python benchmarks/annotation_build.py [--frames 3000] [--repeat 3] [--output FILE]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+BENCHMARKS_DIR = dirname(abspath(__file__))
+SRC_DIR = join(dirname(BENCHMARKS_DIR), "src")
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from corpus import write_multiframe  # pylint: disable=wrong-import-position
+from fake_server import FakeApiServer  # pylint: disable=wrong-import-position
+from run_import import DEFAULT_ENV  # pylint: disable=wrong-import-position
+
+FRAME_SIZE = 512
+
+
+def build_object_graphs(result, group_tag_name: str) -> list:
+    """The previous annotation building: tag objects and an annotation per frame."""
+    # pylint: disable=import-outside-toplevel
+    import supervisely as sly
+
+    import sly_utils as f
+
+    ann_jsons = []
+    for img_size in result.img_sizes:
+        tags = [sly.Tag(f.get_tag_meta(group_tag_name), result.group_tag_value)]
+        tags.extend(sly.Tag(f.get_tag_meta(name), value) for name, value in result.tags)
+        ann = sly.Annotation(img_size=img_size).add_tags(sly.TagCollection(tags))
+        ann_jsons.append(ann.to_json())
+    return ann_jsons
+
+
+def measure(func, repeat: int) -> float:
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+def measure_in_process(env: dict, dcm_path: str, frames: int, repeat: int) -> dict:
+    os.environ.update(env)
+    sys.path.insert(0, SRC_DIR)
+    # pylint: disable=import-outside-toplevel
+    import pydicom
+
+    import sly_utils as f
+    from converter import (
+        PIXEL_DATA_DEFER_SIZE,
+        ConversionResult,
+        ConversionSettings,
+        extract_dcm_tags,
+    )
+
+    settings = ConversionSettings(
+        group_tag_name="StudyInstanceUID", extract_tags=True, add_all_tags=True
+    )
+    dcm = pydicom.dcmread(dcm_path, defer_size=PIXEL_DATA_DEFER_SIZE)
+    tags, meta = extract_dcm_tags(dcm, settings)
+    result = ConversionResult(
+        image_path=dcm_path,
+        tags=tags,
+        meta=meta,
+        group_tag_value=str(dcm.StudyInstanceUID),
+        img_sizes=[[FRAME_SIZE, FRAME_SIZE]] * frames,
+    )
+    group_tag_name = settings.group_tag_name
+
+    seconds = measure(lambda: f.create_ann_jsons(result, group_tag_name), repeat)
+    previous_seconds = measure(lambda: build_object_graphs(result, group_tag_name), repeat)
+    # the JSONs are serialized for the upload either way
+    ann_jsons = f.create_ann_jsons(result, group_tag_name)
+    dumps_seconds = measure(lambda: json.dumps(ann_jsons), repeat)
+    return {
+        "frames": frames,
+        "tags_per_frame": len(tags) + 1,
+        "seconds": round(seconds, 4),
+        "previous_seconds": round(previous_seconds, 4),
+        "speedup": round(previous_seconds / max(seconds, 1e-6), 1),
+        "json_dumps_seconds": round(dumps_seconds, 4),
+    }
+
+
+def run_benchmark(frames: int, repeat: int) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="dicom_annotation_build_")
+    try:
+        # a single frame has the same tags as the whole file
+        dcm_path = write_multiframe(join(work_dir, "enhanced.dcm"), 1, 16, enhanced=True)
+        with FakeApiServer() as server:
+            env = dict(
+                DEFAULT_ENV,
+                SERVER_ADDRESS=server.address,
+                DEBUG_APP_DIR=join(work_dir, "app_data"),
+                DEBUG_CACHE_DIR=join(work_dir, "app_cache"),
+            )
+            with multiprocessing.get_context("spawn").Pool(1) as pool:
+                return pool.apply(measure_in_process, (env, dcm_path, frames, repeat))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=3, help="the best time is reported")
+    parser.add_argument("--output", help="JSON report path, printed if not set")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.frames, args.repeat)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""Synthetic DICOM corpus generator for the benchmarks and tests.
+
+Usage: python benchmarks/corpus.py <output dir> [--profile small|medium|large]
+"""
+import argparse
+import io
+import json
+import os
+from os.path import join
+from typing import List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.encaps import encapsulate
+from pydicom.sequence import Sequence as DicomSequence
+from pydicom.uid import (
+    PYDICOM_IMPLEMENTATION_UID,
+    ExplicitVRLittleEndian,
+    JPEG2000Lossless,
+    JPEGBaseline8Bit,
+    RLELossless,
+    generate_uid,
+)
+
+CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2"
+MR_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.4"
+ENHANCED_CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2.1"
+DX_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.1.1"
+# multi-frame grayscale word secondary capture, used for plain multi-frame files
+MULTIFRAME_SC_STORAGE = "1.2.840.10008.5.1.4.1.1.7.3"
+
+AXIAL = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0)
+SAGITTAL = (0.0, 1.0, 0.0, 0.0, 0.0, -1.0)
+CORONAL = (1.0, 0.0, 0.0, 0.0, 0.0, -1.0)
+
+PROFILES = {
+    # name: (series, slices per series, slice size, multi-frame files, frames, frame size)
+    "small": (2, 8, 64, 1, 16, 64),
+    "medium": (4, 64, 256, 2, 200, 256),
+    "large": (8, 200, 512, 2, 2000, 512),
+}
+
+
+def get_pixels(rows: int, columns: int, frames: int = 1, seed: int = 0) -> np.ndarray:
+    """Smooth int16 pattern with some noise: compressible, but not trivially."""
+    rng = np.random.default_rng(seed)
+    grid = np.add.outer(np.arange(rows, dtype=np.int32), np.arange(columns, dtype=np.int32))
+    pixels = np.empty((frames, rows, columns), dtype=np.int16)
+    for frame in range(frames):
+        noise = rng.integers(0, 16, size=(rows, columns), dtype=np.int32)
+        pixels[frame] = (grid * 4 + frame * 8 + noise) % 4096 - 1024
+    return pixels
+
+
+def new_dataset(
+    sop_class_uid: str,
+    pixels: np.ndarray,
+    study_uid: str = None,
+    series_uid: str = None,
+    modality: str = "CT",
+    instance_number: int = 1,
+) -> FileDataset:
+    """Creates a dataset with (frames, rows, columns) int16 pixel data."""
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = sop_class_uid
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    file_meta.ImplementationClassUID = PYDICOM_IMPLEMENTATION_UID
+
+    ds = FileDataset(None, {}, file_meta=file_meta, preamble=b"\0" * 128)
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.SOPClassUID = sop_class_uid
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = study_uid or generate_uid()
+    ds.SeriesInstanceUID = series_uid or generate_uid()
+    ds.Modality = modality
+    ds.PatientID = "SYNTHETIC"
+    ds.PatientName = "Synthetic^Patient"
+    ds.Manufacturer = "Synthetic"
+    ds.ManufacturerModelName = "corpus.py"
+    ds.InstanceNumber = instance_number
+
+    frames, rows, columns = pixels.shape
+    ds.Rows, ds.Columns = rows, columns
+    if frames > 1 or sop_class_uid in (ENHANCED_CT_IMAGE_STORAGE, MULTIFRAME_SC_STORAGE):
+        ds.NumberOfFrames = frames
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 1
+    ds.RescaleIntercept = 0
+    ds.RescaleSlope = 1
+    ds.PixelData = pixels.tobytes()
+    return ds
+
+
+def set_plane(
+    ds: Dataset,
+    orientation: Sequence[float],
+    position: Sequence[float],
+    pixel_spacing: Optional[Sequence[float]] = (0.5, 0.7),
+    slice_thickness: float = 2.0,
+) -> Dataset:
+    ds.ImageOrientationPatient = [float(v) for v in orientation]
+    ds.ImagePositionPatient = [float(v) for v in position]
+    if pixel_spacing is not None:
+        ds.PixelSpacing = [float(v) for v in pixel_spacing]
+    ds.SliceThickness = slice_thickness
+    return ds
+
+
+def set_functional_groups(
+    ds: Dataset,
+    orientation: Sequence[float],
+    positions: List[Sequence[float]],
+    pixel_spacing: Sequence[float] = (0.5, 0.7),
+    slice_spacing: float = 2.0,
+) -> Dataset:
+    """Enhanced multi-frame: plane attributes live in the functional groups only."""
+    measures = Dataset()
+    measures.PixelSpacing = [float(v) for v in pixel_spacing]
+    measures.SliceThickness = slice_spacing
+    measures.SpacingBetweenSlices = slice_spacing
+    plane_orientation = Dataset()
+    plane_orientation.ImageOrientationPatient = [float(v) for v in orientation]
+    shared = Dataset()
+    shared.PixelMeasuresSequence = DicomSequence([measures])
+    shared.PlaneOrientationSequence = DicomSequence([plane_orientation])
+    ds.SharedFunctionalGroupsSequence = DicomSequence([shared])
+
+    per_frame = []
+    for position in positions:
+        plane_position = Dataset()
+        plane_position.ImagePositionPatient = [float(v) for v in position]
+        frame_group = Dataset()
+        frame_group.PlanePositionSequence = DicomSequence([plane_position])
+        per_frame.append(frame_group)
+    ds.PerFrameFunctionalGroupsSequence = DicomSequence(per_frame)
+    return ds
+
+
+def compress(ds: FileDataset) -> FileDataset:
+    """Re-encodes pixel data with RLE Lossless, pydicom can encode it without plugins."""
+    frames = int(ds.get("NumberOfFrames") or 1)
+    pixels = np.frombuffer(ds.PixelData, dtype=np.int16).reshape(frames, ds.Rows, ds.Columns)
+    ds.compress(RLELossless, pixels if frames > 1 else pixels[0])
+    return ds
+
+
+def save(ds: FileDataset, path: str) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ds.save_as(path, write_like_original=False)
+    return path
+
+
+def write_series(
+    dir_path: str,
+    slices: int,
+    size: int,
+    modality: str = "CT",
+    study_uid: str = None,
+    orientation: Sequence[float] = AXIAL,
+    prefix: str = "slice",
+    seed: int = 0,
+) -> List[str]:
+    """Single-frame CT/MR series, one file per slice."""
+    sop_class_uid = CT_IMAGE_STORAGE if modality == "CT" else MR_IMAGE_STORAGE
+    study_uid = study_uid or generate_uid()
+    series_uid = generate_uid()
+    normal = np.cross(orientation[:3], orientation[3:])
+    paths = []
+    for index in range(slices):
+        pixels = get_pixels(size, size, seed=seed + index)
+        ds = new_dataset(sop_class_uid, pixels, study_uid, series_uid, modality, index + 1)
+        set_plane(ds, orientation, normal * 2.0 * index + np.array([-100.0, -120.0, 50.0]))
+        paths.append(save(ds, join(dir_path, f"{prefix}_{index:04d}.dcm")))
+    return paths
+
+
+def write_multiframe(
+    path: str,
+    frames: int,
+    size: int,
+    compressed: bool = False,
+    enhanced: bool = False,
+    study_uid: str = None,
+    series_uid: str = None,
+    seed: int = 0,
+) -> str:
+    """Multi-frame file, enhanced CT with functional groups or a plain multi-frame file."""
+    pixels = get_pixels(size, size, frames, seed=seed)
+    sop_class_uid = ENHANCED_CT_IMAGE_STORAGE if enhanced else MULTIFRAME_SC_STORAGE
+    ds = new_dataset(sop_class_uid, pixels, study_uid, series_uid, "CT" if enhanced else "OT")
+    if enhanced:
+        positions = [(-100.0, -120.0, 2.0 * frame) for frame in range(frames)]
+        set_functional_groups(ds, AXIAL, positions)
+    if compressed:
+        compress(ds)
+    return save(ds, path)
+
+
+def write_pillow_encoded(path: str, frames: int, size: int, transfer_syntax: str) -> str:
+    """Multi-frame file with frames encoded by Pillow: 8-bit JPEG Baseline or 16-bit
+    JPEG 2000 Lossless."""
+    pixels = get_pixels(size, size, frames).astype(np.int32) + 1024
+    if transfer_syntax == JPEGBaseline8Bit:
+        pixels = (pixels // 16).astype(np.uint8)
+        image_format, options = "JPEG", {"quality": 90}
+    elif transfer_syntax == JPEG2000Lossless:
+        pixels = pixels.astype(np.uint16)
+        image_format, options = "JPEG2000", {"irreversible": False}
+    else:
+        raise ValueError(f"Pillow can't encode transfer syntax {transfer_syntax}")
+    encoded = []
+    for frame in pixels:
+        buffer = io.BytesIO()
+        Image.fromarray(frame).save(buffer, format=image_format, **options)
+        encoded.append(buffer.getvalue())
+
+    ds = new_dataset(MULTIFRAME_SC_STORAGE, pixels.astype(np.int16), modality="OT")
+    ds.file_meta.TransferSyntaxUID = transfer_syntax
+    bits = pixels.dtype.itemsize * 8
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = bits, bits, bits - 1
+    ds.PixelRepresentation = 0
+    ds.PixelData = encapsulate(encoded)
+    ds["PixelData"].VR = "OB"
+    ds["PixelData"].is_undefined_length = True
+    return save(ds, path)
+
+
+def write_annotation(image_path: str, ann_dir: str, size: int, tag_name: str) -> str:
+    """Supervisely format annotation with a single image tag."""
+    ann = {
+        "description": "",
+        "size": {"height": size, "width": size},
+        "tags": [{"name": tag_name, "value": None}],
+        "objects": [],
+    }
+    ann_path = join(ann_dir, f"{os.path.basename(image_path)}.json")
+    os.makedirs(ann_dir, exist_ok=True)
+    with open(ann_path, "w") as file:
+        json.dump(ann, file)
+    return ann_path
+
+
+def write_sly_project(project_dir: str, datasets: int, slices: int, size: int) -> str:
+    """Supervisely format project: `meta.json` and datasets with `img` and `ann` directories."""
+    tag_name = "reviewed"
+    meta = {"classes": [], "tags": [{"name": tag_name, "value_type": "none", "color": "#FF0000"}]}
+    os.makedirs(project_dir, exist_ok=True)
+    with open(join(project_dir, "meta.json"), "w") as file:
+        json.dump(meta, file)
+    for index in range(datasets):
+        dataset_dir = join(project_dir, f"ds{index}")
+        paths = write_series(join(dataset_dir, "img"), slices, size, seed=index * slices)
+        for path in paths:
+            write_annotation(path, join(dataset_dir, "ann"), size, tag_name)
+    return project_dir
+
+
+def generate_corpus(output_dir: str, profile: str = "small") -> dict:
+    """Writes the corpora of the profile, returns their directories by kind.
+
+    - "studies": datasets of single-frame CT and MR series
+    - "multiframe": large multi-frame files, uncompressed and RLE compressed
+    - "sly_project": Supervisely format project with annotations
+    """
+    series, slices, size, mf_files, frames, frame_size = PROFILES[profile]
+    studies_dir = join(output_dir, "studies")
+    for index in range(series):
+        modality = "CT" if index % 2 == 0 else "MR"
+        dataset_dir = join(studies_dir, f"{modality.lower()}_{index}")
+        write_series(dataset_dir, slices, size, modality, seed=index * slices)
+
+    multiframe_dir = join(output_dir, "multiframe")
+    for index in range(mf_files):
+        dataset_dir = join(multiframe_dir, "frames")
+        write_multiframe(join(dataset_dir, f"raw_{index}.dcm"), frames, frame_size, seed=index)
+        write_multiframe(
+            join(dataset_dir, f"rle_{index}.dcm"), frames, frame_size, compressed=True, seed=index
+        )
+    write_multiframe(
+        join(multiframe_dir, "enhanced", "enhanced_ct.dcm"), frames, frame_size, enhanced=True
+    )
+
+    sly_project_dir = write_sly_project(join(output_dir, "sly_project"), 2, slices, size)
+    return {"studies": studies_dir, "multiframe": multiframe_dir, "sly_project": sly_project_dir}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output_dir")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="small")
+    args = parser.parse_args()
+    print(json.dumps(generate_corpus(args.output_dir, args.profile), indent=2))
@@ -0,0 +1,115 @@
+"""Frame-by-frame decoding time of every decoder backend on synthetic compressed files.
+
+A multi-frame file is written for every transfer syntax that can be encoded
+without plugins: RLE Lossless with pydicom, JPEG Baseline and JPEG 2000 Lossless
+with Pillow. Every frame is decoded on its own with each backend, the same way
+the converter does it. Backends that are not installed are reported as
+unavailable, the ones that can't decode the transfer syntax as unsupported.
+
+Usage: python benchmarks/decoder_backends.py [--frames 200] [--size 256] [--output FILE]
+"""
+import argparse
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+BENCHMARKS_DIR = dirname(abspath(__file__))
+SRC_DIR = join(dirname(BENCHMARKS_DIR), "src")
+sys.path[:0] = [BENCHMARKS_DIR, SRC_DIR]
+
+import pydicom  # pylint: disable=wrong-import-position
+from pydicom.encaps import generate_pixel_data_frame  # pylint: disable=wrong-import-position
+from pydicom.uid import JPEG2000Lossless, JPEGBaseline8Bit  # pylint: disable=wrong-import-position
+
+from corpus import write_multiframe, write_pillow_encoded  # pylint: disable=wrong-import-position
+from decoding import DECODER_BACKENDS, get_frame_dataset  # pylint: disable=wrong-import-position
+
+MB = 1024 * 1024
+
+
+def get_handler(name: str):
+    """pydicom pixel data handler module of the backend."""
+    return importlib.import_module(f"pydicom.pixel_data_handlers.{name}_handler")
+
+
+def decode_frames(dcm, frames: int, backend: str) -> float:
+    """Decodes every frame with the backend, returns the seconds spent."""
+    start = time.perf_counter()
+    for frame in generate_pixel_data_frame(dcm.PixelData, frames):
+        frame_dcm = get_frame_dataset(dcm, frame)
+        frame_dcm.convert_pixel_data(handler_name=backend)
+        _ = frame_dcm.pixel_array
+    return time.perf_counter() - start
+
+
+def measure_backends(path: str, frames: int) -> dict:
+    dcm = pydicom.dcmread(path)
+    transfer_syntax = dcm.file_meta.TransferSyntaxUID
+    results = {}
+    for backend in DECODER_BACKENDS:
+        handler = get_handler(backend)
+        if not handler.is_available():
+            results[backend] = "unavailable"
+        elif not handler.supports_transfer_syntax(transfer_syntax):
+            results[backend] = "unsupported"
+        else:
+            try:
+                seconds = decode_frames(dcm, frames, backend)
+            except Exception as e:
+                results[backend] = f"failed: {e}"
+                continue
+            results[backend] = {
+                "seconds": round(seconds, 3),
+                "ms_per_frame": round(seconds / frames * 1000, 3),
+                "frames_per_second": round(frames / seconds, 1),
+            }
+    return results
+
+
+def run_benchmark(frames: int, size: int) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="dicom_decoder_backends_")
+    report = {"frames": frames, "size": size, "results": {}}
+    try:
+        paths = {
+            "rle_lossless": write_multiframe(
+                join(work_dir, "rle.dcm"), frames, size, compressed=True
+            ),
+            "jpeg_baseline": write_pillow_encoded(
+                join(work_dir, "jpeg.dcm"), frames, size, JPEGBaseline8Bit
+            ),
+            "jpeg2000_lossless": write_pillow_encoded(
+                join(work_dir, "j2k.dcm"), frames, size, JPEG2000Lossless
+            ),
+        }
+        for name, path in paths.items():
+            report["results"][name] = dict(
+                file_mb=round(os.path.getsize(path) / MB, 1),
+                backends=measure_backends(path, frames),
+            )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--size", type=int, default=256, help="rows and columns of a frame")
+    parser.add_argument("--output", help="JSON report path, printed if not set")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.frames, args.size)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,559 @@
+"""Stand-in for the Supervisely public API used by the benchmarks and tests.
+
+Keeps projects, datasets, images, volumes and annotations in memory, counts requests
+by method and can delay every request to emulate network latency. Only the
+endpoints used by the import are implemented, the others return an empty
+object and are reported in `unknown_methods`. Requests can be made to fail
+with `fail_requests` after `fail_after` successful ones, a failed
+`images.bulk.add` still adds half of the images.
+"""
+import base64
+import email.parser
+import email.policy
+import hashlib
+import io
+import itertools
+import json
+import os
+import tarfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+API_PREFIX = "/public/api/v3/"
+SERVER_VERSION = "6.12.0"
+
+
+class FakeApiError(Exception):
+    def __init__(self, status: int, error: str, details: dict = None):
+        super().__init__(error)
+        self.status = status
+        self.response = {"error": error, "details": details or {}}
+
+
+def get_hash(data: bytes) -> str:
+    """Same as `sly.fs.get_file_hash`."""
+    return base64.b64encode(hashlib.sha256(data).digest()).decode("utf-8")
+
+
+def get_multipart_files(content_type: str, body: bytes) -> List[bytes]:
+    header = f"Content-Type: {content_type}\r\n\r\n".encode("utf-8")
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(header + body)
+    return [part.get_payload(decode=True) for part in message.iter_parts()]
+
+
+class FakeApiState:
+    """In-memory storage of the stand-in server."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self.unknown_methods: Dict[str, int] = {}
+        self.uploaded_bytes = 0
+        self.projects: Dict[int, dict] = {}
+        self.datasets: Dict[int, dict] = {}
+        # volumes are kept with the images, the server removes them as images
+        self.images: Dict[int, dict] = {}
+        # image annotations, volume annotations only have their tags
+        self.annotations: Dict[int, dict] = {}
+        self.volume_slices: Dict[int, int] = {}  # volume id: number of uploaded slices
+        self.files: Dict[str, bytes] = {}  # Team Files path: content
+        self.downloaded_bytes = 0
+        self.hashes: Dict[str, int] = {}  # uploaded image hashes: size
+        self.metas: Dict[int, dict] = {}
+        # method: number of the next requests to fail
+        self.fail_requests: Dict[str, int] = {}
+        # method: number of successful requests before the failures
+        self.fail_after: Dict[str, int] = {}
+        self._ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def count(self, method: str) -> None:
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def add_files(self, local_dir: str, remote_dir: str) -> None:
+        """Puts the local directory to Team Files."""
+        for root, _, names in os.walk(local_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                remote_path = os.path.join(remote_dir, os.path.relpath(path, local_dir))
+                with open(path, "rb") as file:
+                    self.files[remote_path] = file.read()
+
+    def should_fail(self, method: str) -> bool:
+        with self.lock:
+            if self.fail_requests.get(method, 0) <= 0:
+                return False
+            if self.fail_after.get(method, 0) > 0:
+                self.fail_after[method] -= 1
+                return False
+            self.fail_requests[method] -= 1
+            return True
+
+    def next_id(self) -> int:
+        with self.lock:
+            return next(self._ids)
+
+    def get_projects(self) -> List[dict]:
+        """Projects with their settings and tag metas, image names and annotations by dataset."""
+        with self.lock:
+            projects = []
+            for project in self.projects.values():
+                datasets = {}
+                for dataset in self.datasets.values():
+                    if dataset["projectId"] == project["id"]:
+                        datasets[dataset["name"]] = {
+                            image["name"]: self.annotations.get(image["id"])
+                            for image in self.images.values()
+                            if image["datasetId"] == dataset["id"]
+                        }
+                projects.append(
+                    {
+                        "name": project["name"],
+                        "type": project["type"],
+                        "settings": project["settings"],
+                        "meta": self.metas[project["id"]],
+                        "datasets": datasets,
+                    }
+                )
+            return projects
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                "api_calls": dict(sorted(self.calls.items())),
+                "api_calls_total": sum(self.calls.values()),
+                "unknown_methods": dict(sorted(self.unknown_methods.items())),
+                "uploaded_bytes": self.uploaded_bytes,
+                "downloaded_bytes": self.downloaded_bytes,
+                "images": len(self.images),
+                "annotations": len(self.annotations),
+            }
+
+
+def get_info(**fields) -> dict:
+    now = "2024-01-01T00:00:00.000Z"
+    info = {"description": "", "createdAt": now, "updatedAt": now, "size": 0}
+    info.update(fields)
+    return info
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """Implements the Supervisely API endpoints the import uses."""
+
+    server: "FakeApiServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self._handle()
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self._handle()
+
+    def _handle(self):
+        state = self.server.state
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length > 0 else b""
+        if not self.path.startswith(API_PREFIX):
+            return self._send({"error": "not found"}, 404)
+        method = self.path[len(API_PREFIX) :].split("?")[0]
+        state.count(method)
+        if state.latency > 0:
+            time.sleep(state.latency)
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/"):
+            data = get_multipart_files(content_type, body)
+        else:
+            data = json.loads(body) if body else {}
+        # a failed images.bulk.add adds a part of the images first, see the handler
+        if method != "images.bulk.add" and state.should_fail(method):
+            return self._send({"error": f"Failed to process '{method}'", "details": {}}, 400)
+        handler = getattr(self, "api_" + method.replace(".", "_").replace("-", "_"), None)
+        if handler is None:
+            with state.lock:
+                state.unknown_methods[method] = state.unknown_methods.get(method, 0) + 1
+            return self._send({})
+        try:
+            response = handler(state, data)
+        except KeyError as e:
+            return self._send({"error": f"{repr(e)} is not found", "details": {}}, 404)
+        except FakeApiError as e:
+            return self._send(e.response, e.status)
+        self._send(response)
+
+    def _send(self, response, status: int = 200):
+        if isinstance(response, bytes):
+            payload, content_type = response, "application/octet-stream"
+        else:
+            payload, content_type = json.dumps(response).encode("utf-8"), "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # instance
+    def api_instance_version(self, state: FakeApiState, data: dict):
+        return {"version": SERVER_VERSION}
+
+    # projects
+    def api_projects_list(self, state: FakeApiState, data: dict):
+        projects = [
+            project
+            for project in state.projects.values()
+            if project["workspaceId"] == data.get("workspaceId", project["workspaceId"])
+        ]
+        return get_page(projects, data)
+
+    def api_projects_add(self, state: FakeApiState, data: dict):
+        project_id = state.next_id()
+        state.projects[project_id] = get_info(
+            id=project_id,
+            name=data["name"],
+            workspaceId=data.get("workspaceId"),
+            type=data.get("type", "images"),
+            imagesCount=0,
+            itemsCount=0,
+            datasetsCount=0,
+            teamId=1,
+            settings={},
+            customData={},
+        )
+        state.metas[project_id] = {"classes": [], "tags": []}
+        return state.projects[project_id]
+
+    def api_projects_info(self, state: FakeApiState, data: dict):
+        project = state.projects[data["id"]]
+        project["datasetsCount"] = sum(
+            1 for dataset in state.datasets.values() if dataset["projectId"] == project["id"]
+        )
+        return project
+
+    def api_projects_meta(self, state: FakeApiState, data: dict):
+        return state.metas[data["id"]]
+
+    def api_projects_meta_update(self, state: FakeApiState, data: dict):
+        meta = data["meta"]
+        # tag metas keep their ids, the new ones get an id
+        tag_ids = {tag["name"]: tag["id"] for tag in state.metas[data["id"]]["tags"]}
+        for tag in meta.get("tags", []):
+            tag["id"] = tag_ids.get(tag["name"]) or state.next_id()
+        state.metas[data["id"]] = meta
+        return {"success": True}
+
+    def api_projects_settings_update(self, state: FakeApiState, data: dict):
+        state.projects[data["id"]]["settings"].update(data.get("settings", {}))
+        return {"success": True}
+
+    def api_projects_remove(self, state: FakeApiState, data: dict):
+        state.projects.pop(data["id"], None)
+        return {"success": True}
+
+    # datasets
+    def api_datasets_list(self, state: FakeApiState, data: dict):
+        datasets = [
+            dataset
+            for dataset in state.datasets.values()
+            if dataset["projectId"] == data.get("projectId")
+        ]
+        return get_page(datasets, data)
+
+    def api_datasets_add(self, state: FakeApiState, data: dict):
+        dataset_id = state.next_id()
+        project = state.projects[data["projectId"]]
+        state.datasets[dataset_id] = get_info(
+            id=dataset_id,
+            name=data["name"],
+            projectId=project["id"],
+            imagesCount=0,
+            itemsCount=0,
+            teamId=1,
+            workspaceId=project["workspaceId"],
+            parentId=data.get("parentId"),
+        )
+        return state.datasets[dataset_id]
+
+    def api_datasets_info(self, state: FakeApiState, data: dict):
+        return state.datasets[data["id"]]
+
+    def api_datasets_remove(self, state: FakeApiState, data: dict):
+        state.datasets.pop(data["id"], None)
+        return {"success": True}
+
+    # images
+    def api_images_list(self, state: FakeApiState, data: dict):
+        images = [
+            image for image in state.images.values() if image["datasetId"] == data.get("datasetId")
+        ]
+        return get_page(images, data)
+
+    def api_images_info(self, state: FakeApiState, data: dict):
+        return state.images[data["id"]]
+
+    def api_images_internal_hashes_list(self, state: FakeApiState, data: List[str]):
+        with state.lock:
+            return [image_hash for image_hash in data if image_hash in state.hashes]
+
+    def api_images_bulk_upload(self, state: FakeApiState, data: List[bytes]):
+        results = []
+        with state.lock:
+            for content in data:
+                image_hash = get_hash(content)
+                state.hashes[image_hash] = len(content)
+                state.uploaded_bytes += len(content)
+                results.append({"hash": image_hash})
+        return results
+
+    def api_images_bulk_add(self, state: FakeApiState, data: dict):
+        dataset = state.datasets[data["datasetId"]]
+        images = data["images"]
+        with state.lock:
+            names = {
+                image["name"]: image["id"]
+                for image in state.images.values()
+                if image["datasetId"] == dataset["id"]
+            }
+        errors = [
+            {"name": image["title"], "id": names[image["title"]]}
+            for image in images
+            if image["title"] in names
+        ]
+        if len(errors) > 0:
+            details = {"type": "NONUNIQUE", "errors": errors}
+            raise FakeApiError(400, "Image names are not unique", details)
+        failed = state.should_fail("images.bulk.add")
+        if failed:
+            images = images[: len(images) // 2]
+        infos = []
+        for image in images:
+            image_id = state.next_id()
+            image_hash = image.get("hash")
+            info = get_info(
+                id=image_id,
+                name=image["title"],
+                link=None,
+                hash=image_hash,
+                mime="image/nrrd",
+                ext="nrrd",
+                size=state.hashes.get(image_hash, 0),
+                width=None,
+                height=None,
+                labelsCount=0,
+                datasetId=dataset["id"],
+                meta=image.get("meta", {}),
+                pathOriginal=None,
+                fullStorageUrl=None,
+                tags=[],
+            )
+            with state.lock:
+                state.images[image_id] = info
+                dataset["imagesCount"] += 1
+                dataset["itemsCount"] += 1
+            infos.append(info)
+        if failed:
+            raise FakeApiError(400, "Failed to add images")
+        return infos
+
+    def api_images_bulk_remove(self, state: FakeApiState, data: dict):
+        for image_id in data.get("imageIds", []):
+            with state.lock:
+                image = state.images.pop(image_id, None)
+                state.annotations.pop(image_id, None)
+                state.volume_slices.pop(image_id, None)
+                if image is not None:
+                    state.datasets[image["datasetId"]]["imagesCount"] -= 1
+        return {"success": True}
+
+    def api_images_remove(self, state: FakeApiState, data: dict):
+        return self.api_images_bulk_remove(state, {"imageIds": [data["id"]]})
+
+    # volumes
+    def api_volumes_list(self, state: FakeApiState, data: dict):
+        volumes = [
+            image
+            for image in state.images.values()
+            if image["datasetId"] == data.get("datasetId") and image["id"] in state.volume_slices
+        ]
+        return get_page(volumes, data)
+
+    def api_volumes_info(self, state: FakeApiState, data: dict):
+        return state.images[data["id"]]
+
+    def api_volumes_bulk_add(self, state: FakeApiState, data: dict):
+        dataset = state.datasets[data["datasetId"]]
+        infos = []
+        for volume in data["volumes"]:
+            volume_id = state.next_id()
+            info = get_info(
+                id=volume_id,
+                name=volume["name"],
+                link=None,
+                hash=volume["hash"],
+                mime="application/octet-stream",
+                ext="nrrd",
+                fileMeta={"size": state.hashes.get(volume["hash"], 0)},
+                meta=volume.get("meta", {}),
+                teamId=1,
+                workspaceId=dataset["workspaceId"],
+                projectId=dataset["projectId"],
+                datasetId=dataset["id"],
+                figuresCount=0,
+                annotationObjectsCount=0,
+            )
+            with state.lock:
+                state.images[volume_id] = info
+                state.volume_slices[volume_id] = 0
+                dataset["imagesCount"] += 1
+                dataset["itemsCount"] += 1
+            infos.append(info)
+        return infos
+
+    def api_volumes_slices_bulk_add(self, state: FakeApiState, data: dict):
+        with state.lock:
+            state.volume_slices[data["volumeId"]] += len(data["volumeSlices"])
+        return [{"success": True} for _ in data["volumeSlices"]]
+
+    def api_volumes_tags_bulk_add(self, state: FakeApiState, data: dict):
+        volume = state.images[data["entityId"]]
+        tag_names = {tag["id"]: tag["name"] for tag in state.metas[volume["projectId"]]["tags"]}
+        tags = [
+            {"name": tag_names[tag["tagId"]], "value": tag.get("value"), "id": state.next_id()}
+            for tag in data["tags"]
+        ]
+        with state.lock:
+            state.annotations.setdefault(volume["id"], {"tags": []})["tags"].extend(tags)
+        return [{"id": tag["id"]} for tag in tags]
+
+    # tag metas
+    def api_tags_list(self, state: FakeApiState, data: dict):
+        project_id = data["projectId"]
+        tags = [
+            get_info(id=tag["id"], projectId=project_id, name=tag["name"], settings={}, color="")
+            for tag in state.metas[project_id]["tags"]
+        ]
+        return get_page(tags, data)
+
+    # annotations
+    def api_annotations_bulk_add(self, state: FakeApiState, data: dict):
+        with state.lock:
+            for item in data["annotations"]:
+                state.annotations[item["imageId"]] = item["annotation"]
+        return {"success": True}
+
+    # tasks and files
+    def api_tasks_output_set(self, state: FakeApiState, data: dict):
+        return {"success": True}
+
+    def api_file_storage_list(self, state: FakeApiState, data: dict):
+        path, recursive = data["path"], data.get("recursive", True)
+        infos = []
+        for file_path, content in sorted(state.files.items()):
+            if not file_path.startswith(path):
+                continue
+            if not recursive and "/" in file_path[len(path) :].strip("/"):
+                continue
+            infos.append(get_file_info(file_path, content))
+        return infos
+
+    def api_file_storage_download(self, state: FakeApiState, data: dict):
+        path = data["path"]
+        if not path.endswith("/"):
+            content = state.files[path]
+        else:
+            # directories are downloaded as a tar archive with the directory itself
+            buffer = io.BytesIO()
+            with tarfile.open(fileobj=buffer, mode="w") as archive:
+                for file_path, file_content in state.files.items():
+                    if file_path.startswith(path):
+                        name = os.path.relpath(file_path, os.path.dirname(path.rstrip("/")))
+                        member = tarfile.TarInfo(name)
+                        member.size = len(file_content)
+                        archive.addfile(member, io.BytesIO(file_content))
+            content = buffer.getvalue()
+        with state.lock:
+            state.downloaded_bytes += len(content)
+        return content
+
+    def api_file_storage_upload(self, state: FakeApiState, data: List[bytes]):
+        return {"success": True}
+
+
+def get_file_info(path: str, content: bytes) -> dict:
+    return get_info(
+        teamId=1,
+        id=abs(hash(path)) % 10**9,
+        userId=1,
+        name=os.path.basename(path),
+        hash=get_hash(content),
+        path=path,
+        storagePath=None,
+        meta={
+            "mime": "application/octet-stream",
+            "ext": os.path.splitext(path)[1].lstrip("."),
+            "size": len(content),
+        },
+        fullStorageUrl=None,
+        isDir=False,
+    )
+
+
+def get_page(items: List[dict], data: dict) -> dict:
+    """Single page of the list, only "=" and "in" filters are supported."""
+    for item_filter in data.get("filter", []):
+        field, value = item_filter["field"], item_filter["value"]
+        if item_filter.get("operator") == "=":
+            items = [item for item in items if item.get(field) == value]
+        elif item_filter.get("operator") == "in":
+            items = [item for item in items if item.get(field) in value]
+    return {
+        "total": len(items),
+        "perPage": max(len(items), 1),
+        "pagesCount": 1,
+        "entities": items,
+    }
+
+
+class FakeApiServer(ThreadingHTTPServer):
+    """Runs the stand-in API in a background thread, use as a context manager."""
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0):
+        super().__init__(("127.0.0.1", port), FakeApiHandler)
+        self.state = FakeApiState(latency)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "FakeApiServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8787, help="port to listen on")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to requests")
+    args = parser.parse_args()
+    with FakeApiServer(port=args.port, latency=args.latency) as server:
+        print(f"Stand-in Supervisely API is listening on {server.address}")
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            print(json.dumps(server.state.report(), indent=2))
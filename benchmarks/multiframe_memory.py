@@ -0,0 +1,119 @@
+"""Peak memory of converting a single large multi-frame file.
+
+Every file is converted in a new process after a warm-up conversion of a small file,
+so imports are not counted. Two peaks are reported: the peak RSS increase (Linux),
+which includes the mapped pages of uncompressed pixel data, and the peak of Python
+and numpy allocations traced by tracemalloc. tracemalloc slows numpy code down a lot,
+so allocations are traced in a second conversion that is not timed.
+
+Usage: python benchmarks/multiframe_memory.py [--frames 2000] [--size 256] [--output FILE]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from os.path import abspath, dirname, join
+
+BENCHMARKS_DIR = dirname(abspath(__file__))
+SRC_DIR = join(dirname(BENCHMARKS_DIR), "src")
+sys.path[:0] = [BENCHMARKS_DIR, SRC_DIR]
+
+from converter import ConversionSettings, convert_dicom  # pylint: disable=wrong-import-position
+from corpus import write_multiframe  # pylint: disable=wrong-import-position
+
+MB = 1024 * 1024
+# uncompressed pixel data is memory-mapped, RLE Lossless is decoded frame by frame
+VARIANTS = {"uncompressed": False, "rle": True}
+
+
+def get_status_bytes(name: str) -> int:
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith(f"{name}:"):
+                # the values are in kB
+                return int(line.split()[1]) * 1024
+    raise ValueError(f"{name} is not in the process status")
+
+
+def reset_peak_rss() -> None:
+    """Resets the peak RSS of the process (VmHWM) to the current RSS, importing the
+    app takes more memory than the conversion."""
+    with open("/proc/self/clear_refs", "w") as file:
+        file.write("5")
+
+
+def measure_conversion(path: str, warmup_path: str) -> dict:
+    """Converts the file in this process, returns the time and the peak memory increase."""
+    settings = ConversionSettings(group_tag_name="StudyInstanceUID", nrrd_encoding="raw")
+    convert_dicom(warmup_path, settings)
+    reset_peak_rss()
+    rss_before = get_status_bytes("VmRSS")
+    start = time.perf_counter()
+    result = convert_dicom(path, settings)
+    seconds = time.perf_counter() - start
+    peak_rss = get_status_bytes("VmHWM")
+
+    tracemalloc.start()
+    convert_dicom(path, settings)
+    _, peak_alloc = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "images": len(result.paths),
+        "seconds": round(seconds, 3),
+        "peak_rss_mb": round(max(peak_rss - rss_before, 0) / MB, 1),
+        "peak_alloc_mb": round(peak_alloc / MB, 1),
+    }
+
+
+def run_benchmark(frames: int, size: int) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="dicom_multiframe_memory_")
+    frame_bytes = size * size * 2
+    report = {
+        "frames": frames,
+        "frame_mb": round(frame_bytes / MB, 3),
+        "volume_mb": round(frames * frame_bytes / MB, 1),
+        "results": {},
+    }
+    try:
+        for name, compressed in VARIANTS.items():
+            path = write_multiframe(join(work_dir, name, f"{name}.dcm"), frames, size, compressed)
+            warmup_path = write_multiframe(
+                join(work_dir, "warmup", f"{name}.dcm"), 2, 16, compressed
+            )
+            file_mb = os.path.getsize(path) / MB
+            with multiprocessing.get_context("spawn").Pool(1) as pool:
+                result = pool.apply(measure_conversion, (path, warmup_path))
+            result["file_mb"] = round(file_mb, 1)
+            result["peak_alloc_volumes"] = round(
+                result["peak_alloc_mb"] / report["volume_mb"], 2
+            )
+            report["results"][name] = result
+            shutil.rmtree(join(work_dir, name))
+            shutil.rmtree(join(work_dir, "warmup"))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=256, help="rows and columns of a frame")
+    parser.add_argument("--output", help="JSON report path, printed if not set")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.frames, args.size)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Conversion throughput and uploaded bytes for every NRRD encoding setting.
+
+Imports the same corpus once per setting with run_import.py and reports the
+import throughput, the NRRD write time and the bytes uploaded to the stand-in API,
+to trade CPU for network per deployment.
+
+Usage: python benchmarks/nrrd_encoding.py [--corpus DIR] [--kind studies] [--profile small]
+           [--latency 0.01] [--env CONVERT_WORKERS=4] [--output FILE]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, dirname(abspath(__file__)))
+
+from corpus import generate_corpus  # pylint: disable=wrong-import-position
+from run_import import run_import  # pylint: disable=wrong-import-position
+
+# (NRRD_ENCODING, NRRD_COMPRESSION_LEVEL), the level is used by gzip and bzip2 only
+SETTINGS = (("raw", None), ("gzip", 1), ("gzip", 6), ("gzip", 9), ("bzip2", 1), ("bzip2", 9))
+
+
+def run_benchmark(input_dir: str, env: dict, latency: float) -> list:
+    results = []
+    for encoding, level in SETTINGS:
+        setting_env = dict(env, NRRD_ENCODING=encoding)
+        if level is not None:
+            setting_env["NRRD_COMPRESSION_LEVEL"] = str(level)
+        report = run_import(input_dir, setting_env, latency=latency)
+        write_stage = report["stages"].get("nrrd_write", {})
+        results.append(
+            {
+                "encoding": encoding,
+                "compression_level": level,
+                "wall_seconds": report["wall_seconds"],
+                "files_per_second": report["files_per_second"],
+                "mb_per_second": report["mb_per_second"],
+                "nrrd_write_seconds": write_stage.get("seconds"),
+                "uploaded_mb": report["uploaded_mb"],
+                "uploaded_images": report["uploaded_images"],
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="corpus directory, generated if it does not exist")
+    parser.add_argument(
+        "--kind", choices=("studies", "multiframe", "sly_project"), default="studies"
+    )
+    parser.add_argument("--profile", default="small", help="profile of the generated corpus")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to requests")
+    parser.add_argument("--env", action="append", default=[], help="app setting, KEY=VALUE")
+    parser.add_argument("--output", help="JSON report path, printed if not set")
+    args = parser.parse_args()
+
+    corpus_dir = args.corpus or join(tempfile.gettempdir(), f"dicom_corpus_{args.profile}")
+    if not os.path.isdir(join(corpus_dir, args.kind)):
+        generate_corpus(corpus_dir, args.profile)
+    env = dict(item.split("=", 1) for item in args.env)
+    if args.kind == "sly_project":
+        env.setdefault("modal.state.withAnns", "true")
+
+    report = {
+        "kind": args.kind,
+        "profile": args.profile,
+        "latency": args.latency,
+        "env": env,
+        "results": run_benchmark(join(corpus_dir, args.kind), env, args.latency),
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
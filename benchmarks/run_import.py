@@ -0,0 +1,269 @@
+"""Runs the whole `import_dicom_studies` flow against the stand-in API.
+
+The corpus (see corpus.py) is imported as a local project directory or from
+the Team Files of the stand-in server as a folder or a zip archive, the images
+are uploaded to the stand-in server. Prints a JSON report with throughput,
+peak RSS, stage timings and API calls.
+
+Usage: python benchmarks/run_import.py [--corpus DIR] [--kind studies] [--profile small]
+           [--source local|folder|archive] [--latency 0.01] [--fail images.bulk.add=1]
+           [--reimport | --resume] [--projects]
+           [--env CONVERT_WORKERS=4 --env NRRD_ENCODING=raw] [--output FILE]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+BENCHMARKS_DIR = dirname(abspath(__file__))
+SRC_DIR = join(dirname(BENCHMARKS_DIR), "src")
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from corpus import generate_corpus  # pylint: disable=wrong-import-position
+from fake_server import FakeApiServer  # pylint: disable=wrong-import-position
+
+TASK_ID = 1
+TEAM_ID = 1
+WORKSPACE_ID = 1
+TEAM_FILES_DIR = "/import/"
+SOURCES = ("local", "folder", "archive")
+
+# modal window state of a directory import with default options
+DEFAULT_ENV = {
+    "ENV": "production",
+    "LOG_LEVEL": "warning",
+    "TASK_ID": str(TASK_ID),
+    "CONTEXT_TEAMID": str(TEAM_ID),
+    "CONTEXT_WORKSPACEID": str(WORKSPACE_ID),
+    "API_TOKEN": "0" * 128,
+    "AGENT_TOKEN": "0" * 128,
+    "modal.state.tagMode": "prepared",
+    "modal.state.predefinedGroupTag": "StudyInstanceUID",
+    "modal.state.manualGroupTag": "",
+    "modal.state.addTagsFromDcm": "All tags",
+    "modal.state.dcmTags": "",
+    "modal.state.withAnns": "false",
+}
+
+
+def get_dir_stats(path: str) -> dict:
+    files = [join(root, name) for root, _, names in os.walk(path) for name in names]
+    dicom_files = [file for file in files if not file.endswith(".json")]
+    return {
+        "files": len(dicom_files),
+        "bytes": sum(os.path.getsize(file) for file in dicom_files),
+    }
+
+
+def get_source_env(server: FakeApiServer, input_dir: str, source: str, work_dir: str) -> dict:
+    """Puts the input where the import takes it from, returns the input settings."""
+    name = os.path.basename(os.path.normpath(input_dir))
+    if source == "local":
+        # local input is converted in place
+        project_dir = join(work_dir, "input", name)
+        shutil.copytree(input_dir, project_dir)
+        return {"LOCAL_INPUT_DIR": project_dir}
+    if source == "folder":
+        server.state.add_files(input_dir, join(TEAM_FILES_DIR, name))
+        return {"modal.state.slyFolder": join(TEAM_FILES_DIR, name, "")}
+    archive_dir = join(work_dir, "archive")
+    shutil.copytree(input_dir, join(archive_dir, name))
+    shutil.make_archive(join(work_dir, name), "zip", archive_dir)
+    server.state.add_files(work_dir, TEAM_FILES_DIR.rstrip("/"))
+    return {"modal.state.slyFile": join(TEAM_FILES_DIR, f"{name}.zip")}
+
+
+def import_in_process(env: dict, report_path: str) -> None:
+    """Runs the import, the app globals are read from `env` when sly_globals is imported."""
+    os.environ.update(env)
+    sys.path.insert(0, SRC_DIR)
+    import main  # pylint: disable=import-outside-toplevel
+    import sly_globals as g  # pylint: disable=import-outside-toplevel
+
+    start = time.perf_counter()
+    main.import_dicom_studies(
+        api=g.api, task_id=TASK_ID, context={}, state={}, app_logger=g.my_app.logger
+    )
+    report = dict(g.metrics.report(), wall_seconds=time.perf_counter() - start)
+    if g.conversion_cache is not None:
+        report["conversion_cache"] = {
+            "hits": g.conversion_cache.hits,
+            "misses": g.conversion_cache.misses,
+        }
+    with open(report_path, "w") as file:
+        json.dump(report, file)
+
+
+def run_import(
+    input_dir: str,
+    env: dict,
+    latency: float = 0.0,
+    source: str = "local",
+    fail_requests: dict = None,
+    reimport: bool = False,
+    projects: bool = False,
+    fail_after: dict = None,
+    resume: bool = False,
+) -> dict:
+    """Imports the directory in a new process and returns the report.
+
+    With `reimport` the directory is imported again into the project of the first
+    import, timings are reported for the second import and server counters for both.
+    With `resume` the first import is interrupted by the failed requests and the second
+    one resumes it, the server counters after the interrupted import are in `interrupted`.
+    With `projects` the report has the projects on the stand-in server, see
+    `FakeApiState.get_projects`.
+    """
+    work_dir = tempfile.mkdtemp(prefix="dicom_import_benchmark_")
+    stats = get_dir_stats(input_dir)
+    report_path = join(work_dir, "metrics.json")
+    interrupted = None
+
+    with FakeApiServer(latency=latency) as server:
+        server.state.fail_requests.update(fail_requests or {})
+        server.state.fail_after.update(fail_after or {})
+        for run in range(2 if reimport or resume else 1):
+            run_dir = join(work_dir, f"run_{run}")
+            run_env = dict(
+                DEFAULT_ENV,
+                SERVER_ADDRESS=server.address,
+                DEBUG_APP_DIR=join(run_dir, "app_data"),
+                # the app cache directory of the agent is kept between tasks
+                DEBUG_CACHE_DIR=join(work_dir, "app_cache"),
+            )
+            run_env.update(get_source_env(server, input_dir, source, join(run_dir, "source")))
+            if run > 0 and reimport:
+                run_env["TARGET_PROJECT_ID"] = str(max(server.state.projects))
+            run_env.update(env)
+            # the app reads its settings on import, every import needs a new process
+            process = multiprocessing.get_context("spawn").Process(
+                target=import_in_process, args=(run_env, report_path)
+            )
+            process.start()
+            process.join()
+            if resume and run == 0:
+                if process.exitcode == 0:
+                    raise RuntimeError("Import was not interrupted by the failed requests")
+                interrupted = server.state.report()
+                server.state.fail_requests.clear()
+            elif process.exitcode != 0:
+                raise RuntimeError(f"Import failed with exit code {process.exitcode}")
+        server_report = server.state.report()
+        if projects:
+            server_report["projects"] = server.state.get_projects()
+
+    with open(report_path) as file:
+        metrics = json.load(file)
+    wall_seconds = metrics["wall_seconds"]
+    shutil.rmtree(work_dir, ignore_errors=True)
+    report = {
+        "input_files": stats["files"],
+        "input_mb": round(stats["bytes"] / 1024 / 1024, 3),
+        "wall_seconds": round(wall_seconds, 3),
+        "files_per_second": round(stats["files"] / wall_seconds, 3),
+        "mb_per_second": round(stats["bytes"] / 1024 / 1024 / wall_seconds, 3),
+        "peak_rss_mb": metrics["peak_rss_mb"],
+        "uploaded_images": server_report["images"],
+        "uploaded_annotations": server_report["annotations"],
+        "uploaded_mb": round(server_report["uploaded_bytes"] / 1024 / 1024, 3),
+        "downloaded_mb": round(server_report["downloaded_bytes"] / 1024 / 1024, 3),
+        "api_calls": server_report["api_calls"],
+        "api_calls_total": server_report["api_calls_total"],
+        "unknown_api_methods": server_report["unknown_methods"],
+        "stages": metrics["stages"],
+        "conversion_cache": metrics.get("conversion_cache"),
+    }
+    if projects:
+        report["projects"] = server_report["projects"]
+    if interrupted is not None:
+        report["interrupted"] = {
+            "images": interrupted["images"],
+            "annotations": interrupted["annotations"],
+            "api_calls": interrupted["api_calls"],
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="corpus directory, generated if it does not exist")
+    parser.add_argument(
+        "--kind", choices=("studies", "multiframe", "sly_project"), default="studies"
+    )
+    parser.add_argument("--profile", default="small", help="profile of the generated corpus")
+    parser.add_argument("--source", choices=SOURCES, default="local", help="where the input is")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to requests")
+    parser.add_argument("--env", action="append", default=[], help="app setting, KEY=VALUE")
+    parser.add_argument(
+        "--fail",
+        action="append",
+        default=[],
+        help="requests to fail, METHOD=COUNT or METHOD=COUNT@AFTER to let AFTER requests pass",
+    )
+    parser.add_argument(
+        "--reimport",
+        action="store_true",
+        help="import the corpus again into the same project and report the second import",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="interrupt the import with the failed requests and report the resumed import",
+    )
+    parser.add_argument(
+        "--projects",
+        action="store_true",
+        help="report datasets, images and annotations of the projects on the stand-in server",
+    )
+    parser.add_argument("--output", help="JSON report path, printed if not set")
+    args = parser.parse_args()
+
+    corpus_dir = args.corpus or join(tempfile.gettempdir(), f"dicom_corpus_{args.profile}")
+    if not os.path.isdir(join(corpus_dir, args.kind)):
+        generate_corpus(corpus_dir, args.profile)
+    env = dict(item.split("=", 1) for item in args.env)
+    fail_requests, fail_after = {}, {}
+    for item in args.fail:
+        method, count = item.split("=")
+        count, _, after = count.partition("@")
+        fail_requests[method] = int(count)
+        fail_after[method] = int(after or 0)
+    if args.kind == "sly_project":
+        env.setdefault("modal.state.withAnns", "true")
+
+    report = {
+        "kind": args.kind,
+        "profile": args.profile,
+        "source": args.source,
+        "latency": args.latency,
+        "env": env,
+        "reimport": args.reimport,
+        "resume": args.resume,
+    }
+    report.update(
+        run_import(
+            join(corpus_dir, args.kind),
+            env,
+            args.latency,
+            args.source,
+            fail_requests,
+            args.reimport,
+            args.projects,
+            fail_after,
+            args.resume,
+        )
+    )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
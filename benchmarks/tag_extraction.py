@@ -0,0 +1,116 @@
+"""Per-file metadata extraction time on large multi-frame files.
+
+Compares extract_dcm_tags on a file read with deferred pixel data to the previous
+extraction, which read the whole file and converted every element to a string,
+PixelData and the per-frame functional groups included.
+
+Usage: python benchmarks/tag_extraction.py [--frames 2000] [--size 256] [--repeat 3]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+BENCHMARKS_DIR = dirname(abspath(__file__))
+SRC_DIR = join(dirname(BENCHMARKS_DIR), "src")
+sys.path[:0] = [BENCHMARKS_DIR, SRC_DIR]
+
+import pydicom  # pylint: disable=wrong-import-position
+import supervisely as sly  # pylint: disable=wrong-import-position
+
+from converter import (  # pylint: disable=wrong-import-position
+    MAX_TAG_VALUE_LENGTH,
+    PIXEL_DATA_DEFER_SIZE,
+    ConversionSettings,
+    extract_dcm_tags,
+)
+from corpus import write_multiframe  # pylint: disable=wrong-import-position
+
+MB = 1024 * 1024
+# (compressed, enhanced): enhanced files carry a functional groups item per frame
+VARIANTS = {
+    "multiframe": (False, False),
+    "multiframe_rle": (True, False),
+    "enhanced": (False, True),
+}
+
+
+def extract_all_tags_as_strings(path: str) -> dict:
+    """The previous extraction: every element is read and converted to a string."""
+    dcm = pydicom.dcmread(path)
+    tags = {}
+    for dcm_tag in list(dcm.keys()):
+        element = dcm[dcm_tag]
+        value = str(element.value)
+        if value and len(value) <= MAX_TAG_VALUE_LENGTH:
+            tags[str(element.name)] = value
+    return tags
+
+
+def extract_tags(path: str) -> dict:
+    settings = ConversionSettings(
+        group_tag_name="StudyInstanceUID", extract_tags=True, add_all_tags=True
+    )
+    dcm = pydicom.dcmread(path, defer_size=PIXEL_DATA_DEFER_SIZE)
+    _, tags = extract_dcm_tags(dcm, settings)
+    return tags
+
+
+def measure(func, path: str, repeat: int) -> dict:
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tags = func(path)
+        seconds.append(time.perf_counter() - start)
+    return {"seconds": round(min(seconds), 4), "tags": len(tags)}
+
+
+def run_benchmark(frames: int, size: int, repeat: int) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="dicom_tag_extraction_")
+    report = {"frames": frames, "size": size, "results": {}}
+    try:
+        for name, (compressed, enhanced) in VARIANTS.items():
+            path = write_multiframe(
+                join(work_dir, f"{name}.dcm"), frames, size, compressed, enhanced=enhanced
+            )
+            current = measure(extract_tags, path, repeat)
+            previous = measure(extract_all_tags_as_strings, path, repeat)
+            report["results"][name] = {
+                "file_mb": round(os.path.getsize(path) / MB, 1),
+                "seconds": current["seconds"],
+                "previous_seconds": previous["seconds"],
+                "speedup": round(previous["seconds"] / max(current["seconds"], 1e-6), 1),
+                "tags": current["tags"],
+                "previous_tags": previous["tags"],
+            }
+            os.remove(path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=256, help="rows and columns of a frame")
+    parser.add_argument("--repeat", type=int, default=3, help="the best time is reported")
+    parser.add_argument("--output", help="JSON report path, printed if not set")
+    args = parser.parse_args()
+
+    # skipped tags are logged one by one
+    sly.logger.setLevel(logging.ERROR)
+    report = run_benchmark(args.frames, args.size, args.repeat)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Upload time with fixed upload batch sizes and with the batch size controller.
+
+Imports the same corpus once per setting with run_import.py, every request to the
+stand-in API is delayed by the latency. Reports the import throughput, the time
+spent in upload requests and the number of upload requests: small fixed batches
+pay the latency on every request, the controller grows batches while requests are fast.
+
+Usage: python benchmarks/upload_batch_size.py [--corpus DIR] [--kind studies] [--profile small]
+           [--latency 0.05] [--env CONVERT_WORKERS=4] [--output FILE]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, dirname(abspath(__file__)))
+
+from corpus import generate_corpus  # pylint: disable=wrong-import-position
+from run_import import run_import  # pylint: disable=wrong-import-position
+
+# (name, UPLOAD_BATCH_IMAGES, fixed), a fixed size is both the lower and the upper limit
+SETTINGS = (("fixed", 5, True), ("fixed", 50, True), ("adaptive", 5, False))
+# converted batches are split into upload requests, they must be larger than the requests
+CONVERT_BATCH_SIZE = 200
+FIXED_BATCH_MB = 512
+
+
+def run_benchmark(input_dir: str, env: dict, latency: float) -> list:
+    results = []
+    for name, images, fixed in SETTINGS:
+        setting_env = {"CONVERT_BATCH_SIZE": str(CONVERT_BATCH_SIZE), **env}
+        setting_env["UPLOAD_BATCH_IMAGES"] = str(images)
+        if fixed:
+            setting_env.update(
+                UPLOAD_BATCH_MIN_IMAGES=str(images),
+                UPLOAD_BATCH_MAX_IMAGES=str(images),
+                UPLOAD_BATCH_MIN_MB=str(FIXED_BATCH_MB),
+                UPLOAD_BATCH_MAX_MB=str(FIXED_BATCH_MB),
+            )
+        report = run_import(input_dir, setting_env, latency=latency)
+        upload_stage = report["stages"].get("image_upload", {})
+        results.append(
+            {
+                "batch_size": name,
+                "initial_images": images,
+                "wall_seconds": report["wall_seconds"],
+                "files_per_second": report["files_per_second"],
+                "image_upload_seconds": upload_stage.get("seconds"),
+                "upload_requests": report["api_calls"].get("images.bulk.upload", 0),
+                "uploaded_images": report["uploaded_images"],
+            }
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", help="corpus directory, generated if it does not exist")
+    parser.add_argument(
+        "--kind", choices=("studies", "multiframe", "sly_project"), default="studies"
+    )
+    parser.add_argument("--profile", default="small", help="profile of the generated corpus")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to requests")
+    parser.add_argument("--env", action="append", default=[], help="app setting, KEY=VALUE")
+    parser.add_argument("--output", help="JSON report path, printed if not set")
+    args = parser.parse_args()
+
+    corpus_dir = args.corpus or join(tempfile.gettempdir(), f"dicom_corpus_{args.profile}")
+    if not os.path.isdir(join(corpus_dir, args.kind)):
+        generate_corpus(corpus_dir, args.profile)
+    env = dict(item.split("=", 1) for item in args.env)
+    if args.kind == "sly_project":
+        env.setdefault("modal.state.withAnns", "true")
+
+    report = {
+        "kind": args.kind,
+        "profile": args.profile,
+        "latency": args.latency,
+        "env": env,
+        "results": run_benchmark(join(corpus_dir, args.kind), env, args.latency),
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tarfile
+import zipfile
+from os.path import dirname, isabs, join, normpath
+from typing import IO, Iterator, NamedTuple, Optional
+
+import supervisely as sly
+from tqdm import tqdm
+
+import sly_globals as g
+from metrics import EXTRACT
+from pipeline import UploadPipeline
+from stream_import import StreamImporter, is_ann_file, is_img_file, is_junk_file, is_meta_file
+
+STREAM_DIR_NAME = "archive_stream"
+
+
+class ArchiveMember(NamedTuple):
+    name: str
+    size: int
+
+
+def safe_member_name(name: str) -> Optional[str]:
+    """Returns normalized member name, None if it points outside of the extraction dir."""
+    name = normpath(name.replace("\\", "/")).lstrip("/")
+    if isabs(name) or name == "." or name.startswith(".."):
+        return None
+    return name
+
+
+class ArchiveReader:
+    """Sequential reader of zip and tar(.gz) archives, members are read one at a time
+    without unpacking the whole archive."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.is_zip = zipfile.is_zipfile(path)
+        if not self.is_zip and not tarfile.is_tarfile(path):
+            raise ValueError(f"Unsupported archive format: '{path}'")
+
+    def iter_members(self) -> Iterator[tuple]:
+        """Yields (ArchiveMember, file object) pairs for regular files in archive order.
+
+        The file object is valid only until the next member is requested.
+        """
+        if self.is_zip:
+            with zipfile.ZipFile(self.path) as archive:
+                for info in archive.infolist():
+                    name = safe_member_name(info.filename)
+                    if info.is_dir() or name is None or is_junk_file(name):
+                        continue
+                    with archive.open(info) as file:
+                        yield ArchiveMember(name, info.file_size), file
+        else:
+            # stream mode: tar(.gz) is decompressed once, front to back
+            with tarfile.open(self.path, mode="r|*") as archive:
+                for info in archive:
+                    name = safe_member_name(info.name)
+                    if not info.isfile() or name is None or is_junk_file(name):
+                        continue
+                    file = archive.extractfile(info)
+                    yield ArchiveMember(name, info.size), file
+
+
+def extract_member(file: IO[bytes], dst_path: str) -> str:
+    os.makedirs(dirname(dst_path), exist_ok=True)
+    with open(dst_path, "wb") as dst:
+        shutil.copyfileobj(file, dst)
+    return dst_path
+
+
+def split_project_name(name: str) -> tuple:
+    """Splits member name into the project directory and the path inside it."""
+    parts = name.split(os.sep, 1)
+    if len(parts) < 2:
+        g.my_app.logger.error("There must be only 1 project directory in the archive")
+        raise Exception("There must be only 1 project directory in the archive")
+    return parts[0], parts[1]
+
+
+class ArchiveImporter(StreamImporter):
+    """Imports the project from the archive without unpacking it.
+
+    Members are extracted one at a time into a working directory and removed as
+    soon as their batch is uploaded.
+    """
+
+    def __init__(self, api: sly.Api, archive_path: str):
+        super().__init__(api, join(g.STORAGE_DIR, STREAM_DIR_NAME))
+        self.reader = ArchiveReader(archive_path)
+
+    def run(self, pipeline: UploadPipeline) -> None:
+        if g.WITH_ANNS:
+            self._extract_sly_format_files()
+
+        progress = tqdm(desc="Processing archive members", unit="file")
+        for member, file in self.reader.iter_members():
+            progress.update(1)
+            project_name, name = split_project_name(member.name)
+            if g.WITH_ANNS and not is_img_file(name):
+                continue
+            self._check_project_name(project_name)
+            path = join(self.work_dir, member.name)
+            if self.is_done(path):
+                continue
+            self.acquire(member.size, pipeline)
+            with g.metrics.measure(EXTRACT, nbytes=member.size):
+                extract_member(file, path)
+            self.add_file(path, member.size, pipeline)
+        self.finish(pipeline)
+        progress.close()
+
+    def _extract_sly_format_files(self) -> None:
+        """Extracts meta.json and annotations, they are small and needed before images."""
+        meta_path = None
+        for member, file in self.reader.iter_members():
+            _, name = split_project_name(member.name)
+            if is_meta_file(name):
+                meta_path = extract_member(file, join(self.work_dir, member.name))
+            elif is_ann_file(name):
+                extract_member(file, join(self.work_dir, member.name))
+        self.load_sly_format_meta(meta_path)
+
+    def _check_project_name(self, project_name: str) -> None:
+        if self.project_name is not None and project_name != self.project_name:
+            g.my_app.logger.error("There must be only 1 project directory in the archive")
+            raise Exception("There must be only 1 project directory in the archive")
+        self.project_name = project_name
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import supervisely as sly
+
+DISCOVERED = "discovered"
+CONVERTED = "converted"
+UPLOADED = "uploaded"
+ANNOTATED = "annotated"
+# files that are not imported on purpose, e.g. duplicates
+SKIPPED = "skipped"
+DONE_STATES = (ANNOTATED, SKIPPED)
+# states only move forward, e.g. a late part of an uploaded file does not undo "annotated"
+STATE_ORDER = {DISCOVERED: 0, CONVERTED: 1, UPLOADED: 2, ANNOTATED: 3, SKIPPED: 3}
+
+
+def get_state_order_sql(column: str) -> str:
+    cases = " ".join(f"WHEN '{state}' THEN {order}" for state, order in STATE_ORDER.items())
+    return f"(CASE {column} {cases} ELSE -1 END)"
+
+
+def get_manifest_path(checkpoint_dir: str, *keys) -> str:
+    """Returns manifest path that is the same for every run of the same import."""
+    digest = hashlib.sha1(json.dumps([str(key) for key in keys]).encode("utf-8")).hexdigest()
+    return os.path.join(checkpoint_dir, f"import_checkpoint_{digest[:16]}.sqlite")
+
+
+class ImportCheckpoint:
+    """Persistent manifest of the import state of every source file.
+
+    Files are keyed by their path relative to the storage directory. A file goes
+    through the states: discovered -> converted -> uploaded (with image ids) ->
+    annotated (or skipped). Resumed imports reuse the project and datasets and
+    skip annotated and skipped files. Deduplication keys of the files are saved
+    as well, copies of the imported instances stay duplicates after the resume.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        if not resume and os.path.exists(path):
+            os.remove(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS datasets (path TEXT PRIMARY KEY, dataset_id INTEGER)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "source TEXT PRIMARY KEY, state TEXT, image_ids TEXT, updated_at REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS instances (source TEXT PRIMARY KEY, key TEXT)"
+            )
+        self._done = {
+            row[0]
+            for row in self._conn.execute(
+                "SELECT source FROM files WHERE state IN (?, ?)", DONE_STATES
+            )
+        }
+        if resume and len(self._done) > 0:
+            sly.logger.info(f"Resuming import, {len(self._done)} files are already imported")
+
+    def get_value(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM info WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_value(self, key: str, value) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO info VALUES (?, ?)", (key, str(value)))
+
+    def get_dataset_id(self, path: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT dataset_id FROM datasets WHERE path = ?", (path,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def set_dataset_id(self, path: str, dataset_id: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO datasets VALUES (?, ?)", (path, dataset_id))
+
+    def is_done(self, source: str) -> bool:
+        return source in self._done
+
+    def mark(self, sources: Iterable[str], state: str) -> None:
+        sources, now = list(sources), time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO files VALUES (?, ?, NULL, ?) ON CONFLICT(source) "
+                "DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at "
+                f"WHERE {get_state_order_sql('excluded.state')} > {get_state_order_sql('state')}",
+                [(source, state, now) for source in sources],
+            )
+            if state in DONE_STATES:
+                self._done.update(sources)
+
+    def mark_uploaded(self, source: str, image_ids: List[int]) -> None:
+        """Adds image ids of the source, images of one source can be uploaded in parts."""
+        with self._lock, self._conn:
+            self._update_image_ids(source, lambda ids: ids + image_ids)
+
+    def discard_image_ids(self, source: str, image_ids: List[int]) -> None:
+        """Forgets ids of the images removed after a failed upload."""
+        with self._lock, self._conn:
+            self._update_image_ids(source, lambda ids: [i for i in ids if i not in image_ids])
+
+    def _update_image_ids(self, source: str, update) -> None:
+        row = self._conn.execute(
+            "SELECT state, image_ids FROM files WHERE source = ?", (source,)
+        ).fetchone()
+        state, image_ids = row if row is not None else (None, None)
+        if STATE_ORDER.get(state, -1) < STATE_ORDER[UPLOADED]:
+            state = UPLOADED
+        image_ids = update(json.loads(image_ids or "[]"))
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (source, state, json.dumps(image_ids), time.time()),
+        )
+
+    def add_instance_keys(self, keys: Dict[str, str]) -> None:
+        """Saves deduplication keys of the sources."""
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO instances VALUES (?, ?)", keys.items())
+
+    def get_imported_instance_keys(self) -> List[str]:
+        """Returns deduplication keys of the sources imported before the import was resumed."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key FROM instances JOIN files USING (source) WHERE state = ?", (ANNOTATED,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def pop_stale_image_ids(self) -> List[int]:
+        """Returns ids of images uploaded without annotations, their files are imported again."""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT source, image_ids FROM files WHERE state = ?", (UPLOADED,)
+            ).fetchall()
+            self._conn.execute(
+                "UPDATE files SET state = ?, image_ids = NULL WHERE state = ?",
+                (DISCOVERED, UPLOADED),
+            )
+        return [image_id for _, image_ids in rows for image_id in json.loads(image_ids or "[]")]
+
+    def close(self, remove: bool = False) -> None:
+        with self._lock:
+            self._conn.close()
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,238 @@
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from os.path import basename, dirname, join
+from typing import Dict, Optional, Tuple
+
+import supervisely as sly
+from supervisely.io.fs import mkdir, silent_remove
+
+from converter import ConversionResult, ConversionSettings, convert_dicom
+from dicom_index import DicomIndexEntry
+
+# Bump when the produced images change for the same settings, e.g. rotation or flip
+CACHE_VERSION = 2
+RESULT_FILE = "result.json"
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+# Settings that change how pixel data is decoded but not the produced images
+DECODER_SETTINGS = ("decoder_backends", "transfer_syntax_decoders")
+
+
+def hash_file(path: str, settings: ConversionSettings = None) -> str:
+    """SHA-1 of the file content, takes the settings to run in `ConversionEngine.map`."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def convert_and_hash(
+    image_path: str, settings: ConversionSettings
+) -> Tuple[ConversionResult, Optional[str]]:
+    """Converts the file and hashes it in the same worker, the hash is stored with the
+    cache entry to confirm later hits. The hash is None if the file can't be read again."""
+    result = convert_dicom(image_path, settings)
+    try:
+        return result, hash_file(image_path)
+    except OSError:
+        return result, None
+
+
+def get_settings_key(settings: ConversionSettings) -> str:
+    values = {
+        name: value
+        for name, value in dataclasses.asdict(settings).items()
+        if name not in DECODER_SETTINGS
+    }
+    return json.dumps([CACHE_VERSION, values], sort_keys=True, default=str)
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Hard-links the file, copies it if the cache is on another file system."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def get_dir_size(path: str) -> int:
+    return sum(os.path.getsize(join(path, name)) for name in os.listdir(path))
+
+
+class ConversionCache:
+    """Content-addressed cache of converted DICOM files shared between imports.
+
+    Entries are keyed by a cheap fingerprint of the source file (size and
+    SOPInstanceUID from the DICOM index) and the conversion settings. Every entry
+    is a directory with the produced NRRD images, the extracted tags and the hash
+    of the source file, which confirms a hit: only files with a known fingerprint
+    are hashed before the lookup. Least recently used entries are evicted when the
+    cache grows over `max_bytes`, the order survives restarts through the entry
+    modification time.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, settings: ConversionSettings):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.evicted_count = 0
+        self._settings_key = get_settings_key(settings)
+        self._entries: Dict[str, int] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        mkdir(self.cache_dir)
+        self._load_entries()
+
+    def get_key(self, entry: DicomIndexEntry) -> str:
+        """Fingerprint of the source file, the file itself is not read.
+
+        The modification time is not used: files are downloaded again by every import.
+        """
+        fingerprint = [entry.size, entry.sop_instance_uid, self._settings_key]
+        return hashlib.sha1(json.dumps(fingerprint).encode("utf-8")).hexdigest()
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def add_misses(self, count: int) -> None:
+        """Counts files converted without a lookup, e.g. with an unknown fingerprint."""
+        with self._lock:
+            self.misses += count
+
+    def get(self, image_path: str, key: str, source_hash: str) -> Optional[ConversionResult]:
+        """Restores converted images next to the source file, None if they are not cached
+        or the cached file with the same fingerprint has other content."""
+        entry_dir = self._get_entry_dir(key)
+        original_name = basename(image_path)
+        result = ConversionResult(image_path=image_path, cached=True)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            try:
+                with open(join(entry_dir, RESULT_FILE)) as file:
+                    data = json.load(file)
+                if data["source_hash"] != source_hash:
+                    # the new file replaces the entry once it is converted
+                    self._remove_entry(key)
+                    self.misses += 1
+                    return None
+                result.img_sizes = data["img_sizes"]
+                result.tags = [tuple(tag) for tag in data["tags"]]
+                result.meta = data["meta"]
+                result.group_tag_value = data["group_tag_value"]
+                # image names follow the source file name, the cache is shared by all names
+                for index, prefix in enumerate(data["name_prefixes"]):
+                    name = f"{prefix}{original_name}.nrrd"
+                    path = join(dirname(image_path), name)
+                    link_or_copy(join(entry_dir, f"{index}.nrrd"), path)
+                    result.paths.append(path)
+                    result.names.append(name)
+            except Exception as e:
+                sly.logger.warning(f"Conversion cache entry '{key}' is broken: {repr(e)}")
+                for path in result.paths:
+                    silent_remove(path)
+                self._remove_entry(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.hit_bytes += self._entries[key]
+        os.utime(entry_dir)
+        return result
+
+    def put(self, key: str, source_hash: str, result: ConversionResult) -> None:
+        """Stores converted images of the source file, the images themselves are kept."""
+        entry_dir = self._get_entry_dir(key)
+        tmp_dir = f"{entry_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+        original_name = basename(result.image_path)
+        try:
+            mkdir(tmp_dir, remove_content_if_exists=True)
+            for index, path in enumerate(result.paths):
+                link_or_copy(path, join(tmp_dir, f"{index}.nrrd"))
+            data = {
+                "source_hash": source_hash,
+                "name_prefixes": [name[: -len(f"{original_name}.nrrd")] for name in result.names],
+                "img_sizes": result.img_sizes,
+                "tags": result.tags,
+                "meta": result.meta,
+                "group_tag_value": result.group_tag_value,
+            }
+            with open(join(tmp_dir, RESULT_FILE), "w") as file:
+                json.dump(data, file)
+            size = get_dir_size(tmp_dir)
+        except Exception as e:
+            sly.logger.warning(f"Failed to cache '{result.image_path}': {repr(e)}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        with self._lock:
+            if key in self._entries or size > self.max_bytes:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+            try:
+                mkdir(dirname(entry_dir))
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                # stored by another import sharing the cache
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return
+            self._entries[key] = size
+            self._size += size
+            while self._size > self.max_bytes:
+                self._remove_entry(next(iter(self._entries)))
+                self.evicted_count += 1
+
+    def log_summary(self) -> None:
+        requests = self.hits + self.misses
+        if requests == 0:
+            return
+        sly.logger.info(
+            f"Conversion cache: {self.hits} hits, {self.misses} misses "
+            f"({self.hits / requests:.0%} hit rate), {self.evicted_count} entries evicted, "
+            f"{self._size / 1024 / 1024:.1f} MB in '{self.cache_dir}'",
+            extra={
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "cache_hit_bytes": self.hit_bytes,
+                "cache_evicted": self.evicted_count,
+                "cache_bytes": self._size,
+            },
+        )
+
+    def _get_entry_dir(self, key: str) -> str:
+        return join(self.cache_dir, key[:2], key)
+
+    def _remove_entry(self, key: str) -> None:
+        """Must be called under the lock."""
+        self._size -= self._entries.pop(key, 0)
+        shutil.rmtree(self._get_entry_dir(key), ignore_errors=True)
+
+    def _load_entries(self) -> None:
+        """Indexes entries left by previous imports, the least recently used go first."""
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry_dir = join(prefix_dir, key)
+                if key.endswith(".tmp"):
+                    shutil.rmtree(entry_dir, ignore_errors=True)  # left by an interrupted import
+                    continue
+                entries.append((os.path.getmtime(entry_dir), key, get_dir_size(entry_dir)))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._size += size
+        with self._lock:
+            while self._size > self.max_bytes and len(self._entries) > 0:
+                self._remove_entry(next(iter(self._entries)))
+                self.evicted_count += 1
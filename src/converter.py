@@ -0,0 +1,508 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from os.path import dirname, join
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+import nrrd
+import numpy as np
+import pydicom
+import supervisely as sly
+from pydicom import FileDataset
+from pydicom.datadict import dictionary_VR
+from pydicom.dataelem import DataElement, RawDataElement
+from pydicom.tag import Tag
+from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian
+from supervisely.io.fs import get_file_name_with_ext
+
+from decoding import (
+    decode_pixel_array,
+    get_backends,
+    get_transfer_syntax,
+    is_frame_lazy,
+    iter_decoded_frames,
+)
+from metrics import HEADER_PARSE, NRRD_WRITE, PIXEL_DECODE
+from pipeline import Budget
+
+# This module must not import sly_globals: its functions are executed in worker
+# processes, all the settings they need are passed explicitly.
+
+# Bulk data and sequences, values of these elements are never converted to tags
+SKIP_TAG_VRS = ("OB", "OD", "OF", "OL", "OV", "OW", "SQ", "UN")
+PIXEL_DATA_TAG = 0x7FE00010
+PIXEL_DATA_DEFER_SIZE = "1 MB"
+MEMMAP_TRANSFER_SYNTAXES = (ImplicitVRLittleEndian, ExplicitVRLittleEndian)
+NRRD_ENCODINGS = ("raw", "gzip", "bzip2")
+MAX_TAG_VALUE_LENGTH = 255
+# A character takes up to 4 bytes, longer raw values can't fit into the tag value
+MAX_TAG_VALUE_BYTES = 4 * MAX_TAG_VALUE_LENGTH
+# A frame is copied while it is written: rotated and flipped or transposed
+WRITE_FRAME_COPIES = 2
+# Pixel spacing attribute depends on the SOP class, the same as in GDCM (SimpleITK):
+# X-ray images use ImagerPixelSpacing only, multi-frame secondary captures have none
+IMAGER_PIXEL_SPACING_SOP_CLASSES = tuple(
+    f"1.2.840.10008.5.1.4.1.1.{suffix}"
+    for suffix in ("1", "1.1", "1.1.1", "1.2", "1.2.1", "1.3", "1.3.1", "12.1", "12.2", "12.3")
+)
+SECONDARY_CAPTURE_SOP_CLASS = "1.2.840.10008.5.1.4.1.1.7"
+NO_PIXEL_SPACING_SOP_CLASSES = tuple(
+    f"{SECONDARY_CAPTURE_SOP_CLASS}.{suffix}" for suffix in ("1", "2", "3", "4")
+)
+# pynrrd writes the current time to the header, it is replaced with a constant so the
+# same DICOM file is always converted to the same file (images are found by hash)
+NRRD_TIME_PREFIX = b"NRRD0005\n# This NRRD file was generated by pynrrd\n# on "
+NRRD_TIME = b"1970-01-01 00:00:00"
+
+
+@dataclass(frozen=True)
+class ConversionSettings:
+    group_tag_name: str
+    extract_tags: bool = False
+    add_all_tags: bool = False
+    skip_vrs: Tuple[str, ...] = SKIP_TAG_VRS
+    # if set, only elements with these VRs are converted to tags
+    allow_vrs: Optional[Tuple[str, ...]] = None
+    nrrd_encoding: str = "gzip"
+    nrrd_compression_level: int = 9
+    # pydicom pixel data handlers tried in order, pydicom's own order if empty
+    decoder_backends: Tuple[str, ...] = ()
+    # (transfer syntax UID, handler) pairs, the handler is tried first for the syntax
+    transfer_syntax_decoders: Tuple[Tuple[str, str], ...] = ()
+
+
+@dataclass
+class ConversionResult:
+    image_path: str
+    paths: List[str] = field(default_factory=list)
+    names: List[str] = field(default_factory=list)
+    img_sizes: List[List[int]] = field(default_factory=list)
+    tags: List[Tuple[str, str]] = field(default_factory=list)
+    meta: Dict[str, str] = field(default_factory=dict)
+    group_tag_value: Optional[str] = None
+    # seconds spent in every conversion stage, see `metrics`
+    timings: Dict[str, float] = field(default_factory=dict)
+    # images are restored from the conversion cache
+    cached: bool = False
+
+
+def find_frame_axis(pixel_data: np.ndarray, frames: int):
+    for axis in range(len(pixel_data.shape)):
+        if pixel_data.shape[axis] == frames:
+            return axis
+    raise ValueError("Unable to recognize the frame axis for splitting a set of images")
+
+
+def iter_frames(pixel_array: np.ndarray, frame_axis: int, frames: int) -> Iterator[np.ndarray]:
+    """Yields frames one by one as views over the array, frames are not copied."""
+    if frame_axis == 0:
+        pixel_array = np.transpose(pixel_array, (2, 1, 0))
+    elif frame_axis == 1:
+        pixel_array = np.transpose(pixel_array, (2, 0, 1))
+    for frame in range(frames):
+        yield pixel_array[:, :, frame]
+
+
+def is_memmap_supported(dcm: FileDataset) -> bool:
+    """Checks if the pixel data layout allows to map it as is, the header is enough for that."""
+    if get_transfer_syntax(dcm) not in MEMMAP_TRANSFER_SYNTAXES:
+        return False
+    try:
+        frames = int(dcm.get("NumberOfFrames", 1) or 1)
+        rows, columns = int(dcm.Rows), int(dcm.Columns)
+        bits_allocated, bits_stored = int(dcm.BitsAllocated), int(dcm.BitsStored)
+        signed = int(dcm.get("PixelRepresentation", 0)) == 1
+        samples = int(dcm.get("SamplesPerPixel", 1))
+    except (AttributeError, TypeError, ValueError):
+        return False
+    if frames <= 1 or samples != 1 or bits_allocated not in (8, 16, 32):
+        return False
+    if rows == 0 or columns == 0:
+        return False
+    return not (signed and bits_stored != bits_allocated)
+
+
+def get_memmap_pixel_array(dcm: FileDataset) -> Optional[np.ndarray]:
+    """Memory-maps uncompressed multi-frame pixel data instead of reading it into memory.
+
+    Returns None if the pixel data can't be mapped as is, i.e. it is compressed,
+    big endian, bit-packed, multi-sample or needs a sign correction.
+    """
+    if not is_memmap_supported(dcm):
+        return None
+    element = get_raw_element(dcm, PIXEL_DATA_TAG)
+    if not isinstance(element, RawDataElement) or element.value is not None:
+        return None  # pixel data is already in memory
+    signed = int(dcm.get("PixelRepresentation", 0)) == 1
+    bits_allocated = int(dcm.BitsAllocated)
+    shape = (int(dcm.NumberOfFrames), int(dcm.Rows), int(dcm.Columns))
+    dtype = np.dtype(f"<{'i' if signed else 'u'}{bits_allocated // 8}")
+    if element.length < int(np.prod(shape)) * dtype.itemsize:
+        return None
+    return np.memmap(dcm.filename, dtype=dtype, mode="r", offset=element.value_tell, shape=shape)
+
+
+def estimate_memory(dcm: FileDataset, file_size: int = 0) -> int:
+    """Estimates peak memory of `convert_dicom` in bytes from the file header.
+
+    Memory-mapped and frame-lazy pixel data costs about a single frame, otherwise
+    the pixel data is read (`file_size` bytes) and all frames are decoded at once.
+    """
+    try:
+        frame_bytes = (
+            int(dcm.Rows)
+            * int(dcm.Columns)
+            * int(dcm.get("SamplesPerPixel") or 1)
+            * max(int(dcm.BitsAllocated), 8)
+            // 8
+        )
+        frames = int(dcm.get("NumberOfFrames") or 1)
+    except (AttributeError, TypeError, ValueError):
+        return 0
+    frame_cost = frame_bytes * WRITE_FRAME_COPIES
+    if is_memmap_supported(dcm):
+        return frame_cost
+    if is_frame_lazy(dcm):
+        return frame_cost + file_size
+    return frame_bytes * frames + frame_cost + file_size
+
+
+def get_memory_limit() -> int:
+    """Returns the container memory limit (cgroup v2 or v1) or the physical memory size."""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as file:
+                value = file.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports a huge number if there is no limit
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def find_attribute(dcm: FileDataset, keyword: str, functional_group: str):
+    """Looks for the attribute in the dataset and then in the functional groups."""
+    value = dcm.get(keyword)
+    if value is not None:
+        return value
+    for groups_keyword in ("SharedFunctionalGroupsSequence", "PerFrameFunctionalGroupsSequence"):
+        groups = dcm.get(groups_keyword)
+        if not groups:
+            continue
+        group = groups[0].get(functional_group)
+        if group and group[0].get(keyword) is not None:
+            return group[0].get(keyword)
+    return None
+
+
+def get_pixel_spacing(dcm: FileDataset) -> List[float]:
+    """Returns [x, y, z] spacing of the DICOM image, 1.0 if it is unknown."""
+    spacing = [1.0, 1.0, 1.0]
+    sop_class_uid = str(dcm.get("SOPClassUID", ""))
+    if sop_class_uid in IMAGER_PIXEL_SPACING_SOP_CLASSES:
+        pixel_spacing = dcm.get("ImagerPixelSpacing")
+    elif sop_class_uid in NO_PIXEL_SPACING_SOP_CLASSES:
+        pixel_spacing = None
+    else:
+        pixel_spacing = find_attribute(dcm, "PixelSpacing", "PixelMeasuresSequence")
+        if pixel_spacing is None and sop_class_uid == SECONDARY_CAPTURE_SOP_CLASS:
+            pixel_spacing = dcm.get("NominalScannedPixelSpacing")
+    if pixel_spacing is not None and len(pixel_spacing) == 2:
+        # PixelSpacing is "row spacing \ column spacing", i.e. (y, x)
+        spacing[0], spacing[1] = float(pixel_spacing[1]), float(pixel_spacing[0])
+    slice_spacing = find_attribute(dcm, "SpacingBetweenSlices", "PixelMeasuresSequence")
+    if slice_spacing is not None:
+        spacing[2] = abs(float(slice_spacing))
+    return spacing
+
+
+def get_ras_axes_order(dcm: FileDataset) -> List[int]:
+    """Returns the order of image axes after reorienting the image to the closest RAS orientation.
+
+    Image axes are matched to the world axes the same way ITK does: the pair with the largest
+    direction cosine is matched first, then the largest of the remaining axes and so on.
+    """
+    orientation = find_attribute(dcm, "ImageOrientationPatient", "PlaneOrientationSequence")
+    if orientation is None or len(orientation) != 6:
+        return [0, 1, 2]
+    row_dir = np.array([float(v) for v in orientation[:3]])
+    col_dir = np.array([float(v) for v in orientation[3:]])
+    directions = [row_dir, col_dir, np.cross(row_dir, col_dir)]
+    # (world axis, image axis): |cosine|, equal cosines are resolved to the last pair as in ITK
+    cosines = {
+        (world, axis): abs(directions[axis][world]) for world in range(3) for axis in range(3)
+    }
+    axes_order = [0, 1, 2]
+    while len(cosines) > 0:
+        world, axis = max(cosines, key=lambda pair: (cosines[pair], pair))
+        axes_order[world] = axis
+        cosines = {pair: v for pair, v in cosines.items() if world != pair[0] and axis != pair[1]}
+    return axes_order
+
+
+def get_nrrd_header(dcm: FileDataset) -> dict:
+    """Builds the header of a frame from the parsed dataset, matching the sizes and spacing
+    SimpleITK reports for the same file after reorienting it to RAS."""
+    frames = int(dcm.get("NumberOfFrames", 1) or 1)
+    axes_order = get_ras_axes_order(dcm)
+    dimensions = [int(dcm.Columns), int(dcm.Rows), frames]
+    dimensions = [dimensions[axis] for axis in axes_order]
+    spacing = get_pixel_spacing(dcm)
+    spacing = [spacing[axis] for axis in axes_order]
+    return {
+        "type": "float",
+        "sizes": dimensions[:2],
+        "dimension": 2,
+        "space": "right-anterior-superior",
+        "space directions": [[spacing[0], 0], [0, spacing[1]]],
+    }
+
+
+def write_nrrd(path: str, data: np.ndarray, header: dict, compression_level: int) -> None:
+    nrrd.write(path, data, header, compression_level=compression_level)
+    with open(path, "r+b") as file:
+        if file.read(len(NRRD_TIME_PREFIX)) == NRRD_TIME_PREFIX:
+            file.write(NRRD_TIME)
+
+
+def get_raw_element(dcm: FileDataset, dcm_tag) -> Union[RawDataElement, DataElement, None]:
+    """Returns the element as it is stored in the dataset, deferred values are not read."""
+    # Dataset.get_item() reads deferred values, so the underlying dict is used directly
+    return dcm._dict.get(Tag(dcm_tag))
+
+
+def get_element_vr(dcm: FileDataset, dcm_tag) -> Tuple[str, Optional[int]]:
+    """Returns VR and raw value length of the element without converting its value."""
+    element = get_raw_element(dcm, dcm_tag)
+    if not isinstance(element, RawDataElement):
+        return element.VR, None
+    vr = element.VR
+    if vr is None:  # implicit VR transfer syntax
+        try:
+            vr = dictionary_VR(dcm_tag)
+        except KeyError:
+            vr = "UN"
+    return vr, element.length
+
+
+def is_tag_vr_allowed(vr: str, settings: ConversionSettings) -> bool:
+    vrs = vr.split(" or ")  # ambiguous VRs, e.g. "OB or OW"
+    if any(vr in settings.skip_vrs for vr in vrs):
+        return False
+    if settings.allow_vrs is not None:
+        return any(vr in settings.allow_vrs for vr in vrs)
+    return True
+
+
+def extract_dcm_tags(
+    dcm: FileDataset, settings: ConversionSettings
+) -> Tuple[List[Tuple[str, str]], Dict[str, str]]:
+    """Extracts (name, value) pairs for tags and the image meta from DICOM metadata.
+
+    Elements are filtered by VR and raw length before their values are converted
+    to strings, so pixel data and other bulk elements are never stringified.
+    """
+    if not settings.extract_tags:
+        return [], {}
+
+    tags_from_dcm, dcm_tags_dict = [], {}
+    for dcm_tag in list(dcm.keys()):
+        try:
+            vr, length = get_element_vr(dcm, dcm_tag)
+            if not is_tag_vr_allowed(vr, settings):
+                continue
+            if length is not None and length > MAX_TAG_VALUE_BYTES:
+                sly.logger.warn(f"Tag [{dcm_tag}] has too long value. Skipping tag.")
+                continue
+            curr_tag = dcm[dcm_tag]
+            dcm_tag_name = str(curr_tag.name)
+            dcm_tag_value = str(curr_tag.value)
+            if dcm_tag_value in ["", None]:
+                sly.logger.warn(f"Tag [{dcm_tag_name}] has empty value. Skipping tag.")
+                continue
+            if len(dcm_tag_value) > MAX_TAG_VALUE_LENGTH:
+                sly.logger.warn(f"Tag [{dcm_tag_name}] has too long value. Skipping tag.")
+                continue
+            if settings.add_all_tags:
+                tags_from_dcm.append((dcm_tag_name, dcm_tag_value))
+            dcm_tags_dict[dcm_tag_name] = dcm_tag_value
+        except:
+            dcm_filename = get_file_name_with_ext(dcm.filename)
+            sly.logger.warn(f"Couldn't find key: '{dcm_tag}' in file's metadata: '{dcm_filename}'")
+            continue
+    return tags_from_dcm, dcm_tags_dict
+
+
+def convert_dicom(image_path: str, settings: ConversionSettings) -> ConversionResult:
+    """Converts DICOM data to nrrd format, returns only plain data to be merged by the caller."""
+    start = time.perf_counter()
+    # pixel data is deferred: it is either memory-mapped or decoded on first access
+    dcm = pydicom.dcmread(image_path, defer_size=PIXEL_DATA_DEFER_SIZE)
+    tags, meta = extract_dcm_tags(dcm, settings)
+    result = ConversionResult(image_path=image_path, tags=tags, meta=meta)
+    try:
+        result.group_tag_value = str(dcm[settings.group_tag_name].value)
+    except:
+        result.group_tag_value = None
+    result.timings[HEADER_PARSE] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    backends = get_backends(
+        get_transfer_syntax(dcm), settings.decoder_backends, settings.transfer_syntax_decoders
+    )
+    frame_lazy = is_frame_lazy(dcm)
+    pixel_array = None
+    if not frame_lazy:
+        pixel_array = get_memmap_pixel_array(dcm)
+        if pixel_array is None:
+            pixel_array = decode_pixel_array(dcm, backends)
+    # memory-mapped and encapsulated frames are read while they are written
+    result.timings[PIXEL_DECODE] = time.perf_counter() - start
+    decode_seconds = result.timings[PIXEL_DECODE]
+    pixel_data_list = [pixel_array]
+
+    if frame_lazy:
+        frames = int(dcm.NumberOfFrames)
+        # (rows, columns) -> (columns, rows), the same as frames of the whole pixel array
+        pixel_data_list = (
+            frame.T for frame in iter_decoded_frames(dcm, frames, backends, result.timings)
+        )
+        header = get_nrrd_header(dcm)
+    elif len(pixel_array.shape) == 3:
+        if pixel_array.shape[0] == 1 and not hasattr(dcm, "NumberOfFrames"):
+            frames = 1
+            pixel_data_list = [pixel_array.reshape((pixel_array.shape[1], pixel_array.shape[2]))]
+            header = get_nrrd_header(dcm)
+        else:
+            try:
+                frames = int(dcm.NumberOfFrames)
+            except AttributeError as e:
+                if str(e) == "'FileDataset' object has no attribute 'NumberOfFrames'":
+                    e.args = ("can't get 'NumberOfFrames' from dcm meta.",)
+                    raise e
+            frame_axis = find_frame_axis(pixel_array, frames)
+            pixel_data_list = iter_frames(pixel_array, frame_axis, frames)
+            header = get_nrrd_header(dcm)
+    elif len(pixel_array.shape) == 2:
+        frames = 1
+        header = get_nrrd_header(dcm)
+    else:
+        raise NotImplementedError(
+            f"this type of dcm data is not supported, pixel_array.shape = {len(pixel_array.shape)}"
+        )
+
+    header["encoding"] = settings.nrrd_encoding
+    start = time.perf_counter()
+    frames_list = [f"{i:0{len(str(frames))}d}" for i in range(1, frames + 1)]
+    original_name = get_file_name_with_ext(image_path)
+
+    for pixel_data, frame_number in zip(pixel_data_list, frames_list):
+        if frames == 1:
+            pixel_data = sly.image.rotate(img=pixel_data, degrees_angle=270)
+            pixel_data = sly.image.fliplr(pixel_data)
+            image_name = f"{original_name}.nrrd"
+        else:
+            image_name = f"{frame_number}_{original_name}.nrrd"
+
+        save_path = join(dirname(image_path), image_name)
+        write_nrrd(save_path, pixel_data, header, settings.nrrd_compression_level)
+        result.paths.append(save_path)
+        result.names.append(image_name)
+        # nrrd sizes are the array shape (Fortran index order), no need to read them back
+        result.img_sizes.append(list(pixel_data.shape)[::-1])
+    # frames decoded lazily are timed by the decoder
+    lazy_decode_seconds = result.timings[PIXEL_DECODE] - decode_seconds
+    result.timings[NRRD_WRITE] = time.perf_counter() - start - lazy_decode_seconds
+    return result
+
+
+class ConversionEngine:
+    """Runs DICOM conversion either in the current process or in a process pool.
+
+    Results are always yielded in the order of the input paths, so merging them
+    into the project meta gives the same result for any number of workers.
+    Conversions are admitted while their estimated memory fits `memory_budget`
+    (bytes, unlimited if 0), a conversion larger than the budget runs alone.
+    """
+
+    def __init__(self, settings: ConversionSettings, workers: int = 1, memory_budget: int = 0):
+        self.settings = settings
+        self.workers = max(1, workers)
+        self.budget = Budget(memory_budget) if memory_budget > 0 else None
+        self._pool = None
+        self._futures: Set[Future] = set()
+        self._futures_lock = threading.Lock()
+        if self.workers > 1:
+            # "fork" keeps workers from re-importing the app entrypoint (and sly_globals)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("fork")
+            )
+            # workers are started here, before the upload and dataset threads exist, so they
+            # are not forked while another thread holds a logging or sqlite lock
+            for future in [self._pool.submit(os.getpid) for _ in range(self.workers)]:
+                future.result()
+
+    def convert(
+        self, image_paths: List[str], costs: List[int] = None
+    ) -> Iterator[Tuple[str, Union[ConversionResult, Exception]]]:
+        """Yields (path, result) pairs, result is an exception if the conversion failed."""
+        return self.map(convert_dicom, image_paths, costs)
+
+    def map(self, func: Callable, items: list, costs: List[int] = None) -> Iterator[tuple]:
+        """Yields (item, result) pairs of `func(item, settings)` in the order of items,
+        result is an exception if the call failed. `func` must be a module-level function.
+        `costs` are estimated memory of the calls in bytes, see `estimate_memory`."""
+        if costs is None or self.budget is None:
+            costs = [0] * len(items)
+        if self._pool is None:
+            for item, cost in zip(items, costs):
+                self._acquire(cost)
+                try:
+                    result = func(item, self.settings)
+                except Exception as e:
+                    result = e
+                finally:
+                    self._release(cost)
+                yield item, result
+            return
+
+        futures = []
+        for item, cost in zip(items, costs):
+            self._acquire(cost)
+            future = self._pool.submit(func, item, self.settings)
+            with self._futures_lock:
+                self._futures.add(future)
+            future.add_done_callback(lambda _, cost=cost: self._release(cost))
+            future.add_done_callback(self._discard_future)
+            futures.append(future)
+        for item, future in zip(items, futures):
+            try:
+                yield item, future.result()
+            except Exception as e:
+                yield item, e
+
+    def _discard_future(self, future: Future) -> None:
+        with self._futures_lock:
+            self._futures.discard(future)
+
+    def _acquire(self, cost: int) -> None:
+        if cost > 0:
+            self.budget.acquire(cost)
+
+    def _release(self, cost: int) -> None:
+        if cost > 0:
+            self.budget.release(cost)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            # conversions that have not started are dropped, Python 3.8 has no cancel_futures
+            with self._futures_lock:
+                futures = list(self._futures)
+            for future in futures:
+                future.cancel()
+            self._pool.shutdown(wait=True)
+            self._pool = None
@@ -0,0 +1,111 @@
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from pydicom import Dataset, FileDataset
+from pydicom.encaps import encapsulate, generate_pixel_data_frame
+
+from metrics import PIXEL_DECODE
+
+# Like converter, this module must not import sly_globals: it runs in worker processes.
+
+# pydicom pixel data handlers that can be selected as decoder backends
+DECODER_BACKENDS = ("pylibjpeg", "gdcm", "pillow", "jpeg_ls", "rle", "numpy")
+
+# Elements a single frame needs to be decoded on its own
+FRAME_ATTRIBUTES = (
+    "Rows",
+    "Columns",
+    "SamplesPerPixel",
+    "PhotometricInterpretation",
+    "PlanarConfiguration",
+    "BitsAllocated",
+    "BitsStored",
+    "HighBit",
+    "PixelRepresentation",
+)
+
+# first backend that decoded the transfer syntax in this process
+_working_backends: Dict[str, Optional[str]] = {}
+
+
+def get_transfer_syntax(dcm: FileDataset):
+    file_meta = getattr(dcm, "file_meta", None)
+    return file_meta.get("TransferSyntaxUID") if file_meta is not None else None
+
+
+def is_encapsulated(dcm: FileDataset) -> bool:
+    transfer_syntax = get_transfer_syntax(dcm)
+    return transfer_syntax is not None and transfer_syntax.is_compressed
+
+
+def is_frame_lazy(dcm: FileDataset) -> bool:
+    """Checks if the encapsulated multi-frame pixel data can be decoded frame by frame."""
+    try:
+        frames = int(dcm.get("NumberOfFrames") or 1)
+    except (TypeError, ValueError):
+        return False
+    return is_encapsulated(dcm) and frames > 1 and int(dcm.get("SamplesPerPixel") or 1) == 1
+
+
+def get_backends(
+    transfer_syntax: str,
+    backends: Tuple[str, ...],
+    transfer_syntax_backends: Tuple[Tuple[str, str], ...] = (),
+) -> List[str]:
+    """Returns backends to try for the transfer syntax, the one configured for it goes first."""
+    preferred = dict(transfer_syntax_backends).get(str(transfer_syntax))
+    names = [preferred] if preferred else []
+    return names + [name for name in backends if name != preferred]
+
+
+def decode_pixel_array(dcm: Dataset, backends: List[str]) -> np.ndarray:
+    """Decodes pixel data with the first backend that can handle it.
+
+    pydicom picks the handler itself if no backend is configured or none of them
+    succeeded.
+    """
+    transfer_syntax = str(get_transfer_syntax(dcm))
+    working_backend = _working_backends.get(transfer_syntax)
+    if working_backend is not None:
+        backends = [working_backend] + [name for name in backends if name != working_backend]
+    for name in backends:
+        try:
+            dcm.convert_pixel_data(handler_name=name)
+        except Exception:
+            continue
+        _working_backends[transfer_syntax] = name
+        return dcm.pixel_array
+    return dcm.pixel_array
+
+
+def get_frame_dataset(dcm: FileDataset, frame: bytes) -> Dataset:
+    """Builds a single-frame dataset with the encoded frame and the pixel description."""
+    frame_dcm = Dataset()
+    frame_dcm.file_meta = dcm.file_meta
+    frame_dcm.is_little_endian = True
+    frame_dcm.is_implicit_VR = False
+    for keyword in FRAME_ATTRIBUTES:
+        if keyword in dcm:
+            setattr(frame_dcm, keyword, dcm.get(keyword))
+    frame_dcm.NumberOfFrames = 1
+    frame_dcm.PixelData = encapsulate([frame])
+    frame_dcm["PixelData"].VR = "OB"
+    frame_dcm["PixelData"].is_undefined_length = True
+    return frame_dcm
+
+
+def iter_decoded_frames(
+    dcm: FileDataset, frames: int, backends: List[str], timings: Dict[str, float] = None
+) -> Iterator[np.ndarray]:
+    """Decodes encapsulated multi-frame pixel data one frame at a time.
+
+    Only the encoded pixel data and a single decoded frame are kept in memory.
+    Frames are yielded as (rows, columns) arrays.
+    """
+    for frame in generate_pixel_data_frame(dcm.PixelData, frames):
+        start = time.perf_counter()
+        pixel_array = decode_pixel_array(get_frame_dataset(dcm, frame), backends)
+        if timings is not None:
+            timings[PIXEL_DECODE] = timings.get(PIXEL_DECODE, 0) + time.perf_counter() - start
+        yield pixel_array
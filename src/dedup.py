@@ -0,0 +1,127 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+import supervisely as sly
+
+from dicom_index import DicomIndex, DicomIndexEntry, hash_pixel_data
+
+KEEP_ALL = "keep_all"
+KEEP_FIRST = "keep_first"
+SKIP = "skip"
+DEDUP_POLICIES = (KEEP_ALL, KEEP_FIRST, SKIP)
+
+
+class Deduplicator:
+    """Drops repeated DICOM instances before they are converted.
+
+    Instances are identified by SOPInstanceUID, files without it by the hash of
+    their pixel data. Policies:
+    - "keep_all": every file is imported (no deduplication)
+    - "keep_first": only the first file of every instance is imported
+    - "skip": instances found more than once are not imported at all, the
+      counts are known only for the files indexed with `count` beforehand
+    """
+
+    def __init__(self, policy: str = KEEP_ALL):
+        self.policy = policy
+        self.duplicates_count = 0
+        self.duplicates_bytes = 0
+        self.existing_count = 0
+        self.existing_bytes = 0
+        self._seen: Set[str] = set()
+        self._counts: Dict[str, int] = {}
+        self._keys: Dict[str, Optional[str]] = {}
+        self._converted_bytes = 0
+        self._convert_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.policy != KEEP_ALL
+
+    def count(self, index: DicomIndex) -> None:
+        """Counts copies of every instance in the index, required by the "skip" policy."""
+        if self.policy != SKIP:
+            return
+        for entry in index:
+            key = self.get_key(entry)
+            if key is not None:
+                self._counts[key] = self._counts.get(key, 0) + 1
+
+    def filter(self, entries: List[DicomIndexEntry]) -> List[DicomIndexEntry]:
+        """Returns entries to import in the same order, duplicates are dropped."""
+        if not self.enabled:
+            return entries
+        return [entry for entry in entries if self.keep(entry)]
+
+    def keep(self, entry: DicomIndexEntry) -> bool:
+        if not self.enabled:
+            return True
+        key = self.get_key(entry)
+        if key is None:
+            return True
+        with self._lock:
+            is_duplicate = key in self._seen or (
+                self.policy == SKIP and self._counts.get(key, 0) > 1
+            )
+            self._seen.add(key)
+            if is_duplicate:
+                self.duplicates_count += 1
+                self.duplicates_bytes += entry.size
+        if is_duplicate:
+            sly.logger.debug(f"Duplicate DICOM instance '{entry.path}' will be skipped")
+        return not is_duplicate
+
+    def add_imported(self, keys: Iterable[str]) -> None:
+        """Adds keys of the instances imported before the resume, their copies are duplicates."""
+        with self._lock:
+            self._seen.update(keys)
+
+    def add_existing(self, size: int) -> None:
+        """Counts the source file whose images are already in the dataset, `size` is their size."""
+        with self._lock:
+            self.existing_count += 1
+            self.existing_bytes += size
+
+    def add_conversion_time(self, size: int, seconds: float) -> None:
+        """Conversion throughput is used to estimate the time saved on skipped files."""
+        with self._lock:
+            self._converted_bytes += size
+            self._convert_seconds += seconds
+
+    def log_summary(self) -> None:
+        if self.duplicates_count + self.existing_count == 0:
+            return
+        # duplicates are never converted, files already in the datasets are converted
+        # to compare the hashes and only their upload is saved
+        saved_seconds = 0.0
+        if self._converted_bytes > 0:
+            saved_seconds = self.duplicates_bytes * self._convert_seconds / self._converted_bytes
+        sly.logger.info(
+            f"Skipped {self.duplicates_count} duplicate DICOM files "
+            f"({self.duplicates_bytes / 1024 / 1024:.1f} MB, "
+            f"about {saved_seconds:.1f} s of conversion saved) and "
+            f"{self.existing_count} files already in the datasets "
+            f"({self.existing_bytes / 1024 / 1024:.1f} MB of upload saved)",
+            extra={
+                "duplicates_count": self.duplicates_count,
+                "duplicates_bytes": self.duplicates_bytes,
+                "existing_count": self.existing_count,
+                "existing_bytes": self.existing_bytes,
+                "saved_seconds": round(saved_seconds, 1),
+            },
+        )
+
+    def get_key(self, entry: DicomIndexEntry) -> Optional[str]:
+        """Returns the key that is the same for all copies of the instance."""
+        if entry.sop_instance_uid is not None:
+            return f"uid:{entry.sop_instance_uid}"
+        # pixel data is hashed only once, "skip" policy needs the key before the import
+        if entry.path not in self._keys:
+            try:
+                pixel_hash = hash_pixel_data(entry.path)
+            except Exception as e:
+                sly.logger.debug(f"Failed to hash pixel data of '{entry.path}': {repr(e)}")
+                pixel_hash = None
+            self._keys[entry.path] = None if pixel_hash is None else f"pixels:{pixel_hash}"
+        return self._keys[entry.path]
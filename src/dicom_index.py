@@ -0,0 +1,187 @@
+import hashlib
+import os
+import time
+from dataclasses import dataclass
+from os.path import abspath, dirname, normpath
+from typing import Dict, Iterator, List, Optional, Set
+
+import pydicom
+import supervisely as sly
+from pydicom import Dataset
+from pydicom.datadict import tag_for_keyword
+from pydicom.dataset import FileMetaDataset
+
+from metrics import DISCOVERY, MetricsRecorder
+
+DICOM_PREAMBLE_SIZE = 128
+DICOM_MAGIC = b"DICM"
+# Elements larger than this are not loaded into memory while reading headers.
+HEADER_DEFER_SIZE = "1 KB"
+# Header elements read from the index after the scan: series grouping and slice order
+# (volume mode), deduplication and conversion memory estimates
+INDEX_HEADER_KEYWORDS = (
+    "SOPInstanceUID",
+    "SeriesInstanceUID",
+    "InstanceNumber",
+    "NumberOfFrames",
+    "ImageOrientationPatient",
+    "ImagePositionPatient",
+    "Rows",
+    "Columns",
+    "SamplesPerPixel",
+    "BitsAllocated",
+    "BitsStored",
+    "PixelRepresentation",
+    "SharedFunctionalGroupsSequence",
+)
+
+
+@dataclass
+class DicomIndexEntry:
+    path: str
+    # only INDEX_HEADER_KEYWORDS and the transfer syntax, see `get_index_header`
+    header: Dataset
+    size: int
+    group_tag_value: Optional[str]
+    frames: int
+    sop_instance_uid: Optional[str] = None
+
+
+def _index_key(path: str) -> str:
+    return normpath(abspath(path))
+
+
+def has_dicom_magic(path: str) -> bool:
+    """Cheap check for the 128-byte preamble followed by the 'DICM' prefix."""
+    try:
+        with open(path, "rb") as file:
+            file.seek(DICOM_PREAMBLE_SIZE)
+            return file.read(len(DICOM_MAGIC)) == DICOM_MAGIC
+    except OSError:
+        return False
+
+
+def read_dicom_header(path: str) -> Dataset:
+    """Reads DICOM header without pixel data, deferring large element values."""
+    return pydicom.dcmread(path, stop_before_pixels=True, defer_size=HEADER_DEFER_SIZE)
+
+
+def get_index_header(header: Dataset, frames: int) -> Dataset:
+    """Copies the elements the import reads from the index, the full header of every
+    file is not kept in memory. Per-frame functional groups are kept for single-frame
+    files only, multi-frame files are neither grouped into series nor sorted."""
+    index_header = Dataset()
+    file_meta = getattr(header, "file_meta", None)
+    index_header.file_meta = FileMetaDataset()
+    if file_meta is not None and "TransferSyntaxUID" in file_meta:
+        index_header.file_meta.TransferSyntaxUID = file_meta.TransferSyntaxUID
+    keywords = INDEX_HEADER_KEYWORDS
+    if frames <= 1:
+        keywords += ("PerFrameFunctionalGroupsSequence",)
+    for keyword in keywords:
+        tag = tag_for_keyword(keyword)
+        if tag in header:
+            # raw elements are copied as they are, values are converted on first access
+            index_header[tag] = header.get_item(tag)
+    return index_header
+
+
+def hash_pixel_data(path: str) -> Optional[str]:
+    """Returns SHA-1 of the raw PixelData bytes, None if the file has no pixel data."""
+    dcm = pydicom.dcmread(path)
+    pixel_data = dcm.get("PixelData")
+    if pixel_data is None:
+        return None
+    return hashlib.sha1(pixel_data).hexdigest()
+
+
+class DicomIndex:
+    """In-memory index of DICOM files found in the project directory.
+
+    Every file is checked for the DICOM magic and parsed only once, all later
+    validation steps read from the index instead of going back to disk.
+    """
+
+    def __init__(self, group_tag_name: str = None, metrics: MetricsRecorder = None):
+        self.group_tag_name = group_tag_name
+        self.metrics = metrics
+        self._entries: Dict[str, DicomIndexEntry] = {}
+        self._dirs: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, path: str) -> bool:
+        return _index_key(path) in self._entries
+
+    def __iter__(self) -> Iterator[DicomIndexEntry]:
+        return iter(self._entries.values())
+
+    def scan(self, root_dir: str) -> "DicomIndex":
+        """Walks the directory tree once and indexes all DICOM files."""
+        for dir_path, _, file_names in os.walk(root_dir):
+            for file_name in sorted(file_names):
+                self.add(os.path.join(dir_path, file_name))
+        sly.logger.info(f"Found {len(self)} DICOM files in '{root_dir}'")
+        return self
+
+    def add(self, path: str) -> Optional[DicomIndexEntry]:
+        """Indexes a single file, returns None if it is not a DICOM file."""
+        key = _index_key(path)
+        if key in self._entries:
+            return self._entries[key]
+        start = time.perf_counter()
+        try:
+            if not has_dicom_magic(key):
+                return None
+            header = read_dicom_header(key)
+        except Exception as e:
+            sly.logger.debug(f"'{path}' appears not to be a DICOM file ({repr(e)})")
+            return None
+        finally:
+            if self.metrics is not None:
+                self.metrics.record(DISCOVERY, time.perf_counter() - start)
+
+        frames = self._get_frames(header)
+        entry = DicomIndexEntry(
+            path=key,
+            header=get_index_header(header, frames),
+            size=os.path.getsize(key),
+            group_tag_value=self._get_group_tag_value(header),
+            frames=frames,
+            sop_instance_uid=str(header.get("SOPInstanceUID", "") or "") or None,
+        )
+        self._entries[key] = entry
+        self._dirs.setdefault(dirname(key), set()).add(key)
+        return entry
+
+    def remove(self, path: str) -> None:
+        """Drops the file from the index, e.g. when it is already imported and deleted."""
+        key = _index_key(path)
+        if self._entries.pop(key, None) is not None:
+            self._dirs.get(dirname(key), set()).discard(key)
+
+    def get(self, path: str) -> Optional[DicomIndexEntry]:
+        return self._entries.get(_index_key(path))
+
+    def is_dicom(self, path: str) -> bool:
+        return _index_key(path) in self._entries
+
+    def dicom_files(self, dir_path: str) -> List[str]:
+        """Returns sorted paths of DICOM files located directly in the directory."""
+        return sorted(self._dirs.get(_index_key(dir_path), []))
+
+    def _get_group_tag_value(self, header: Dataset) -> Optional[str]:
+        if self.group_tag_name is None or self.group_tag_name not in header:
+            return None
+        try:
+            return str(header[self.group_tag_name].value)
+        except Exception:
+            return None
+
+    @staticmethod
+    def _get_frames(header: Dataset) -> int:
+        try:
+            return int(header.get("NumberOfFrames", 1) or 1)
+        except (TypeError, ValueError):
+            return 1
@@ -0,0 +1,108 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from os.path import basename, join, normpath
+from typing import Dict, List, NamedTuple, Tuple
+
+import supervisely as sly
+from tqdm import tqdm
+
+import sly_globals as g
+from metrics import DOWNLOAD
+from pipeline import UploadPipeline
+from stream_import import StreamImporter, is_ann_file, is_img_file, is_junk_file, is_meta_file
+
+STREAM_DIR_NAME = "folder_stream"
+
+
+class RemoteFile(NamedTuple):
+    path: str
+    # path relative to the project directory
+    name: str
+    size: int
+
+
+class FolderImporter(StreamImporter):
+    """Imports the project from the Team Files folder without downloading it first.
+
+    Files are downloaded concurrently and each downloaded file goes straight to
+    conversion, sources are removed as soon as their batch is uploaded.
+    """
+
+    def __init__(self, api: sly.Api, remote_dir: str):
+        super().__init__(api, join(g.STORAGE_DIR, STREAM_DIR_NAME))
+        self.remote_dir = remote_dir
+        if g.IS_ON_AGENT:
+            _, cur_files_path = api.file.parse_agent_id_and_path(remote_dir)
+        else:
+            cur_files_path = remote_dir
+        self.remote_files_path = normpath(cur_files_path)
+        self.project_name = basename(self.remote_files_path)
+
+    def list_files(self) -> List[RemoteFile]:
+        files = []
+        for item in self.api.file.list(g.TEAM_ID, self.remote_dir, recursive=True):
+            item_path = normpath(item["path"])
+            # agent listing may return paths with or without the agent prefix
+            position = item_path.find(self.remote_files_path)
+            if position == -1:
+                continue
+            name = item_path[position + len(self.remote_files_path) :].lstrip("/")
+            if name == "" or is_junk_file(name):
+                continue
+            size = item.get("meta", {}).get("size") or item.get("size") or 0
+            files.append(RemoteFile(join(self.remote_dir, name), name, int(size)))
+        return sorted(files, key=lambda file: file.name)
+
+    def run(self, pipeline: UploadPipeline) -> None:
+        files = self.list_files()
+        if g.WITH_ANNS:
+            meta_path = None
+            for file in files:
+                if is_meta_file(file.name):
+                    meta_path = self._download(file)
+                elif is_ann_file(file.name):
+                    self._download(file)
+            self.load_sly_format_meta(meta_path)
+        if g.WITH_ANNS:
+            files = [file for file in files if is_img_file(file.name)]
+        # files imported before the import was resumed are not downloaded again
+        files = [file for file in files if not self.is_done(self._get_local_path(file))]
+
+        progress = tqdm(total=sum(file.size for file in files), desc="Downloading", unit="B")
+        pending: Dict[Future, RemoteFile] = {}
+        max_pending = 2 * g.DOWNLOAD_WORKERS
+        with ThreadPoolExecutor(max_workers=g.DOWNLOAD_WORKERS) as executor:
+            files_iter = iter(files)
+            next_file = next(files_iter, None)
+            while next_file is not None or len(pending) > 0:
+                while (
+                    next_file is not None
+                    and len(pending) < max_pending
+                    and (len(pending) == 0 or self.budget.can_acquire(next_file.size))
+                ):
+                    # with nothing in flight it's safe to wait for uploads to free the space
+                    self.acquire(next_file.size, pipeline)
+                    pending[executor.submit(self._download, next_file)] = next_file
+                    next_file = next(files_iter, None)
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file = pending.pop(future)
+                    progress.update(file.size)
+                    try:
+                        path = future.result()
+                    except Exception as e:
+                        sly.logger.warning(f"Failed to download '{file.path}': {repr(e)}")
+                        self.budget.release(file.size)
+                        continue
+                    self.add_file(path, file.size, pipeline)
+        progress.close()
+        self.finish(pipeline)
+
+    def _get_local_path(self, file: RemoteFile) -> str:
+        return join(self.work_dir, self.project_name, file.name)
+
+    def _download(self, file: RemoteFile) -> str:
+        local_path = self._get_local_path(file)
+        with g.metrics.measure(DOWNLOAD, nbytes=file.size):
+            self.api.file.download(g.TEAM_ID, file.path, local_path)
+        return local_path
@@ -0,0 +1,72 @@
+import itertools
+import os
+import shutil
+import threading
+from os.path import exists, join
+from typing import Dict, NamedTuple
+
+import supervisely as sly
+from supervisely.io.fs import mkdir, remove_dir
+
+from pipeline import UploadBatch
+
+
+class LocalDatasetInfo(NamedTuple):
+    id: int
+    name: str
+    images_count: int = 0
+
+
+def get_free_path(path: str) -> str:
+    """Adds a numeric suffix to the path if it is already taken."""
+    free_path, index = path, 1
+    while exists(free_path):
+        free_path = f"{path}_{index:03d}"
+        index += 1
+    return free_path
+
+
+class LocalProject:
+    """Supervisely format project directory, written instead of uploading in convert-only mode.
+
+    Every dataset has `img`, `ann` and `meta` (image metadata) directories, the
+    project meta is written to `meta.json` once all images are converted.
+    """
+
+    def __init__(self, project_dir: str):
+        self.project_dir = get_free_path(project_dir)
+        mkdir(self.project_dir)
+        self._datasets: Dict[int, str] = {}
+        # ids are not reused after a dataset is removed
+        self._dataset_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def datasets_count(self) -> int:
+        return len(self._datasets)
+
+    def create_dataset(self, name: str) -> LocalDatasetInfo:
+        with self._lock:
+            dataset_dir = get_free_path(join(self.project_dir, name))
+            for subdir in ("img", "ann", "meta"):
+                mkdir(join(dataset_dir, subdir))
+            dataset_id = next(self._dataset_ids)
+            self._datasets[dataset_id] = dataset_dir
+        return LocalDatasetInfo(dataset_id, os.path.basename(dataset_dir))
+
+    def remove_dataset(self, dataset_id: int) -> None:
+        with self._lock:
+            dataset_dir = self._datasets.pop(dataset_id, None)
+        if dataset_dir is not None:
+            remove_dir(dataset_dir)
+
+    def write_batch(self, batch: UploadBatch) -> None:
+        """Moves converted images into the dataset and writes their annotations and metadata."""
+        dataset_dir = self._datasets[batch.dataset_id]
+        for path, name, meta, ann in zip(batch.paths, batch.names, batch.metas, batch.anns):
+            shutil.move(path, join(dataset_dir, "img", name))
+            sly.json.dump_json_file(ann, join(dataset_dir, "ann", f"{name}.json"))
+            sly.json.dump_json_file(meta, join(dataset_dir, "meta", f"{name}.json"))
+
+    def write_meta(self, meta_json: dict) -> None:
+        sly.json.dump_json_file(meta_json, join(self.project_dir, "meta.json"))
@@ -1,11 +1,18 @@
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
 
 import supervisely as sly
-from supervisely.io.fs import remove_dir
+from supervisely.io.fs import remove_dir, silent_remove
 from tqdm import tqdm
 
 import sly_globals as g
 import sly_utils as f
+from archive_stream import ArchiveImporter
+from dicom_index import DicomIndex
+from folder_stream import FolderImporter
+from pipeline import UploadPipeline
+from stream_import import StreamImporter
 
 
 @g.my_app.callback("import-dicom-studies")
@@ -14,16 +21,46 @@ def import_dicom_studies(
     api: sly.Api, task_id: int, context: dict, state: dict, app_logger
 ) -> None:
     """Converts DICOM data to .nrrd format and add tags from DICOM metadata."""
+    g.metrics.count_api_calls(api)
+    g.metrics.count_api_calls(g.api)
+    if g.LOCAL_INPUT_DIR is None:
+        f.handle_input_path(api)
+    g.checkpoint = f.open_checkpoint()
+    try:
+        if g.LOCAL_INPUT_DIR is not None:
+            import_project_dir(api, task_id, app_logger)
+        elif g.STREAM_ARCHIVE and g.INPUT_FILE is not None:
+            archive_path = f.download_archive(api, task_id, g.STORAGE_DIR)
+            if archive_path is not None:
+                import_stream(api, task_id, ArchiveImporter(api, archive_path), app_logger)
+                silent_remove(archive_path)
+        elif g.STREAM_FOLDER and g.INPUT_DIR is not None:
+            import_stream(api, task_id, FolderImporter(api, g.INPUT_DIR), app_logger)
+        else:
+            import_project_dir(api, task_id, app_logger)
+    finally:
+        f.save_metrics_report(api, task_id)
+
 
-    # Create a new project in the workspace
-    project_dir = f.download_data_from_team_files(api=api, task_id=task_id, save_path=g.STORAGE_DIR)
+def import_project_dir(api: sly.Api, task_id: int, app_logger) -> None:
+    """Downloads (and unpacks) input data and imports the project directory."""
+    if g.LOCAL_INPUT_DIR is not None:
+        project_dir = os.path.normpath(g.LOCAL_INPUT_DIR)
+    else:
+        project_dir = f.download_data_from_team_files(
+            api=api, task_id=task_id, save_path=g.STORAGE_DIR
+        )
     if project_dir is not None:
         project_name = os.path.basename(project_dir)
+        g.dicom_index = DicomIndex(g.GROUP_TAG_NAME, g.metrics).scan(project_dir)
+        g.deduplicator.count(g.dicom_index)
 
         if g.WITH_ANNS:
             f.check_image_project_structure(project_dir, with_anns=g.WITH_ANNS)
         if g.WITH_ANNS:
-            g.project_meta_from_sly_format = sly.read_single_project(g.STORAGE_DIR).meta
+            g.project_meta_from_sly_format = sly.ProjectMeta.from_json(
+                sly.json.load_json_file(os.path.join(project_dir, "meta.json"))
+            )
 
             # Loop over the datasets in the project directory
             datasets_paths = [
@@ -36,35 +73,83 @@ def import_dicom_studies(
             datasets_paths = f.check_ds_dirs(datasets_paths)
 
         if len(datasets_paths) == 0:
-            title = "No DICOM data found."
-            description = "Read the app overview to prepare your data for import."
-            api.task.set_output_error(task_id, title=title, description=description)
-            app_logger.error(f"{title} {description}")
+            set_no_data_error(api, task_id, app_logger)
         else:
-            project = api.project.create(
-                workspace_id=g.WORKSPACE_ID, name=project_name, change_name_if_conflict=True
-            )
-            g.project_id = project.id
+            # Create a new project in the workspace
+            f.create_project(api, project_name)
+            g.conversion_engine = f.create_conversion_engine()
+            g.conversion_cache = f.create_conversion_cache(g.conversion_engine.settings)
+            pipeline = f.create_upload_pipeline(api)
             ds_progress = tqdm(total=len(datasets_paths), desc="Importing Datasets", unit="dataset")
-            for dataset_path in datasets_paths:
-                try:
-                    f.import_dataset(api, dataset_path)
-                except FileNotFoundError as e:
-                    if str(e) == "Nothing to import":
-                        sly.logger.warning(f"Skipping dataset '{dataset_path}', nothing to import")
-                        continue
-                ds_progress.update(1)
+            try:
+                import_datasets(api, datasets_paths, pipeline, ds_progress)
+                pipeline.close()
+            finally:
+                g.conversion_engine.shutdown()
             ds_progress.close()
-            if api.project.get_datasets_count(project.id) == 0:
-                api.project.remove(project.id)
-                title = f"Failed to import DICOM data."
-                description = "Read the app overview to prepare your data for import."
-                raise Exception(f"{title} {description}")
-            g.workflow.add_output(g.project_id)
-        remove_dir(project_dir)
+            f.finalize_project(api)
+        # local input is converted in place, only the converted files are removed
+        if g.LOCAL_INPUT_DIR is None:
+            remove_dir(project_dir)
         g.my_app.stop()
 
 
+def import_datasets(
+    api: sly.Api, datasets_paths: List[str], pipeline: UploadPipeline, ds_progress: tqdm
+) -> None:
+    """Imports up to `DATASET_WORKERS` datasets at once, they share the conversion
+    process pool and the upload pipeline."""
+    datasets = {}
+    for dataset_path in datasets_paths:
+        dataset = f.prepare_dataset(api, dataset_path)
+        if dataset is None:
+            ds_progress.update(1)
+        else:
+            datasets[dataset_path] = dataset
+
+    with ThreadPoolExecutor(max_workers=g.DATASET_WORKERS) as executor:
+        futures = {
+            executor.submit(f.import_dataset, api, dataset, pipeline): dataset_path
+            for dataset_path, dataset in datasets.items()
+        }
+        for future in as_completed(futures):
+            dataset_path = futures[future]
+            try:
+                future.result()
+            except FileNotFoundError as e:
+                if str(e) == "Nothing to import":
+                    sly.logger.warning(f"Skipping dataset '{dataset_path}', nothing to import")
+                    continue
+            ds_progress.update(1)
+
+
+def import_stream(api: sly.Api, task_id: int, importer: StreamImporter, app_logger) -> None:
+    """Imports files one at a time as they are extracted or downloaded."""
+    g.conversion_engine = f.create_conversion_engine()
+    g.conversion_cache = f.create_conversion_cache(g.conversion_engine.settings)
+    pipeline = f.create_upload_pipeline(api)
+    try:
+        importer.run(pipeline)
+        pipeline.close()
+    finally:
+        g.conversion_engine.shutdown()
+        remove_dir(importer.work_dir)
+
+    if g.project_id is None:
+        set_no_data_error(api, task_id, app_logger)
+    else:
+        f.finalize_project(api)
+    g.my_app.stop()
+
+
+def set_no_data_error(api: sly.Api, task_id: int, app_logger) -> None:
+    title = "No DICOM data found."
+    description = "Read the app overview to prepare your data for import."
+    if not g.CONVERT_ONLY:
+        api.task.set_output_error(task_id, title=title, description=description)
+    app_logger.error(f"{title} {description}")
+
+
 def main():
     sly.logger.info(
         "Script arguments", extra={"TEAM_ID": g.TEAM_ID, "WORKSPACE_ID": g.WORKSPACE_ID}
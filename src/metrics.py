@@ -0,0 +1,153 @@
+import functools
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+import supervisely as sly
+
+DISCOVERY = "discovery"
+DOWNLOAD = "download"
+# reading members of the streamed archive
+EXTRACT = "extract"
+HEADER_PARSE = "header_parse"
+PIXEL_DECODE = "pixel_decode"
+NRRD_WRITE = "nrrd_write"
+ANNOTATION_BUILD = "annotation_build"
+IMAGE_UPLOAD = "image_upload"
+ANNOTATION_UPLOAD = "annotation_upload"
+# writing converted images to the local project in convert-only mode
+LOCAL_WRITE = "local_write"
+META_UPDATE = "meta_update"
+STAGES = (
+    DISCOVERY,
+    DOWNLOAD,
+    EXTRACT,
+    HEADER_PARSE,
+    PIXEL_DECODE,
+    NRRD_WRITE,
+    ANNOTATION_BUILD,
+    IMAGE_UPLOAD,
+    ANNOTATION_UPLOAD,
+    LOCAL_WRITE,
+    META_UPDATE,
+)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile, `values` must be sorted."""
+    if len(values) == 0:
+        return 0.0
+    rank = min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))
+    return values[rank]
+
+
+def get_peak_rss_mb() -> Dict[str, float]:
+    """Peak resident memory of the app process and of the largest conversion worker."""
+    # ru_maxrss is in kilobytes on Linux
+    return {
+        "main": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "workers": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+class StageMetrics:
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.latencies: List[float] = []
+
+    def to_json(self) -> Dict[str, float]:
+        latencies = sorted(self.latencies)
+        return {
+            "count": self.count,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 3),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "files_per_sec": round(self.count / self.seconds, 2) if self.seconds > 0 else None,
+            "mb_per_sec": (
+                round(self.bytes / 1024 / 1024 / self.seconds, 2) if self.seconds > 0 else None
+            ),
+        }
+
+
+class MetricsRecorder:
+    """Thread-safe recorder of time spent in every stage of the import.
+
+    Every record is one operation (a file, a request) with its latency and the
+    number of items and bytes it processed. Stage times of parallel workers are
+    summed, so they show where the work goes rather than the wall time.
+    """
+
+    def __init__(self, log_interval: float = 0):
+        self.log_interval = log_interval
+        self._stages: Dict[str, StageMetrics] = {}
+        self._api_calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._started_at = time.perf_counter()
+        self._logged_at = self._started_at
+
+    def record(self, stage: str, seconds: float, count: int = 1, nbytes: int = 0) -> None:
+        with self._lock:
+            metrics = self._stages.setdefault(stage, StageMetrics())
+            metrics.count += count
+            metrics.bytes += nbytes
+            metrics.seconds += seconds
+            metrics.latencies.append(seconds)
+            now = time.perf_counter()
+            should_log = self.log_interval > 0 and now - self._logged_at >= self.log_interval
+            if should_log:
+                self._logged_at = now
+        if should_log:
+            self.log_report("Import metrics")
+
+    @contextmanager
+    def measure(self, stage: str, count: int = 1, nbytes: int = 0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, count, nbytes)
+
+    def count_api_calls(self, api: sly.Api) -> None:
+        """Counts requests of the API instance by endpoint."""
+        if getattr(api, "_metrics_recorder", None) is self:
+            return
+        api._metrics_recorder = self
+        for name in ("get", "post"):
+            setattr(api, name, self._wrap_request(getattr(api, name)))
+
+    def _wrap_request(self, request):
+        @functools.wraps(request)
+        def wrapper(method, *args, **kwargs):
+            with self._lock:
+                self._api_calls[method] = self._api_calls.get(method, 0) + 1
+            return request(method, *args, **kwargs)
+
+        return wrapper
+
+    def report(self) -> dict:
+        with self._lock:
+            stages = {
+                stage: self._stages[stage].to_json()
+                for stage in sorted(self._stages, key=self._stage_order)
+            }
+            api_calls = dict(sorted(self._api_calls.items()))
+        return {
+            "wall_seconds": round(time.perf_counter() - self._started_at, 3),
+            "peak_rss_mb": get_peak_rss_mb(),
+            "api_calls": api_calls,
+            "stages": stages,
+        }
+
+    def log_report(self, message: str = "Import metrics report") -> dict:
+        report = self.report()
+        sly.logger.info(message, extra={"metrics": report})
+        return report
+
+    @staticmethod
+    def _stage_order(stage: str) -> tuple:
+        return (STAGES.index(stage), "") if stage in STAGES else (len(STAGES), stage)
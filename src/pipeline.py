@@ -0,0 +1,304 @@
+import math
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import supervisely as sly
+from supervisely.io.fs import silent_remove
+
+
+class Budget:
+    """Limits the total size of resources in use, e.g. disk space or memory.
+
+    `acquire` blocks until enough is released by `release`. A single item
+    larger than the budget is admitted when nothing else is in use.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def can_acquire(self, size: int) -> bool:
+        with self._cond:
+            return self.used == 0 or self.used + size <= self.max_bytes
+
+    def acquire(self, size: int) -> None:
+        with self._cond:
+            while self.used > 0 and self.used + size > self.max_bytes:
+                self._cond.wait()
+            self.used += size
+
+    def release(self, size: int) -> None:
+        with self._cond:
+            self.used = max(0, self.used - size)
+            self._cond.notify_all()
+
+
+class SourceImages(NamedTuple):
+    source: str
+    # number of images converted from the source file in this batch
+    count: int
+
+
+@dataclass
+class UploadBatch:
+    dataset_id: int
+    paths: List[str] = field(default_factory=list)
+    names: List[str] = field(default_factory=list)
+    metas: List[Dict[str, str]] = field(default_factory=list)
+    # annotation JSONs, volume tag collections in volume mode
+    anns: list = field(default_factory=list)
+    # source files of the images, in the same order
+    source_images: List[SourceImages] = field(default_factory=list)
+    # source files to remove together with the converted ones
+    sources: List[str] = field(default_factory=list)
+    # called when the batch is processed, successfully or not
+    on_done: Optional[Callable[[], None]] = None
+    # called when all images of the batch are uploaded
+    on_uploaded: Optional[Callable[[], None]] = None
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def get_sizes(self) -> List[int]:
+        return [os.path.getsize(path) if os.path.exists(path) else 0 for path in self.paths]
+
+    def split(self, max_images: int, max_bytes: int) -> List["UploadBatch"]:
+        """Splits images into parts limited by the number of images and their total size.
+
+        Sources to remove and the callbacks are not copied to the parts.
+        """
+        if len(self.anns) != len(self.paths):
+            # annotations can't be matched to the images, the batch is uploaded as is
+            return [self]
+
+        bounds, start, part_bytes = [], 0, 0
+        for i, size in enumerate(self.get_sizes()):
+            if i > start and (i - start >= max_images or part_bytes + size > max_bytes):
+                bounds.append((start, i))
+                start, part_bytes = i, 0
+            part_bytes += size
+        bounds.append((start, len(self.paths)))
+        if len(bounds) == 1:
+            return [self]
+        return [self._slice(start, end) for start, end in bounds]
+
+    def _slice(self, start: int, end: int) -> "UploadBatch":
+        source_images, offset = [], 0
+        for item in self.source_images:
+            first, last = max(start, offset), min(end, offset + item.count)
+            if first < last:
+                source_images.append(SourceImages(item.source, last - first))
+            offset += item.count
+        return UploadBatch(
+            dataset_id=self.dataset_id,
+            paths=self.paths[start:end],
+            names=self.names[start:end],
+            metas=self.metas[start:end],
+            anns=self.anns[start:end],
+            source_images=source_images,
+        )
+
+
+class BatchSizeController:
+    """Adapts the size of upload requests to the observed upload throughput and errors.
+
+    Requests are sized to take about `target_seconds` at the measured throughput:
+    the limits grow while requests are fast and shrink when they are slow, every
+    failed request halves them.
+    """
+
+    GROWTH = 1.5
+    # weight of the last observation in the throughput estimate
+    SMOOTHING = 0.3
+
+    def __init__(
+        self,
+        max_images: int,
+        max_bytes: int,
+        min_images: int = 1,
+        min_bytes: int = 1024 * 1024,
+        target_seconds: float = 30.0,
+        initial_images: int = None,
+        initial_bytes: int = None,
+    ):
+        self.min_images, self.max_images = min_images, max(min_images, max_images)
+        self.min_bytes, self.max_bytes = min_bytes, max(min_bytes, max_bytes)
+        self.target_seconds = target_seconds
+        self.images = self._clamp_images(initial_images or self.max_images)
+        self.bytes = self._clamp_bytes(initial_bytes or self.max_bytes)
+        self.throughput: Optional[float] = None
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def limits(self) -> tuple:
+        with self._lock:
+            return self.images, self.bytes
+
+    def observe(self, images: int, nbytes: int, seconds: float, ok: bool) -> None:
+        with self._lock:
+            if not ok:
+                self.errors += 1
+                self.images = self._clamp_images(min(self.images, images) // 2)
+                self.bytes = self._clamp_bytes(min(self.bytes, nbytes) // 2)
+                return
+            if seconds <= 0 or nbytes <= 0:
+                return
+            throughput = nbytes / seconds
+            if self.throughput is None:
+                self.throughput = throughput
+            else:
+                self.throughput += self.SMOOTHING * (throughput - self.throughput)
+
+            if seconds < self.target_seconds / 2:
+                self.images = self._clamp_images(math.ceil(self.images * self.GROWTH))
+                self.bytes = self._clamp_bytes(int(self.bytes * self.GROWTH))
+            elif seconds > self.target_seconds:
+                ratio = self.target_seconds / seconds
+                self.images = self._clamp_images(int(self.images * ratio))
+                self.bytes = self._clamp_bytes(int(self.throughput * self.target_seconds))
+
+    def _clamp_images(self, value: int) -> int:
+        return min(max(value, self.min_images), self.max_images)
+
+    def _clamp_bytes(self, value: int) -> int:
+        return min(max(value, self.min_bytes), self.max_bytes)
+
+
+class UploadPipeline:
+    """Uploads converted batches in background threads while the next ones are converted.
+
+    The queue is bounded: `put` blocks while `max_queued` batches are waiting, so the
+    amount of converted files kept on disk is limited. Converted files are removed
+    as soon as their batch is processed.
+
+    With the batch size controller, batches are split into upload requests by the
+    number of images and bytes, a failed request is split in halves and retried.
+    `on_uploaded` is called with the source images of a batch once all of its parts
+    are uploaded.
+    """
+
+    _STOP = None
+
+    def __init__(
+        self,
+        upload_func: Callable[[UploadBatch], None],
+        workers: int = 1,
+        max_queued: int = 1,
+        controller: BatchSizeController = None,
+        retries: int = 0,
+        on_uploaded: Callable[[List[SourceImages]], None] = None,
+    ):
+        self._upload_func = upload_func
+        self._on_uploaded = on_uploaded
+        self._controller = controller
+        self._retries = retries
+        self._queue = queue.Queue(maxsize=max(1, max_queued))
+        self._error: Optional[Exception] = None
+        self._threads = [
+            threading.Thread(target=self._run, name=f"upload-worker-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, batch: UploadBatch) -> None:
+        self._raise_if_failed()
+        if self._on_uploaded is not None:
+            batch.on_uploaded = partial(self._on_uploaded, batch.source_images)
+        if self._controller is None:
+            self._queue.put(batch)
+            return
+        parts = batch.split(*self._controller.limits())
+        if len(parts) == 1:
+            self._queue.put(batch)
+            return
+        # sources are removed and `on_done` is called once all parts are processed,
+        # `on_uploaded` once all parts are uploaded, whatever order they finish in
+        on_done = _countdown(len(parts), partial(_remove_sources, batch))
+        on_uploaded = _countdown(len(parts), batch.on_uploaded)
+        for part in parts:
+            part.on_done = on_done
+            part.on_uploaded = on_uploaded
+            self._queue.put(part)
+
+    def close(self) -> None:
+        """Waits until all queued batches are uploaded and stops the workers."""
+        for _ in self._threads:
+            self._queue.put(self._STOP)
+        for thread in self._threads:
+            thread.join()
+        self._raise_if_failed()
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def _run(self) -> None:
+        while True:
+            batch = self._queue.get()
+            if batch is self._STOP:
+                break
+            try:
+                # keep draining the queue after a failure, so the producer is never blocked
+                if self._error is None:
+                    self._upload(batch, self._retries)
+                    if batch.on_uploaded is not None:
+                        batch.on_uploaded()
+            except Exception as e:
+                sly.logger.error(f"Failed to upload batch of {len(batch)} images: {repr(e)}")
+                self._error = e
+            finally:
+                for path in batch.paths + batch.sources:
+                    silent_remove(path)
+                if batch.on_done is not None:
+                    batch.on_done()
+
+    def _upload(self, batch: UploadBatch, retries: int) -> None:
+        if self._controller is None:
+            self._upload_func(batch)
+            return
+        nbytes = sum(batch.get_sizes())
+        start = time.perf_counter()
+        try:
+            self._upload_func(batch)
+        except Exception as e:
+            self._controller.observe(len(batch), nbytes, time.perf_counter() - start, ok=False)
+            parts = batch.split(math.ceil(len(batch) / 2), nbytes)
+            if retries <= 0 or len(parts) == 1:
+                raise
+            sly.logger.warning(
+                f"Failed to upload batch of {len(batch)} images ({repr(e)}), "
+                f"retrying in {len(parts)} parts"
+            )
+            for part in parts:
+                self._upload(part, retries - 1)
+            return
+        self._controller.observe(len(batch), nbytes, time.perf_counter() - start, ok=True)
+
+
+def _remove_sources(batch: UploadBatch) -> None:
+    for path in batch.sources:
+        silent_remove(path)
+    if batch.on_done is not None:
+        batch.on_done()
+
+
+def _countdown(count: int, callback: Optional[Callable[[], None]]) -> Callable[[], None]:
+    """Returns a function that calls `callback` on its `count`-th call."""
+    lock = threading.Lock()
+    remaining = [count]
+
+    def on_done():
+        with lock:
+            remaining[0] -= 1
+            is_last = remaining[0] == 0
+        if is_last and callback is not None:
+            callback()
+
+    return on_done
@@ -1,12 +1,22 @@
 import json
 import os
+import threading
 from distutils.util import strtobool
+from typing import Dict, List, Optional, Set
 
 import supervisely as sly
 from dotenv import load_dotenv
 from supervisely.app.v1.app_service import AppService
 from supervisely.io.fs import mkdir
 
+from checkpoint import ImportCheckpoint
+from conversion_cache import ConversionCache
+from converter import NRRD_ENCODINGS, SKIP_TAG_VRS, ConversionEngine, get_memory_limit
+from decoding import DECODER_BACKENDS
+from dedup import DEDUP_POLICIES, KEEP_ALL, Deduplicator
+from dicom_index import DicomIndex
+from local_project import LocalProject
+from metrics import MetricsRecorder
 from workflow import Workflow
 
 if sly.is_development():
@@ -35,6 +45,18 @@ if ADD_DCM_TAGS == ADD_ONLY_SPECIFIED:
     except:
         my_app.logger.warn("Invalid JSON input in modal window editor")
 
+# Comma-separated DICOM VRs to skip (or to keep only) when tags are extracted
+DCM_TAGS_SKIP_VRS: tuple = SKIP_TAG_VRS
+if os.environ.get("DCM_TAGS_SKIP_VRS") is not None:
+    DCM_TAGS_SKIP_VRS = tuple(
+        vr.strip().upper() for vr in os.environ["DCM_TAGS_SKIP_VRS"].split(",") if vr.strip()
+    )
+DCM_TAGS_ALLOW_VRS: tuple = None
+if os.environ.get("DCM_TAGS_ALLOW_VRS"):
+    DCM_TAGS_ALLOW_VRS = tuple(
+        vr.strip().upper() for vr in os.environ["DCM_TAGS_ALLOW_VRS"].split(",") if vr.strip()
+    )
+
 PREPARED_GROUP_TAG_NAME: str = os.environ.get("modal.state.predefinedGroupTag")
 MANUAL_GROUP_TAG_NAME: str = os.environ.get("modal.state.manualGroupTag")
 
@@ -47,17 +69,182 @@ else:
 INPUT_DIR: str = os.environ.get("modal.state.slyFolder")
 INPUT_FILE: str = os.environ.get("modal.state.slyFile")
 
+# Local project directory to import instead of the Team Files input
+LOCAL_INPUT_DIR: str = os.environ.get("LOCAL_INPUT_DIR")
+
 if INPUT_DIR:
     IS_ON_AGENT = api.file.is_on_agent(INPUT_DIR)
-else:
+elif INPUT_FILE:
     IS_ON_AGENT = api.file.is_on_agent(INPUT_FILE)
+else:
+    IS_ON_AGENT = False
 
 WITH_ANNS: bool = bool(strtobool(os.environ.get("modal.state.withAnns")))
 
+# Encoding of converted NRRD files: "raw" is the cheapest for CPU, "gzip" and "bzip2"
+# reduce uploaded bytes, compression level is from 1 (fastest) to 9 (smallest)
+NRRD_ENCODING: str = os.environ.get(
+    "modal.state.nrrdEncoding", os.environ.get("NRRD_ENCODING", "gzip")
+).lower()
+if NRRD_ENCODING not in NRRD_ENCODINGS:
+    my_app.logger.warn(f"Unknown NRRD encoding '{NRRD_ENCODING}', 'gzip' will be used")
+    NRRD_ENCODING = "gzip"
+NRRD_COMPRESSION_LEVEL: int = int(
+    os.environ.get("modal.state.nrrdCompressionLevel", os.environ.get("NRRD_COMPRESSION_LEVEL", 9))
+)
+NRRD_COMPRESSION_LEVEL = min(max(NRRD_COMPRESSION_LEVEL, 1), 9)
+
+# Pixel data decoders (pydicom handlers) tried in order, e.g. "pylibjpeg,gdcm,pillow",
+# pydicom chooses the decoder itself if none is set
+DECODER_BACKENDS_ORDER: tuple = ()
+for _name in os.environ.get("DECODER_BACKENDS", "").split(","):
+    _name = _name.strip().lower()
+    if _name and _name not in DECODER_BACKENDS:
+        my_app.logger.warn(f"Unknown pixel data decoder '{_name}', it will be skipped")
+    elif _name:
+        DECODER_BACKENDS_ORDER += (_name,)
+# Decoders preferred for transfer syntaxes, e.g. "1.2.840.10008.1.2.4.90=pylibjpeg"
+TRANSFER_SYNTAX_DECODERS: tuple = ()
+for _pair in os.environ.get("TRANSFER_SYNTAX_DECODERS", "").split(","):
+    if "=" not in _pair:
+        continue
+    _uid, _name = (value.strip() for value in _pair.split("=", 1))
+    if _name.lower() not in DECODER_BACKENDS:
+        my_app.logger.warn(f"Unknown pixel data decoder '{_name}', it will be skipped")
+    else:
+        TRANSFER_SYNTAX_DECODERS += ((_uid, _name.lower()),)
+
+# Number of processes converting DICOM files, 1 disables the process pool
+CONVERT_WORKERS: int = int(os.environ.get("CONVERT_WORKERS") or os.cpu_count() or 1)
+# Estimated memory of files converted at once, half of the container memory by default
+CONVERT_MEMORY_BUDGET_BYTES: int = (
+    int(os.environ.get("CONVERT_MEMORY_BUDGET_MB") or get_memory_limit() // 2 // 1024 // 1024)
+    * 1024
+    * 1024
+)
+
+# Number of threads uploading converted batches and number of converted batches
+# waiting for upload, together they limit the disk space used by converted files
+UPLOAD_WORKERS: int = int(os.environ.get("UPLOAD_WORKERS", 2))
+UPLOAD_QUEUE_SIZE: int = int(os.environ.get("UPLOAD_QUEUE_SIZE", 2))
+
+# Number of datasets imported at once, they share the conversion and upload workers
+DATASET_WORKERS: int = max(1, int(os.environ.get("DATASET_WORKERS", 4)))
+
+# Number of source files converted at once, one file can expand into many images
+CONVERT_BATCH_SIZE: int = int(os.environ.get("CONVERT_BATCH_SIZE", 50))
+# Converted batches are split into upload requests limited by the number of images
+# and their size, the limits adapt to keep each request about the target duration
+UPLOAD_BATCH_IMAGES: int = int(os.environ.get("UPLOAD_BATCH_IMAGES", 50))
+UPLOAD_BATCH_MIN_IMAGES: int = int(os.environ.get("UPLOAD_BATCH_MIN_IMAGES", 1))
+UPLOAD_BATCH_MAX_IMAGES: int = int(os.environ.get("UPLOAD_BATCH_MAX_IMAGES", 500))
+UPLOAD_BATCH_MIN_BYTES: int = int(os.environ.get("UPLOAD_BATCH_MIN_MB", 8)) * 1024 * 1024
+UPLOAD_BATCH_MAX_BYTES: int = int(os.environ.get("UPLOAD_BATCH_MAX_MB", 512)) * 1024 * 1024
+UPLOAD_TARGET_SECONDS: float = float(os.environ.get("UPLOAD_TARGET_SECONDS", 30))
+# Number of times a failed request is split in halves and retried
+UPLOAD_RETRIES: int = int(os.environ.get("UPLOAD_RETRIES", 2))
+
+# Import archives member by member instead of unpacking them, the size of local
+# source files that are not yet uploaded is limited by the working set size
+STREAM_ARCHIVE: bool = bool(
+    strtobool(
+        os.environ.get("modal.state.streamArchive", os.environ.get("STREAM_ARCHIVE", "false"))
+    )
+)
+# Download files of the input folder concurrently and convert them as they arrive
+STREAM_FOLDER: bool = bool(
+    strtobool(
+        os.environ.get("modal.state.streamFolder", os.environ.get("STREAM_FOLDER", "false"))
+    )
+)
+DOWNLOAD_WORKERS: int = int(os.environ.get("DOWNLOAD_WORKERS", 8))
+STREAM_WORKING_SET_BYTES: int = int(os.environ.get("STREAM_WORKING_SET_MB", 2048)) * 1024 * 1024
+
 STORAGE_DIR: str = my_app.data_dir
 mkdir(STORAGE_DIR, True)
 
+# Convert into a local Supervisely format project instead of uploading to the instance
+CONVERT_ONLY: bool = bool(
+    strtobool(os.environ.get("modal.state.convertOnly", os.environ.get("CONVERT_ONLY", "false")))
+)
+CONVERT_OUTPUT_DIR: str = os.environ.get(
+    "CONVERT_OUTPUT_DIR", os.path.join(STORAGE_DIR, "converted")
+)
+
+# Assemble every series (SeriesInstanceUID) into a single 3D NRRD volume and import them
+# into a volumes project, series are grouped in the directory import only
+VOLUME_MODE: bool = bool(
+    strtobool(os.environ.get("modal.state.volumeMode", os.environ.get("VOLUME_MODE", "false")))
+)
+if VOLUME_MODE and CONVERT_ONLY:
+    my_app.logger.warn("Series-to-volume mode is not supported in convert-only mode, disabling it")
+    VOLUME_MODE = False
+if VOLUME_MODE and WITH_ANNS:
+    my_app.logger.warn("Supervisely format annotations are not imported in series-to-volume mode")
+if VOLUME_MODE and (STREAM_ARCHIVE or STREAM_FOLDER):
+    my_app.logger.warn("Series-to-volume mode downloads the whole input before the import")
+    STREAM_ARCHIVE = STREAM_FOLDER = False
+
+# Import state of every file is saved to the checkpoint manifest, with the resume option
+# a restarted import reuses the project and skips already imported files. The manifest
+# must outlive the task: it is kept in the app cache directory of the agent by default,
+# the task data directory is not kept after a restart
+RESUME_IMPORT: bool = bool(
+    strtobool(os.environ.get("modal.state.resume", os.environ.get("RESUME_IMPORT", "false")))
+)
+CHECKPOINT_DIR: str = os.environ.get(
+    "CHECKPOINT_DIR", os.path.join(my_app.cache_dir, "import_checkpoints")
+)
+
+# Repeated DICOM instances (same SOPInstanceUID or pixel data): "keep_all", "keep_first"
+# or "skip" all copies. The import can target an existing project, its datasets with the
+# same names are reused and images already in them can be skipped by hash
+DEDUP_POLICY: str = os.environ.get(
+    "modal.state.dedupPolicy", os.environ.get("DEDUP_POLICY", KEEP_ALL)
+).lower()
+if DEDUP_POLICY not in DEDUP_POLICIES:
+    my_app.logger.warn(f"Unknown deduplication policy '{DEDUP_POLICY}', '{KEEP_ALL}' will be used")
+    DEDUP_POLICY = KEEP_ALL
+# the modal state always has the option, it is empty (null) if no project is selected
+TARGET_PROJECT_ID: Optional[int] = None
+for _value in (os.environ.get("modal.state.targetProjectId"), os.environ.get("TARGET_PROJECT_ID")):
+    if _value is not None and _value.strip().isdigit() and int(_value) > 0:
+        TARGET_PROJECT_ID = int(_value)
+        break
+SKIP_EXISTING_IMAGES: bool = bool(
+    strtobool(
+        os.environ.get("modal.state.skipExisting", os.environ.get("SKIP_EXISTING_IMAGES", "false"))
+    )
+)
+
+# Stage timings are logged every METRICS_LOG_INTERVAL seconds (0 disables periodic logs),
+# the final report is also uploaded to the Team Files directory if it is set
+METRICS_LOG_INTERVAL: float = float(os.environ.get("METRICS_LOG_INTERVAL", 0))
+METRICS_REPORT_DIR: str = os.environ.get("METRICS_REPORT_DIR")
+
+# Converted files are cached by content in this directory (e.g. a volume mounted to
+# the agent) and reused by later imports, the least recently used are evicted
+CONVERSION_CACHE_DIR: str = os.environ.get("CONVERSION_CACHE_DIR")
+CONVERSION_CACHE_MAX_BYTES: int = (
+    int(os.environ.get("CONVERSION_CACHE_MAX_MB", 10240)) * 1024 * 1024
+)
+
 SLY_FORMAT_DOCS = "https://docs.supervise.ly/data-organization/00_ann_format_navi"
 project_id: int = None
 project_meta: sly.ProjectMeta = sly.ProjectMeta()
+project_meta_lock = threading.Lock()
+# tag metas created during conversion, the new ones are added to project_meta in one go
+tag_metas: Dict[str, sly.TagMeta] = {}
+pending_tag_metas: List[sly.TagMeta] = []
+project_meta_synced: bool = False
 project_meta_from_sly_format: sly.ProjectMeta = sly.ProjectMeta()
+metrics: MetricsRecorder = MetricsRecorder(log_interval=METRICS_LOG_INTERVAL)
+dicom_index: DicomIndex = DicomIndex(GROUP_TAG_NAME, metrics)
+conversion_engine: ConversionEngine = None
+conversion_cache: ConversionCache = None
+local_project: LocalProject = None
+deduplicator: Deduplicator = Deduplicator(DEDUP_POLICY)
+# images that are in the reused datasets before the import and hashes of them by dataset
+existing_image_ids: Set[int] = set()
+dataset_image_hashes: Dict[int, Set[str]] = {}
+checkpoint: ImportCheckpoint = None
@@ -1,93 +1,509 @@
 import functools
-import json
 import os
 import tarfile
+import time
 import zipfile
 from functools import partial
 from os.path import basename, dirname, exists, join, normpath
-from pathlib import Path
-from typing import Callable, Dict, List, Tuple
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 
-import nrrd
-import numpy as np
-import pydicom
 import supervisely as sly
-from pydicom import FileDataset
 from supervisely.io.fs import (
-    file_exists,
     get_file_ext,
+    get_file_hash,
     get_file_name_with_ext,
+    mkdir,
+    remove_dir,
     silent_remove,
 )
 from tqdm import tqdm
 
 import sly_globals as g
+from checkpoint import (
+    ANNOTATED,
+    CONVERTED,
+    DISCOVERED,
+    SKIPPED,
+    ImportCheckpoint,
+    get_manifest_path,
+)
+from conversion_cache import ConversionCache, convert_and_hash, hash_file
+from converter import (
+    ConversionEngine,
+    ConversionResult,
+    ConversionSettings,
+    estimate_memory,
+)
+from local_project import LocalProject
+from metrics import (
+    ANNOTATION_BUILD,
+    ANNOTATION_UPLOAD,
+    DOWNLOAD,
+    HEADER_PARSE,
+    IMAGE_UPLOAD,
+    LOCAL_WRITE,
+    META_UPDATE,
+    NRRD_WRITE,
+    PIXEL_DECODE,
+)
+from pipeline import BatchSizeController, SourceImages, UploadBatch, UploadPipeline
+from volume import VolumeResult, convert_series, estimate_series_memory, group_series
 
+# Input archives are unpacked into this subdirectory of the storage directory
+UNPACK_DIR_NAME = "unpacked"
+# Number of interned tag JSONs, DICOM tag values mostly repeat across files of a study
+TAG_JSON_CACHE_SIZE = 16384
 
-def import_dataset(api: sly.Api, dataset_path: str) -> None:
-    """Imports a single dataset into the project."""
-    # Create a new dataset in the project
-    dataset_name = basename(normpath(dataset_path))
-    dataset_info = api.dataset.create(
-        project_id=g.project_id, name=dataset_name, change_name_if_conflict=True
-    )
 
-    batch_size = 50
-    # Process the images in batches
+class DatasetFiles(NamedTuple):
+    dataset_info: sly.DatasetInfo
+    images_paths: List[str]
+    annotations_paths: List[str]
+
+
+def prepare_dataset(api: sly.Api, dataset_path: str) -> Optional[DatasetFiles]:
+    """Creates the dataset and selects its files to import.
+
+    Datasets are prepared one by one in their order, so dataset creation and
+    deduplication give the same result however many datasets are imported at once.
+    """
+    # Create a new dataset in the project (or reuse it if the import is resumed)
+    dataset_info = create_dataset(api, dataset_path)
+
     ds_images_paths, ds_annotations_paths = get_paths(dataset_path, with_anns=g.WITH_ANNS)
-    batch_progress = tqdm(total=len(ds_images_paths), desc="Processing Images", unit="image")
+    pending = [
+        i
+        for i, path in enumerate(ds_images_paths)
+        if not g.checkpoint.is_done(checkpoint_key(path)) and is_unique_instance(path)
+    ]
+    if len(pending) == 0 and dataset_info.images_count:
+        sly.logger.info(f"Dataset '{dataset_info.name}' is already imported")
+        return None
+    ds_images_paths = [ds_images_paths[i] for i in pending]
+    ds_annotations_paths = [ds_annotations_paths[i] for i in pending]
+    mark_discovered(ds_images_paths)
+    return DatasetFiles(dataset_info, ds_images_paths, ds_annotations_paths)
+
+
+def import_dataset(api: sly.Api, dataset: DatasetFiles, pipeline: UploadPipeline) -> None:
+    """Imports a single dataset into the project."""
+    if g.VOLUME_MODE:
+        import_volume_dataset(api, dataset, pipeline)
+        return
+    dataset_info = dataset.dataset_info
+    batch_size = g.CONVERT_BATCH_SIZE
+    # Process the images in batches, converted batches are uploaded in the background
+    batch_progress = tqdm(
+        total=len(dataset.images_paths), desc=f"Processing '{dataset_info.name}'", unit="image"
+    )
 
+    images_count = 0
     for batch_imgs, batch_anns in zip(
-        sly.batched(ds_images_paths, batch_size),
-        sly.batched(ds_annotations_paths, batch_size),
+        sly.batched(dataset.images_paths, batch_size),
+        sly.batched(dataset.annotations_paths, batch_size),
     ):
-        import_images(api, dataset_info, batch_imgs, batch_anns)
+        batch = convert_images(dataset_info, batch_imgs, batch_anns)
+        if len(batch) > 0:
+            images_count += len(batch)
+            pipeline.put(batch)
         batch_progress.update(len(batch_imgs))
     batch_progress.close()
 
+    if images_count == 0 and not dataset_info.images_count:
+        remove_dataset(api, dataset_info)
+        raise FileNotFoundError("Nothing to import")
 
-def import_images(
-    api: sly.Api, dataset: sly.DatasetInfo, batch_imgs: list, batch_anns: list
-) -> None:
-    img_paths = []
-    img_names = []
-    anns = []
-    img_metas = []
 
-    for image_path, annotation_path in zip(batch_imgs, batch_anns):
-        try:
-            image_paths, image_names, anns_from_dcm, dcm_meta = dcm2nrrd(
-                image_path=image_path,
-                group_tag_name=g.GROUP_TAG_NAME,
+def import_volume_dataset(api: sly.Api, dataset: DatasetFiles, pipeline: UploadPipeline) -> None:
+    """Imports every series of the dataset as a single 3D volume."""
+    dataset_info = dataset.dataset_info
+    entries = [g.dicom_index.get(path) for path in dataset.images_paths]
+    series = group_series([entry for entry in entries if entry is not None])
+    # a series is converted by a single worker, so all workers get a series at once
+    batch_size = max(1, g.CONVERT_WORKERS)
+    batch_progress = tqdm(
+        total=len(series), desc=f"Processing '{dataset_info.name}'", unit="volume"
+    )
+
+    volumes_count = 0
+    for batch_series in sly.batched(series, batch_size):
+        batch = convert_volumes(dataset_info, batch_series)
+        if len(batch) > 0:
+            volumes_count += len(batch)
+            pipeline.put(batch)
+        batch_progress.update(len(batch_series))
+    batch_progress.close()
+
+    if volumes_count == 0 and not dataset_info.images_count:
+        remove_dataset(api, dataset_info)
+        raise FileNotFoundError("Nothing to import")
+
+
+def convert_volumes(dataset: sly.DatasetInfo, batch_series: list) -> UploadBatch:
+    """Converts every series to a volume, the batch holds volume tags instead of annotations."""
+    batch = UploadBatch(dataset_id=dataset.id)
+    series_paths = [[entry.path for entry in entries] for entries in batch_series]
+    costs = [
+        estimate_series_memory([entry.header for entry in entries]) for entries in batch_series
+    ]
+    for image_paths, result in g.conversion_engine.map(convert_series, series_paths, costs):
+        if isinstance(result, Exception):
+            sly.logger.warning(
+                f"Series of {len(image_paths)} files starting with '{image_paths[0]}' "
+                f"will be skipped due to: {repr(result)}"
             )
-        except Exception as e:
-            sly.logger.warning(f"File '{image_path}' will be skipped due to: {repr(e)}")
             continue
+        source_size = sum(get_source_size(path) for path in image_paths)
+        for stage in (HEADER_PARSE, PIXEL_DECODE):
+            g.metrics.record(stage, result.timings.get(stage, 0), len(image_paths), source_size)
+        g.metrics.record(
+            NRRD_WRITE, result.timings.get(NRRD_WRITE, 0), nbytes=os.path.getsize(result.path)
+        )
+
+        # the volume is mapped to the first file of the series in the checkpoint
+        batch.source_images.append(SourceImages(image_paths[0], 1))
+        batch.source_images.extend(SourceImages(path, 0) for path in image_paths[1:])
+        batch.paths.append(result.path)
+        batch.names.append(result.name)
+        batch.metas.append(result.meta)
+        batch.anns.append(create_volume_tags(result))
+    g.checkpoint.mark([checkpoint_key(item.source) for item in batch.source_images], CONVERTED)
+    return batch
+
+
+def mark_discovered(paths: List[str]) -> None:
+    """Marks the files to import, their deduplication keys are saved for a resumed import."""
+    g.checkpoint.mark([checkpoint_key(path) for path in paths], DISCOVERED)
+    if not g.deduplicator.enabled:
+        return
+    keys = {}
+    for path in paths:
+        entry = g.dicom_index.get(path)
+        key = None if entry is None else g.deduplicator.get_key(entry)
+        if key is not None:
+            keys[checkpoint_key(path)] = key
+    g.checkpoint.add_instance_keys(keys)
+
+
+def is_unique_instance(path: str) -> bool:
+    """Checks the file against the deduplication policy, duplicates are marked as skipped."""
+    entry = g.dicom_index.get(path)
+    if entry is None or g.deduplicator.keep(entry):
+        return True
+    g.checkpoint.mark([checkpoint_key(path)], SKIPPED)
+    return False
 
-        img_paths.extend(image_paths)
-        img_names.extend(image_names)
-        img_metas.extend([dcm_meta for _ in image_paths])
 
-        if g.WITH_ANNS:
-            ann = sly.Annotation.load_json_file(annotation_path, g.project_meta_from_sly_format)
+def is_already_uploaded(dataset: sly.DatasetInfo, result: ConversionResult) -> bool:
+    """Checks if all images converted from the file are already in the dataset."""
+    existing_hashes = g.dataset_image_hashes.get(dataset.id)
+    if not g.SKIP_EXISTING_IMAGES or not existing_hashes:
+        return False
+    return all(get_file_hash(path) in existing_hashes for path in result.paths)
 
-            for ann_dcm in anns_from_dcm:
-                ann = ann.merge(ann_dcm)
-            anns.append(ann)
-        else:
-            anns.extend(anns_from_dcm)
 
-    if len(img_paths) == 0:
-        api.dataset.remove(dataset.id)
-        raise FileNotFoundError("Nothing to import")
+def checkpoint_key(path: str) -> str:
+    """Returns the path that is the same for every run of the import."""
+    return os.path.relpath(path, g.STORAGE_DIR)
+
+
+def create_dataset(api: sly.Api, dataset_path: str) -> sly.DatasetInfo:
+    """Creates dataset for the local directory.
+
+    The dataset is reused if the import is resumed, the dataset with the same name
+    is reused if the import targets an existing project.
+    """
+    if g.CONVERT_ONLY:
+        return g.local_project.create_dataset(basename(normpath(dataset_path)))
+    key = checkpoint_key(dataset_path)
+    dataset_name = basename(normpath(dataset_path))
+    dataset_info = None
+    dataset_id = g.checkpoint.get_dataset_id(key)
+    if dataset_id is not None:
+        dataset_info = api.dataset.get_info_by_id(dataset_id)
+    if dataset_info is None and g.TARGET_PROJECT_ID is not None:
+        dataset_info = api.dataset.get_info_by_name(g.project_id, dataset_name)
+    if dataset_info is None:
+        dataset_info = api.dataset.create(
+            project_id=g.project_id, name=dataset_name, change_name_if_conflict=True
+        )
+    elif dataset_info.images_count and not g.VOLUME_MODE:
+        load_existing_images(api, dataset_info.id)
+    g.checkpoint.set_dataset_id(key, dataset_info.id)
+    return dataset_info
+
+
+def load_existing_images(api: sly.Api, dataset_id: int) -> None:
+    """Remembers images that are in the dataset before the import, they are never removed."""
+    image_infos = api.image.get_list(dataset_id, force_metadata_for_links=False)
+    g.existing_image_ids.update(image_info.id for image_info in image_infos)
+    g.dataset_image_hashes[dataset_id] = {image_info.hash for image_info in image_infos}
+
+
+def remove_dataset(api: sly.Api, dataset_info: sly.DatasetInfo) -> None:
+    if g.CONVERT_ONLY:
+        g.local_project.remove_dataset(dataset_info.id)
+    else:
+        api.dataset.remove(dataset_info.id)
+
+
+def create_upload_pipeline(api: sly.Api) -> UploadPipeline:
+    if g.VOLUME_MODE:
+        return UploadPipeline(
+            upload_func=partial(upload_volumes, api),
+            workers=g.UPLOAD_WORKERS,
+            max_queued=g.UPLOAD_QUEUE_SIZE,
+            on_uploaded=mark_annotated,
+        )
+    if g.CONVERT_ONLY:
+        return UploadPipeline(
+            upload_func=write_local_images,
+            workers=g.UPLOAD_WORKERS,
+            max_queued=g.UPLOAD_QUEUE_SIZE,
+            on_uploaded=mark_annotated,
+        )
+    return UploadPipeline(
+        upload_func=partial(upload_images, api),
+        workers=g.UPLOAD_WORKERS,
+        max_queued=g.UPLOAD_QUEUE_SIZE,
+        controller=BatchSizeController(
+            max_images=g.UPLOAD_BATCH_MAX_IMAGES,
+            max_bytes=g.UPLOAD_BATCH_MAX_BYTES,
+            min_images=g.UPLOAD_BATCH_MIN_IMAGES,
+            min_bytes=g.UPLOAD_BATCH_MIN_BYTES,
+            target_seconds=g.UPLOAD_TARGET_SECONDS,
+            initial_images=g.UPLOAD_BATCH_IMAGES,
+        ),
+        retries=g.UPLOAD_RETRIES,
+        on_uploaded=mark_annotated,
+    )
+
+
+def convert_images(dataset: sly.DatasetInfo, batch_imgs: list, batch_anns: list) -> UploadBatch:
+    batch = UploadBatch(dataset_id=dataset.id)
 
-    dst_image_infos = api.image.upload_paths(
-        dataset_id=dataset.id, names=img_names, paths=img_paths, metas=img_metas
+    start = time.perf_counter()
+    converted = convert_with_cache(batch_imgs)
+    for (image_path, result), annotation_path in zip(converted, batch_anns):
+        if isinstance(result, Exception):
+            sly.logger.warning(f"File '{image_path}' will be skipped due to: {repr(result)}")
+            continue
+        if not result.cached:
+            record_conversion_metrics(result)
+        if is_already_uploaded(dataset, result):
+            # the converted images are not uploaded
+            g.deduplicator.add_existing(sum(os.path.getsize(path) for path in result.paths))
+            for path in result.paths:
+                silent_remove(path)
+            g.checkpoint.mark([checkpoint_key(image_path)], SKIPPED)
+            continue
+        start_ann = time.perf_counter()
+        ann_json = None
+        if g.WITH_ANNS and annotation_path is not None:
+            try:
+                ann_json = sly.Annotation.load_json_file(
+                    annotation_path, g.project_meta_from_sly_format
+                ).to_json()
+            except Exception as e:
+                sly.logger.warning(
+                    f"Annotation '{annotation_path}' will be skipped due to: {repr(e)}"
+                )
+        ann_jsons = create_ann_jsons(result, g.GROUP_TAG_NAME, ann_json)
+
+        batch.source_images.append(SourceImages(image_path, len(result.paths)))
+        batch.paths.extend(result.paths)
+        batch.names.extend(result.names)
+        batch.metas.extend([result.meta for _ in result.paths])
+        batch.anns.extend(ann_jsons)
+        g.metrics.record(ANNOTATION_BUILD, time.perf_counter() - start_ann, len(ann_jsons))
+    g.checkpoint.mark([checkpoint_key(item.source) for item in batch.source_images], CONVERTED)
+    g.deduplicator.add_conversion_time(
+        sum(get_source_size(path) for path in batch_imgs), time.perf_counter() - start
+    )
+    return batch
+
+
+def convert_with_cache(
+    image_paths: List[str],
+) -> Iterator[Tuple[str, Union[ConversionResult, Exception]]]:
+    """Restores cached files and converts the rest, yields (path, result) in the input order."""
+    if g.conversion_cache is None:
+        costs = [get_conversion_cost(path) for path in image_paths]
+        yield from g.conversion_engine.convert(image_paths, costs)
+        return
+
+    keys, cached = {}, {}
+    for path in image_paths:
+        entry = g.dicom_index.get(path)
+        if entry is not None:
+            keys[path] = g.conversion_cache.get_key(entry)
+    # sources are hashed in the conversion workers, only the ones with a cached fingerprint
+    known = [path for path in keys if g.conversion_cache.contains(keys[path])]
+    for path, source_hash in g.conversion_engine.map(hash_file, known):
+        if isinstance(source_hash, Exception):
+            sly.logger.debug(f"Failed to hash '{path}' for the conversion cache: {source_hash}")
+            continue
+        cached[path] = g.conversion_cache.get(path, keys[path], source_hash)
+    # the lookup counts its misses, files that are not looked up are misses as well
+    g.conversion_cache.add_misses(len(image_paths) - len(cached))
+    missed = [path for path in image_paths if cached.get(path) is None]
+    costs = [get_conversion_cost(path) for path in missed]
+    converted = g.conversion_engine.map(convert_and_hash, missed, costs)
+    for path in image_paths:
+        result = cached.get(path)
+        if result is None:
+            _, result = next(converted)
+            if not isinstance(result, Exception):
+                result, source_hash = result
+                if path in keys and source_hash is not None:
+                    g.conversion_cache.put(keys[path], source_hash, result)
+        yield path, result
+
+
+def record_conversion_metrics(result: ConversionResult) -> None:
+    """Records the stage timings measured in the conversion worker."""
+    source_size = get_source_size(result.image_path)
+    g.metrics.record(HEADER_PARSE, result.timings.get(HEADER_PARSE, 0), nbytes=source_size)
+    g.metrics.record(PIXEL_DECODE, result.timings.get(PIXEL_DECODE, 0), nbytes=source_size)
+    nrrd_bytes = sum(os.path.getsize(path) for path in result.paths if exists(path))
+    g.metrics.record(
+        NRRD_WRITE, result.timings.get(NRRD_WRITE, 0), count=len(result.paths), nbytes=nrrd_bytes
     )
+
+
+def get_source_size(path: str) -> int:
+    entry = g.dicom_index.get(path)
+    return entry.size if entry is not None else 0
+
+
+def get_conversion_cost(path: str) -> int:
+    """Estimated memory of the file conversion, see `ConversionEngine`."""
+    entry = g.dicom_index.get(path)
+    if entry is None:
+        return 0
+    cost = estimate_memory(entry.header, entry.size)
+    if cost > g.CONVERT_MEMORY_BUDGET_BYTES > 0:
+        sly.logger.info(
+            f"File '{path}' needs about {cost // 1024 // 1024} MB to convert, "
+            "more than the conversion memory budget, it will be converted alone"
+        )
+    return cost
+
+
+def upload_images(api: sly.Api, batch: UploadBatch) -> None:
+    try:
+        with g.metrics.measure(IMAGE_UPLOAD, count=len(batch), nbytes=sum(batch.get_sizes())):
+            dst_image_infos = api.image.upload_paths(
+                dataset_id=batch.dataset_id,
+                names=batch.names,
+                paths=batch.paths,
+                metas=batch.metas,
+                # images of the target dataset may have the same names
+                conflict_resolution="rename" if g.TARGET_PROJECT_ID is not None else None,
+            )
+    except Exception:
+        remove_partial_upload(api, batch)
+        raise
     dst_image_ids = [img_info.id for img_info in dst_image_infos]
+    offset = 0
+    for item in batch.source_images:
+        image_ids = dst_image_ids[offset : offset + item.count]
+        g.checkpoint.mark_uploaded(checkpoint_key(item.source), image_ids)
+        offset += item.count
+
+    try:
+        sync_project_meta(api)
+        with g.metrics.measure(ANNOTATION_UPLOAD, count=len(batch.anns)):
+            api.annotation.upload_jsons(img_ids=dst_image_ids, ann_jsons=batch.anns)
+    except Exception:
+        # images without annotations are removed, so the batch can be uploaded again
+        api.image.remove_batch(dst_image_ids)
+        offset = 0
+        for item in batch.source_images:
+            image_ids = dst_image_ids[offset : offset + item.count]
+            g.checkpoint.discard_image_ids(checkpoint_key(item.source), image_ids)
+            offset += item.count
+        raise
+
+
+def remove_partial_upload(api: sly.Api, batch: UploadBatch) -> None:
+    """Removes images of the batch added before the upload failed, e.g. by the first
+    requests of the bulk upload, so the batch (or its parts) can be uploaded again."""
+    try:
+        image_infos = api.image.get_list(
+            batch.dataset_id,
+            filters=[{"field": "name", "operator": "in", "value": batch.names}],
+            force_metadata_for_links=False,
+        )
+        image_ids = [info.id for info in image_infos if info.id not in g.existing_image_ids]
+        if len(image_ids) > 0:
+            sly.logger.info(f"Removing {len(image_ids)} images of the failed upload request")
+            api.image.remove_batch(image_ids)
+    except Exception as e:
+        sly.logger.warning(f"Failed to remove images of the failed upload request: {repr(e)}")
+
+
+def upload_volumes(api: sly.Api, batch: UploadBatch) -> None:
+    """Uploads volumes of the batch and adds their tags (series-to-volume mode)."""
+    dst_volume_infos = []
+    try:
+        for path, name in zip(batch.paths, batch.names):
+            with g.metrics.measure(IMAGE_UPLOAD, nbytes=os.path.getsize(path)):
+                dst_volume_infos.append(
+                    api.volume.upload_nrrd_serie_path(
+                        batch.dataset_id, name, path, log_progress=False
+                    )
+                )
+    except Exception:
+        # volumes uploaded before the failure are removed, they are not in the checkpoint yet
+        if len(dst_volume_infos) > 0:
+            remove_volumes(api, [volume_info.id for volume_info in dst_volume_infos])
+        raise
+    dst_volume_ids = [volume_info.id for volume_info in dst_volume_infos]
+    offset = 0
+    for item in batch.source_images:
+        volume_ids = dst_volume_ids[offset : offset + item.count]
+        g.checkpoint.mark_uploaded(checkpoint_key(item.source), volume_ids)
+        offset += item.count
+
+    try:
+        sync_project_meta(api)
+        with g.metrics.measure(ANNOTATION_UPLOAD, count=len(batch)):
+            for volume_info, tags in zip(dst_volume_infos, batch.anns):
+                ann = sly.VolumeAnnotation(volume_info.meta, tags=tags)
+                api.volume.annotation.append(volume_info.id, ann)
+    except Exception:
+        # volumes without tags are removed, so the batch can be uploaded again
+        remove_volumes(api, dst_volume_ids)
+        offset = 0
+        for item in batch.source_images:
+            volume_ids = dst_volume_ids[offset : offset + item.count]
+            g.checkpoint.discard_image_ids(checkpoint_key(item.source), volume_ids)
+            offset += item.count
+        raise
+
+
+def remove_volumes(api: sly.Api, volume_ids: List[int]) -> None:
+    """Volumes are removed as images, the SDK does not implement volume removal
+    and removes videos the same way."""
+    api.image.remove_batch(volume_ids)
+
+
+def mark_annotated(source_images: List[SourceImages]) -> None:
+    """Marks source files done once all their images are uploaded, see `UploadPipeline`."""
+    g.checkpoint.mark([checkpoint_key(item.source) for item in source_images], ANNOTATED)
+
 
+def write_local_images(batch: UploadBatch) -> None:
+    """Writes the batch to the local project instead of uploading it (convert-only mode)."""
+    with g.metrics.measure(LOCAL_WRITE, count=len(batch), nbytes=sum(batch.get_sizes())):
+        g.local_project.write_batch(batch)
+
+
+def get_project_meta_json() -> dict:
+    """Returns the project meta with the tags from DICOM and from Supervisely format meta."""
     # Merge meta from annotations (if supervisely format) with other tags
-    if g.WITH_ANNS:
+    if g.WITH_ANNS and not g.VOLUME_MODE:
         _meta_dct = g.project_meta_from_sly_format.to_json()
         _new_meta_cct = g.project_meta.to_json()
         remove_sly_tag_name_if_not_unique(_meta_dct, _new_meta_cct)
@@ -95,12 +511,36 @@ def import_images(
         check_unique_name(_meta_dct["tags"])  # left for emergency cases
     else:
         _meta_dct = g.project_meta.to_json()
+    project_settings = get_project_settings()
+    if project_settings is not None:
+        _meta_dct["projectSettings"] = project_settings.to_json()
+    return _meta_dct
+
+
+def get_project_settings() -> Optional[sly.ProjectSettings]:
+    """Returns image grouping by the grouping tag once the tag is in the project meta.
+
+    The settings are pushed with every meta: the meta update also updates the project
+    settings, so a meta without them would disable the grouping.
+    """
+    if g.VOLUME_MODE or g.GROUP_TAG_NAME not in g.tag_metas:
+        return None
+    return sly.ProjectSettings(multiview_enabled=True, multiview_tag_name=g.GROUP_TAG_NAME)
+
 
-    # Update the project metadata and enable image grouping
-    api.project.update_meta(id=g.project_id, meta=_meta_dct)
-    api.project.images_grouping(id=g.project_id, enable=True, tag_name=g.GROUP_TAG_NAME)
+def sync_project_meta(api: sly.Api) -> None:
+    """Pushes the project meta only if new tag metas appeared since the last push.
 
-    api.annotation.upload_anns(img_ids=dst_image_ids, anns=anns)
+    Meta is pushed under the lock, so the last push always contains all tag metas
+    used by the annotations of already converted batches.
+    """
+    with g.project_meta_lock:
+        fold_tag_metas()
+        if not g.project_meta_synced:
+            _meta_dct = get_project_meta_json()
+            with g.metrics.measure(META_UPDATE):
+                api.project.update_meta(id=g.project_id, meta=_meta_dct)
+            g.project_meta_synced = True
 
 
 def get_paths(dataset_path: str, with_anns: bool = False) -> Tuple[List[str], List[str]]:
@@ -117,28 +557,45 @@ def get_paths(dataset_path: str, with_anns: bool = False) -> Tuple[List[str], Li
         img_dirname, ann_dirname = join(dataset_path, "img"), join(dataset_path, "ann")
         dataset_path = img_dirname
 
-    ds_images_paths = sorted(
-        [
-            join(dataset_path, item)
-            for item in os.listdir(dataset_path)
-            if file_exists(join(dataset_path, item)) and is_dicom_file(join(dataset_path, item))
-        ]
-    )
+    ds_images_paths = g.dicom_index.dicom_files(dataset_path)
 
     if with_anns:
-        ds_annotations_paths = sorted(
-            [
-                join(ann_dirname, item)
-                for item in os.listdir(ann_dirname)
-                if file_exists(join(ann_dirname, item)) and is_json_file(join(ann_dirname, item))
-            ]
-        )
+        ds_annotations_paths = pair_annotations(ds_images_paths, ann_dirname)
     else:
         ds_annotations_paths = [None for _ in ds_images_paths]
 
     return ds_images_paths, ds_annotations_paths
 
 
+def pair_annotations(images_paths: List[str], ann_dir: str) -> List[Optional[str]]:
+    """Returns annotation path (`<image name>.json`) for every image, None if it is missing.
+
+    Annotations are not parsed here, they are loaded once when the images are converted.
+    """
+    ann_index = {
+        item[: -len(".json")]: join(ann_dir, item)
+        for item in os.listdir(ann_dir)
+        if item.lower().endswith(".json") and os.path.isfile(join(ann_dir, item))
+    }
+    annotations_paths = [ann_index.pop(basename(path), None) for path in images_paths]
+
+    unpaired_images = [
+        basename(path) for path, ann in zip(images_paths, annotations_paths) if ann is None
+    ]
+    if len(unpaired_images) > 0:
+        sly.logger.warning(
+            f"{len(unpaired_images)} images in '{dirname(ann_dir)}' have no annotation, "
+            "they will be imported with DICOM tags only",
+            extra={"images": unpaired_images[:10]},
+        )
+    if len(ann_index) > 0:
+        sly.logger.warning(
+            f"{len(ann_index)} annotations in '{ann_dir}' have no image and will be skipped",
+            extra={"annotations": sorted(ann_index)[:10]},
+        )
+    return annotations_paths
+
+
 def remove_sly_tag_name_if_not_unique(sly_meta, new_meta):
     for s_tag in sly_meta["tags"]:
         for n_tag in new_meta["tags"]:
@@ -162,8 +619,8 @@ def check_unique_name(lst: List[Dict[str, str]]) -> None:
         )
 
 
-def is_dicom_folder(dir_path: str) -> List[str]:
-    return any([is_dicom_file(f.path) for f in os.scandir(dir_path)])
+def is_dicom_folder(dir_path: str) -> bool:
+    return len(g.dicom_index.dicom_files(dir_path)) > 0
 
 
 def check_image_project_structure(root_dir: str, with_anns: bool) -> None:
@@ -235,26 +692,9 @@ def check_extension_in_folder(folder_path: str, extension: str) -> bool:
     return False
 
 
-def is_dicom_file(path: str, verbose: bool = False) -> bool:
-    """Checks if file is DICOM file by given path."""
-    try:
-        pydicom.read_file(str(Path(path).resolve()), stop_before_pixels=True)
-        result = True
-    except Exception as ex:
-        if verbose:
-            print("'{}' appears not to be a DICOM file\n({})".format(path, ex))
-            g.my_app.logger.warn("'{}' appears not to be a DICOM file\n({})".format(path, ex))
-        result = False
-    return result
-
-
-def is_json_file(file_path):
-    try:
-        with open(file_path, "r") as f:
-            json.load(f)
-            return True
-    except (ValueError, FileNotFoundError):
-        return False
+def is_dicom_file(path: str) -> bool:
+    """Checks if file is DICOM file by given path using the discovery index."""
+    return g.dicom_index.is_dicom(path)
 
 
 def is_archive(path, local=True):
@@ -309,7 +749,6 @@ def handle_input_path(api: sly.Api) -> str:
 
 def download_data_from_team_files(api: sly.Api, task_id: int, save_path: str) -> str:
     """Download data from remote directory in Team Files."""
-    handle_input_path(api)
     project_path = None
     if g.INPUT_DIR is not None:
         sly.logger.info(f"Input directory: {g.INPUT_DIR}")
@@ -327,232 +766,322 @@ def download_data_from_team_files(api: sly.Api, task_id: int, save_path: str) ->
             unit="B",
             unit_scale=True,
         )
-        api.file.download_directory(
-            team_id=g.TEAM_ID,
-            remote_path=remote_path,
-            local_save_path=project_path,
-            progress_cb=progress_cb,
-        )
+        with g.metrics.measure(DOWNLOAD, nbytes=sizeb):
+            api.file.download_directory(
+                team_id=g.TEAM_ID,
+                remote_path=remote_path,
+                local_save_path=project_path,
+                progress_cb=progress_cb,
+            )
         progress_cb.close()
         sly.fs.remove_junk_from_dir(project_path)
 
     elif g.INPUT_FILE is not None:
-        sly.logger.info(f"Input file: {g.INPUT_FILE}")
-        if g.IS_ON_AGENT:
-            _, cur_files_path = api.file.parse_agent_id_and_path(g.INPUT_FILE)
-        else:
-            cur_files_path = g.INPUT_FILE
+        save_archive_path = download_archive(api, task_id, save_path)
+        if save_archive_path is None:
+            return None
+        # the storage directory also keeps the checkpoint manifest and other app files
+        unpack_path = join(save_path, UNPACK_DIR_NAME)
+        mkdir(unpack_path, remove_content_if_exists=True)
+        sly.fs.unpack_archive(save_archive_path, unpack_path, remove_junk=True)
+        silent_remove(save_archive_path)
+        if len(os.listdir(unpack_path)) != 1:
+            g.my_app.logger.error("There must be only 1 project directory in the archive")
+            raise Exception("There must be only 1 project directory in the archive")
 
-        remote_path = g.INPUT_FILE
-        save_archive_path = join(save_path, get_file_name_with_ext(normpath(cur_files_path)))
-        sizeb = api.file.get_info_by_path(g.TEAM_ID, remote_path).sizeb
-        progress_cb = tqdm(
-            total=sizeb,
-            desc=f"Downloading {remote_path.lstrip('/')}",
-            unit="B",
-            unit_scale=True,
-        )
+        project_name = os.listdir(unpack_path)[0]
+        project_path = join(unpack_path, project_name)
+    return project_path
+
+
+def download_archive(api: sly.Api, task_id: int, save_path: str) -> str:
+    """Download input archive from Team Files, returns None if the file is not an archive."""
+    sly.logger.info(f"Input file: {g.INPUT_FILE}")
+    if g.IS_ON_AGENT:
+        _, cur_files_path = api.file.parse_agent_id_and_path(g.INPUT_FILE)
+    else:
+        cur_files_path = g.INPUT_FILE
+
+    remote_path = g.INPUT_FILE
+    save_archive_path = join(save_path, get_file_name_with_ext(normpath(cur_files_path)))
+    sizeb = api.file.get_info_by_path(g.TEAM_ID, remote_path).sizeb
+    progress_cb = tqdm(
+        total=sizeb,
+        desc=f"Downloading {remote_path.lstrip('/')}",
+        unit="B",
+        unit_scale=True,
+    )
+    with g.metrics.measure(DOWNLOAD, nbytes=sizeb):
         api.file.download(
             team_id=g.TEAM_ID,
             remote_path=remote_path,
             local_save_path=save_archive_path,
             progress_cb=progress_cb,
         )
-        progress_cb.close()
-        if is_archive(save_archive_path):
-            sly.fs.unpack_archive(save_archive_path, save_path, remove_junk=True)
-        else:
-            silent_remove(save_archive_path)
-            title = "Incorrect input data: file is not an archive."
-            description = "Read more in the app description."
-            api.task.set_output_error(task_id, title=title, description=description)
-            g.my_app.logger.error(f"{title} {description}")
-            g.my_app.stop()
-            return None
+    progress_cb.close()
+    if not is_archive(save_archive_path):
         silent_remove(save_archive_path)
-        if len(os.listdir(save_path)) > 1:
-            g.my_app.logger.error("There must be only 1 project directory in the archive")
-            raise Exception("There must be only 1 project directory in the archive")
+        title = "Incorrect input data: file is not an archive."
+        description = "Read more in the app description."
+        api.task.set_output_error(task_id, title=title, description=description)
+        g.my_app.logger.error(f"{title} {description}")
+        g.my_app.stop()
+        return None
+    return save_archive_path
 
-        project_name = os.listdir(save_path)[0]
-        project_path = join(save_path, project_name)
-    return project_path
 
+def create_project(api: sly.Api, project_name: str) -> sly.ProjectInfo:
+    """Creates a new project in the workspace and resets the project meta state.
 
-def find_frame_axis(pixel_data: np.ndarray, frames: int):
-    for axis in range(len(pixel_data.shape)):
-        if pixel_data.shape[axis] == frames:
-            return axis
-    raise ValueError("Unable to recognize the frame axis for splitting a set of images")
+    If the import is resumed, the project from the checkpoint is reused instead,
+    the target project is used if it is set.
+    """
+    g.project_meta_synced = False
+    if g.CONVERT_ONLY:
+        g.local_project = LocalProject(join(g.CONVERT_OUTPUT_DIR, project_name))
+        # the local project has no id, the import only checks that the project exists
+        g.project_id = 0
+        return None
+    project = resume_project(api)
+    if project is None and g.TARGET_PROJECT_ID is not None:
+        project = open_target_project(api)
+    elif project is None:
+        project = api.project.create(
+            workspace_id=g.WORKSPACE_ID,
+            name=project_name,
+            type=sly.ProjectType.VOLUMES if g.VOLUME_MODE else sly.ProjectType.IMAGES,
+            change_name_if_conflict=True,
+        )
+        g.checkpoint.set_value("project_id", project.id)
+    g.project_id = project.id
+    return project
+
+
+def resume_project(api: sly.Api) -> sly.ProjectInfo:
+    """Returns project of the interrupted import and restores its meta state."""
+    project_id = g.checkpoint.get_value("project_id")
+    if project_id is None:
+        return None
+    project = api.project.get_info_by_id(int(project_id))
+    if project is None:
+        sly.logger.warning(f"Project {project_id} from the checkpoint is not found")
+        return None
+    sly.logger.info(f"Resuming import into project '{project.name}' (id: {project.id})")
+    restore_project_meta(api, project)
+
+    # images uploaded without annotations are removed, their files are imported again
+    stale_image_ids = g.checkpoint.pop_stale_image_ids()
+    if len(stale_image_ids) > 0 and g.VOLUME_MODE:
+        remove_volumes(api, stale_image_ids)
+    elif len(stale_image_ids) > 0:
+        api.image.remove_batch(stale_image_ids)
+    return project
+
+
+def open_target_project(api: sly.Api) -> sly.ProjectInfo:
+    """Returns the existing project to import into and restores its meta state."""
+    project = api.project.get_info_by_id(g.TARGET_PROJECT_ID)
+    if project is None:
+        raise ValueError(f"Target project {g.TARGET_PROJECT_ID} is not found")
+    project_type = sly.ProjectType.VOLUMES if g.VOLUME_MODE else sly.ProjectType.IMAGES
+    if project.type != str(project_type):
+        raise ValueError(
+            f"Target project '{project.name}' is a {project.type} project, "
+            f"DICOM data can be imported only to {project_type} projects in this mode"
+        )
+    sly.logger.info(f"Importing into the existing project '{project.name}' (id: {project.id})")
+    g.checkpoint.set_value("project_id", project.id)
+    restore_project_meta(api, project)
+    return project
+
+
+def restore_project_meta(api: sly.Api, project: sly.ProjectInfo) -> None:
+    # existing tags must stay in the meta, sly format tags are merged on every push
+    server_meta = sly.ProjectMeta.from_json(api.project.get_meta(project.id))
+    tag_metas = [
+        tag_meta
+        for tag_meta in server_meta.tag_metas
+        if not g.WITH_ANNS or g.project_meta_from_sly_format.get_tag_meta(tag_meta.name) is None
+    ]
+    g.project_meta = sly.ProjectMeta(tag_metas=tag_metas)
+    g.tag_metas = {tag_meta.name: tag_meta for tag_meta in tag_metas}
+    g.pending_tag_metas = []
+
+
+def finalize_project(api: sly.Api) -> None:
+    """Removes the project if nothing was imported, otherwise registers it as the task output."""
+    if g.CONVERT_ONLY:
+        finalize_local_project()
+        return
+    if api.project.get_datasets_count(g.project_id) == 0:
+        # the target project existed before the import
+        if g.TARGET_PROJECT_ID is None:
+            api.project.remove(g.project_id)
+        title = f"Failed to import DICOM data."
+        description = "Read the app overview to prepare your data for import."
+        raise Exception(f"{title} {description}")
+    g.deduplicator.log_summary()
+    if g.conversion_cache is not None:
+        g.conversion_cache.log_summary()
+    g.workflow.add_output(g.project_id)
+    # the import is complete, nothing to resume
+    g.checkpoint.close(remove=True)
+
+
+def finalize_local_project() -> None:
+    """Writes the project meta of the local project (convert-only mode)."""
+    if g.local_project.datasets_count == 0:
+        remove_dir(g.local_project.project_dir)
+        raise Exception("Failed to import DICOM data. Nothing was converted.")
+    fold_tag_metas()
+    # the meta is written as sly.Project reads it, with image grouping in the project settings
+    project_meta = sly.ProjectMeta.from_json(get_project_meta_json())
+    g.local_project.write_meta(project_meta.to_json())
+    g.deduplicator.log_summary()
+    if g.conversion_cache is not None:
+        g.conversion_cache.log_summary()
+    sly.logger.info(f"Converted project is saved to '{g.local_project.project_dir}'")
+    g.checkpoint.close(remove=True)
+
+
+def save_metrics_report(api: sly.Api, task_id: int) -> None:
+    """Logs the metrics report and uploads it to Team Files if the directory is set."""
+    report = g.metrics.log_report()
+    if not g.METRICS_REPORT_DIR or g.CONVERT_ONLY:
+        return
+    local_path = join(g.STORAGE_DIR, f"metrics_{task_id}.json")
+    sly.json.dump_json_file(report, local_path)
+    remote_path = join(g.METRICS_REPORT_DIR, f"{task_id}.json")
+    try:
+        api.file.upload(g.TEAM_ID, local_path, remote_path)
+        sly.logger.info(f"Metrics report is uploaded to Team Files: '{remote_path}'")
+    except Exception as e:
+        sly.logger.warning(f"Failed to upload metrics report: {repr(e)}")
+    finally:
+        silent_remove(local_path)
+
+
+def open_checkpoint() -> ImportCheckpoint:
+    path = get_manifest_path(
+        g.CHECKPOINT_DIR,
+        g.TEAM_ID,
+        g.WORKSPACE_ID,
+        g.INPUT_DIR or g.INPUT_FILE or g.LOCAL_INPUT_DIR,
+    )
+    checkpoint = ImportCheckpoint(path, resume=g.RESUME_IMPORT)
+    g.deduplicator.add_imported(checkpoint.get_imported_instance_keys())
+    return checkpoint
 
 
-def create_pixel_data_set(dcm: FileDataset, frame_axis):
-    if frame_axis == 0:
-        pixel_array = np.transpose(dcm.pixel_array, (2, 1, 0))
-    elif frame_axis == 1:
-        pixel_array = np.transpose(dcm.pixel_array, (2, 0, 1))
-    else:
-        pixel_array = dcm.pixel_array
-    frame_axis = 2
-    list_of_images = np.split(pixel_array, int(dcm.NumberOfFrames), axis=frame_axis)
-    return list_of_images, frame_axis
-
-
-def get_nrrd_header(image_path: str, frame_axis: int = 2):
-    _, meta = sly.volume.read_dicom_serie_volume([image_path], False)
-    dimensions: Dict = meta.get("dimensionsIJK")
-    header = {
-        "type": "float",
-        "sizes": [dimensions.get("x"), dimensions.get("y")],
-        "dimension": 2,
-        "space": "right-anterior-superior",
-    }
+def create_ann_jsons(
+    result: ConversionResult, group_tag_name: str, ann_json: dict = None
+) -> List[dict]:
+    """Creates annotation JSONs with tags for every image produced from a single DICOM file.
 
-    if frame_axis == 0:
-        spacing = meta["spacing"][1:]
-        header["space directions"] = [[spacing[0], 0], [0, spacing[1]]]
-    if frame_axis == 1:
-        spacing = meta["spacing"][0::2]
-        header["space directions"] = [[spacing[0], 0], [0, spacing[1]]]
-    if frame_axis == 2:
-        spacing = meta["spacing"][0:2]
-        header["space directions"] = [[spacing[0], 0], [0, spacing[1]]]
-    return header
-
-
-def dcm2nrrd(
-    image_path: str,
-    group_tag_name: str,
-) -> Tuple[str, str, sly.Annotation]:
-    """Converts DICOM data to nrrd format and returns image paths, image names, and image annotations."""
-    dcm = pydicom.read_file(image_path)
-    dcm_tags, dcm_meta = create_dcm_tags(dcm)
-    
-    pixel_data_list = [dcm.pixel_array]
-
-    if len(dcm.pixel_array.shape) == 3:
-        if dcm.pixel_array.shape[0] == 1 and not hasattr(dcm, "NumberOfFrames"):
-            frames = 1
-            pixel_data_list = [
-                dcm.pixel_array.reshape((dcm.pixel_array.shape[1], dcm.pixel_array.shape[2]))
-            ]
-            header = get_nrrd_header(image_path)
-        else:
-            try:
-                frames = int(dcm.NumberOfFrames)
-            except AttributeError as e:
-                if str(e) == "'FileDataset' object has no attribute 'NumberOfFrames'":
-                    e.args = ("can't get 'NumberOfFrames' from dcm meta.",)
-                    raise e
-            frame_axis = find_frame_axis(dcm.pixel_array, frames)
-            pixel_data_list, frame_axis = create_pixel_data_set(dcm, frame_axis)
-            header = get_nrrd_header(image_path, frame_axis)
-    elif len(dcm.pixel_array.shape) == 2:
-        frames = 1
-        header = get_nrrd_header(image_path)
+    Images of the file share the list of tag JSONs instead of building tag objects
+    per frame. `ann_json` (Supervisely format annotation of the file) is merged into
+    every image.
+    """
+    tags = []
+    if result.group_tag_value is not None:
+        tags.append(get_tag_json(group_tag_name, result.group_tag_value))
     else:
-        raise NotImplementedError(
-            f"this type of dcm data is not supported, pixel_array.shape = {len(dcm.pixel_array.shape)}"
+        original_name = get_file_name_with_ext(result.image_path)
+        g.my_app.logger.warn(
+            f"Couldn't find key: '{group_tag_name}' in file's metadata: '{original_name}'"
         )
+    tags.extend(get_tag_json(name, value) for name, value in result.tags if value is not None)
+
+    if ann_json is not None:
+        merged_json = dict(ann_json, tags=ann_json.get("tags", []) + tags)
+        return [merged_json] * len(result.img_sizes)
+    return [
+        {
+            "description": "",
+            "size": {"height": img_size[0], "width": img_size[1]},
+            "tags": tags,
+            "objects": [],
+            "customBigData": {},
+        }
+        for img_size in result.img_sizes
+    ]
+
+
+def get_tag_json(tag_name: str, tag_value: str) -> dict:
+    """Returns the tag JSON shared by all annotations with this (name, value) pair.
+
+    The tag meta is looked up on every call, outside of the cache, so it is created
+    again after the tag metas are reset. The JSON must not be modified.
+    """
+    get_tag_meta(tag_name)
+    return _intern_tag_json(tag_name, tag_value)
 
-    save_paths = []
-    image_names = []
-    anns = []
-    frames_list = [f"{i:0{len(str(frames))}d}" for i in range(1, frames + 1)]
 
-    for pixel_data, frame_number in zip(pixel_data_list, frames_list):
-        original_name = get_file_name_with_ext(image_path)
+@functools.lru_cache(maxsize=TAG_JSON_CACHE_SIZE)
+def _intern_tag_json(tag_name: str, tag_value: str) -> dict:
+    return {"name": tag_name, "value": tag_value}
 
-        if frames == 1:
-            pixel_data = sly.image.rotate(img=pixel_data, degrees_angle=270)
-            pixel_data = sly.image.fliplr(pixel_data)
-            image_name = f"{original_name}.nrrd"
-        else:
-            pixel_data = np.squeeze(pixel_data, frame_axis)
-            image_name = f"{frame_number}_{original_name}.nrrd"
 
-        save_path = join(dirname(image_path), image_name)
-        nrrd.write(save_path, pixel_data, header)
-        save_paths.append(save_path)
-        image_names.append(image_name)
-        try:
-            group_tag_value = str(dcm[group_tag_name].value)
-            group_tag = {"name": group_tag_name, "value": group_tag_value}
-            ann = create_ann_with_tags(
-                save_path,
-                group_tag,
-                dcm_tags,
-            )
-        except:
-            g.my_app.logger.warn(
-                f"Couldn't find key: '{group_tag_name}' in file's metadata: '{original_name}'"
-            )
-            img_size = nrrd.read_header(save_path)["sizes"].tolist()[::-1]
-            ann = sly.Annotation(img_size=img_size)
-            if dcm_tags is not None:
-                ann = ann.add_tags(sly.TagCollection(dcm_tags))
-        anns.append(ann)
-    return save_paths, image_names, anns, dcm_meta
-
-
-def create_dcm_tags(dcm: FileDataset) -> List[sly.Tag]: # ! Incorrect return type, to fix.
-    """Create tags from DICOM metadata."""
-    if g.ADD_DCM_TAGS == g.DO_NOT_ADD:
-        return [], {}
-
-    tags_from_dcm, dcm_tags_dict = [], {}
-    if g.ADD_DCM_TAGS == g.ADD_ALL:
-        g.DCM_TAGS = list(dcm.keys())
-    for dcm_tag in list(dcm.keys()):
-        try:
-            curr_tag = dcm[dcm_tag]
-            dcm_tag_name = str(curr_tag.name)
-            dcm_tag_value = str(curr_tag.value)
-            if dcm_tag_value in ["", None]:
-                sly.logger.warn(f"Tag [{dcm_tag_name}] has empty value. Skipping tag.")
-                continue
-            if len(dcm_tag_value) > 255:
-                sly.logger.warn(f"Tag [{dcm_tag_name}] has too long value. Skipping tag.")
-                continue
-            if g.ADD_DCM_TAGS == g.ADD_ALL:
-                tags_from_dcm.append((dcm_tag_name, dcm_tag_value))
-            dcm_tags_dict[dcm_tag_name] = dcm_tag_value
-        except:
-            dcm_filename = get_file_name_with_ext(dcm.filename)
-            g.my_app.logger.warn(
-                f"Couldn't find key: '{dcm_tag}' in file's metadata: '{dcm_filename}'"
-            )
-            continue
+def create_conversion_cache(settings: ConversionSettings) -> Optional[ConversionCache]:
+    """Returns None if the cache is disabled, e.g. in volume mode where series are converted."""
+    if not g.CONVERSION_CACHE_DIR or g.VOLUME_MODE:
+        return None
+    try:
+        return ConversionCache(g.CONVERSION_CACHE_DIR, g.CONVERSION_CACHE_MAX_BYTES, settings)
+    except Exception as e:
+        sly.logger.warning(f"Conversion cache is disabled due to: {repr(e)}")
+        return None
+
+
+def create_conversion_engine() -> ConversionEngine:
+    settings = ConversionSettings(
+        group_tag_name=g.GROUP_TAG_NAME,
+        extract_tags=g.ADD_DCM_TAGS != g.DO_NOT_ADD,
+        add_all_tags=g.ADD_DCM_TAGS == g.ADD_ALL,
+        skip_vrs=g.DCM_TAGS_SKIP_VRS,
+        allow_vrs=g.DCM_TAGS_ALLOW_VRS,
+        nrrd_encoding=g.NRRD_ENCODING,
+        nrrd_compression_level=g.NRRD_COMPRESSION_LEVEL,
+        decoder_backends=g.DECODER_BACKENDS_ORDER,
+        transfer_syntax_decoders=g.TRANSFER_SYNTAX_DECODERS,
+    )
+    return ConversionEngine(
+        settings, workers=g.CONVERT_WORKERS, memory_budget=g.CONVERT_MEMORY_BUDGET_BYTES
+    )
+
 
-    dcm_sly_tags = []
-    for dcm_tag_name, dcm_tag_value in tags_from_dcm:
-        dcm_tag_meta = g.project_meta.get_tag_meta(dcm_tag_name)
-        if dcm_tag_meta is None:
-            dcm_tag_meta = sly.TagMeta(dcm_tag_name, sly.TagValueType.ANY_STRING)
-            g.project_meta = g.project_meta.add_tag_meta(dcm_tag_meta)
-
-        dcm_tag = sly.Tag(dcm_tag_meta, dcm_tag_value)
-        dcm_sly_tags.append(dcm_tag)
-
-    return dcm_sly_tags, dcm_tags_dict
-
-
-def create_ann_with_tags(
-    path_to_img: str, group_tag_info: dict, dcm_tags: List[sly.Tag] = None
-) -> sly.Annotation:
-    """Creates annotation with tags."""
-    img_size = nrrd.read_header(path_to_img)["sizes"].tolist()[::-1]
-    group_tag = create_group_tag(group_tag_info)
-    tags_to_add = [tag for tag in [group_tag] + (dcm_tags or []) if tag.value is not None]
-    return sly.Annotation(img_size=img_size).add_tags(sly.TagCollection(tags_to_add))
-
-
-def create_group_tag(group_tag_info: Dict[str, str]) -> sly.Tag:
-    """Creates grouping tag."""
-    group_tag_name, group_tag_value = group_tag_info["name"], group_tag_info["value"]
-    group_tag_meta = g.project_meta.get_tag_meta(group_tag_name)
-    if group_tag_meta is None:
-        group_tag_meta = sly.TagMeta(group_tag_name, sly.TagValueType.ANY_STRING)
-        g.project_meta = g.project_meta.add_tag_meta(group_tag_meta)
-    group_tag = sly.Tag(group_tag_meta, group_tag_value)
-    return group_tag
+def create_volume_tags(result: VolumeResult) -> sly.VolumeTagCollection:
+    """Creates volume tags from DICOM metadata of the first file of the series."""
+    tags = [sly.VolumeTag(get_tag_meta(name), value) for name, value in result.tags]
+    if result.group_tag_value is not None:
+        tags.insert(0, sly.VolumeTag(get_tag_meta(g.GROUP_TAG_NAME), result.group_tag_value))
+    else:
+        g.my_app.logger.warn(
+            f"Couldn't find key: '{g.GROUP_TAG_NAME}' in file's metadata: '{result.image_paths[0]}'"
+        )
+    return sly.VolumeTagCollection(tags)
+
+
+def get_tag_meta(tag_name: str) -> sly.TagMeta:
+    """Returns tag meta by name, creates it if it doesn't exist yet.
+
+    New tag metas are collected in a dict and added to the project meta at once
+    by `fold_tag_metas`, instead of copying the immutable ProjectMeta per tag.
+    """
+    tag_meta = g.tag_metas.get(tag_name)
+    if tag_meta is None:
+        with g.project_meta_lock:
+            tag_meta = g.tag_metas.get(tag_name)
+            if tag_meta is None:
+                tag_meta = sly.TagMeta(tag_name, sly.TagValueType.ANY_STRING)
+                g.tag_metas[tag_name] = tag_meta
+                g.pending_tag_metas.append(tag_meta)
+    return tag_meta
+
+
+def fold_tag_metas() -> None:
+    """Adds new tag metas to the project meta. Must be called under `project_meta_lock`."""
+    if len(g.pending_tag_metas) > 0:
+        g.project_meta = g.project_meta.add_tag_metas(g.pending_tag_metas)
+        g.pending_tag_metas = []
+        g.project_meta_synced = False
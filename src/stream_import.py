@@ -0,0 +1,142 @@
+import os
+from functools import partial
+from os.path import basename, dirname, exists, join, normpath
+from typing import Dict, List, Optional, Tuple
+
+import supervisely as sly
+from supervisely.io.fs import silent_remove
+
+import sly_globals as g
+import sly_utils as f
+from pipeline import Budget, UploadPipeline
+
+JUNK_NAMES = ("__MACOSX", ".DS_Store", "Thumbs.db")
+
+
+def is_junk_file(name: str) -> bool:
+    parts = normpath(name).split(os.sep)
+    return any(part in JUNK_NAMES for part in parts) or basename(name).startswith("._")
+
+
+def is_meta_file(name: str) -> bool:
+    """Checks if the path relative to the project directory is the project meta.json."""
+    return normpath(name) == "meta.json"
+
+
+def is_ann_file(name: str) -> bool:
+    parts = normpath(name).split(os.sep)
+    return len(parts) == 3 and parts[1] == "ann" and parts[2].lower().endswith(".json")
+
+
+def is_img_file(name: str) -> bool:
+    parts = normpath(name).split(os.sep)
+    return len(parts) == 3 and parts[1] == "img"
+
+
+class StreamImporter:
+    """Base class for imports that receive source files one at a time.
+
+    Files added with `add_file` are indexed, grouped into batches by dataset,
+    converted and passed to the upload pipeline. Sources are removed as soon as
+    their batch is uploaded, the total size of local sources is limited by
+    `STREAM_WORKING_SET_MB`.
+    """
+
+    def __init__(self, api: sly.Api, work_dir: str):
+        self.api = api
+        self.work_dir = work_dir
+        self.budget = Budget(g.STREAM_WORKING_SET_BYTES)
+        self.project_name: str = None
+        self.datasets: Dict[str, sly.DatasetInfo] = {}
+        self.images_count: Dict[int, int] = {}
+        self._chunk: List[Tuple[str, int]] = []
+
+    def add_file(self, path: str, size: int, pipeline: UploadPipeline) -> None:
+        """Adds local source file, its `size` must be already acquired from the budget."""
+        if self.is_done(path) or g.dicom_index.add(path) is None or not f.is_unique_instance(path):
+            g.dicom_index.remove(path)
+            silent_remove(path)
+            self.budget.release(size)
+            return
+        f.mark_discovered([path])
+        self._chunk.append((path, size))
+        if len(self._chunk) >= g.CONVERT_BATCH_SIZE:
+            self.flush(pipeline)
+
+    def is_done(self, path: str) -> bool:
+        """Checks if the file was imported before the import was resumed."""
+        return g.checkpoint.is_done(f.checkpoint_key(path))
+
+    def acquire(self, size: int, pipeline: UploadPipeline) -> None:
+        if not self.budget.can_acquire(size):
+            # upload what is already received before waiting for the space
+            self.flush(pipeline)
+        self.budget.acquire(size)
+
+    def finish(self, pipeline: UploadPipeline) -> None:
+        self.flush(pipeline)
+        for dataset_dir, dataset in self.datasets.items():
+            if self.images_count[dataset.id] == 0 and not dataset.images_count:
+                f.remove_dataset(self.api, dataset)
+                sly.logger.warning(f"Skipping dataset '{dataset_dir}', nothing to import")
+
+    def load_sly_format_meta(self, meta_path: Optional[str]) -> None:
+        if meta_path is None:
+            sly.logger.warn("Failed checking Supervisely format.")
+            sly.logger.warn(
+                "Missing meta.json file. "
+                f"Learn more about <a href='{g.SLY_FORMAT_DOCS}'>Supervisely format</a>."
+            )
+            g.WITH_ANNS = False
+            return
+        g.project_meta_from_sly_format = sly.ProjectMeta.from_json(
+            sly.json.load_json_file(meta_path)
+        )
+
+    def flush(self, pipeline: UploadPipeline) -> None:
+        groups: Dict[str, List[Tuple[str, int]]] = {}
+        for path, size in self._chunk:
+            dataset_dir = dirname(dirname(path)) if g.WITH_ANNS else dirname(path)
+            groups.setdefault(dataset_dir, []).append((path, size))
+        self._chunk = []
+
+        for dataset_dir, items in groups.items():
+            dataset = self._get_dataset(dataset_dir)
+            img_paths = [path for path, _ in items]
+            ann_paths = [self._get_ann_path(path) for path in img_paths]
+            on_done = partial(self._release, img_paths, sum(size for _, size in items))
+
+            batch = f.convert_images(dataset, img_paths, ann_paths)
+            batch.sources = img_paths
+            batch.on_done = on_done
+            if len(batch) == 0:
+                for path in img_paths:
+                    silent_remove(path)
+                on_done()
+                continue
+            self.images_count[dataset.id] += len(batch)
+            pipeline.put(batch)
+
+    def _get_dataset(self, dataset_dir: str) -> sly.DatasetInfo:
+        dataset = self.datasets.get(dataset_dir)
+        if dataset is None:
+            if g.project_id is None:
+                f.create_project(self.api, self.project_name)
+            dataset = f.create_dataset(self.api, dataset_dir)
+            self.datasets[dataset_dir] = dataset
+            self.images_count[dataset.id] = 0
+        return dataset
+
+    def _get_ann_path(self, image_path: str) -> Optional[str]:
+        if not g.WITH_ANNS:
+            return None
+        ann_path = join(dirname(dirname(image_path)), "ann", f"{basename(image_path)}.json")
+        if not exists(ann_path):
+            sly.logger.warning(f"Annotation for '{basename(image_path)}' not found")
+            return None
+        return ann_path
+
+    def _release(self, paths: List[str], size: int) -> None:
+        for path in paths:
+            g.dicom_index.remove(path)
+        self.budget.release(size)
@@ -0,0 +1,213 @@
+import re
+import time
+from dataclasses import dataclass, field
+from os.path import dirname, join
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pydicom
+from pydicom import FileDataset
+from pydicom.pixel_data_handlers.util import apply_modality_lut
+from supervisely.io.fs import get_file_name
+
+from converter import (
+    PIXEL_DATA_DEFER_SIZE,
+    ConversionSettings,
+    extract_dcm_tags,
+    find_attribute,
+    get_pixel_spacing,
+    write_nrrd,
+)
+from decoding import decode_pixel_array, get_backends, get_transfer_syntax
+from dicom_index import DicomIndexEntry
+from metrics import HEADER_PARSE, NRRD_WRITE, PIXEL_DECODE
+
+# Like converter, this module must not import sly_globals: series are converted
+# in worker processes.
+
+# Slices in modality units are float64, they are copied once more into the volume
+VOLUME_BYTES_PER_VOXEL = 16
+
+
+@dataclass
+class VolumeResult:
+    # source files of the series, sorted along the slice axis
+    image_paths: List[str]
+    path: str
+    name: str
+    tags: List[Tuple[str, str]] = field(default_factory=list)
+    meta: Dict[str, str] = field(default_factory=dict)
+    group_tag_value: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+def get_orientation(dcm: FileDataset) -> Optional[np.ndarray]:
+    """Returns row, column and normal directions as the rows of a 3x3 matrix."""
+    orientation = find_attribute(dcm, "ImageOrientationPatient", "PlaneOrientationSequence")
+    if orientation is None or len(orientation) != 6:
+        return None
+    row_dir = np.array([float(v) for v in orientation[:3]])
+    col_dir = np.array([float(v) for v in orientation[3:]])
+    return np.array([row_dir, col_dir, np.cross(row_dir, col_dir)])
+
+
+def get_position(dcm: FileDataset) -> Optional[np.ndarray]:
+    position = find_attribute(dcm, "ImagePositionPatient", "PlanePositionSequence")
+    if position is None or len(position) != 3:
+        return None
+    return np.array([float(v) for v in position])
+
+
+def group_series(entries: List[DicomIndexEntry]) -> List[List[DicomIndexEntry]]:
+    """Groups single-frame files by SeriesInstanceUID, every multi-frame file (or a
+    file without the series UID) is a volume by itself. Groups keep the input order."""
+    series: Dict[str, List[DicomIndexEntry]] = {}
+    for entry in entries:
+        series_uid = entry.header.get("SeriesInstanceUID")
+        key = entry.path if entry.frames > 1 or not series_uid else f"series:{series_uid}"
+        series.setdefault(key, []).append(entry)
+    return [sort_slices(group) for group in series.values()]
+
+
+def sort_slices(entries: List[DicomIndexEntry]) -> List[DicomIndexEntry]:
+    """Sorts slices by their position along the normal, by InstanceNumber if the
+    position or orientation is missing."""
+    normals = [get_orientation(entry.header) for entry in entries]
+    positions = [get_position(entry.header) for entry in entries]
+    if all(n is not None for n in normals) and all(p is not None for p in positions):
+        normal = normals[0][2]
+        return [
+            entry
+            for _, entry in sorted(
+                zip(positions, entries), key=lambda item: float(np.dot(item[0], normal))
+            )
+        ]
+
+    def instance_number(entry: DicomIndexEntry) -> int:
+        try:
+            return int(entry.header.get("InstanceNumber") or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    return sorted(entries, key=instance_number)
+
+
+def estimate_series_memory(headers: List[FileDataset]) -> int:
+    """Estimates peak memory of `convert_series` in bytes from the slice headers."""
+    voxels = 0
+    for header in headers:
+        try:
+            voxels += (
+                int(header.Rows) * int(header.Columns) * int(header.get("NumberOfFrames") or 1)
+            )
+        except (AttributeError, TypeError, ValueError):
+            continue
+    return voxels * VOLUME_BYTES_PER_VOXEL
+
+
+def get_volume_name(dcm: FileDataset, path: str) -> str:
+    """Series volumes are named after SeriesInstanceUID. A multi-frame file is a volume by
+    itself and a series can have many of them, so the name of a volume grouped by file
+    also has SOPInstanceUID (or the file name)."""
+    series_uid = str(dcm.get("SeriesInstanceUID", "") or "")
+    name = series_uid
+    if int(dcm.get("NumberOfFrames") or 1) > 1 or not series_uid:
+        instance = str(dcm.get("SOPInstanceUID", "") or "") or get_file_name(path)
+        name = f"{series_uid}_{instance}" if series_uid else instance
+    name = re.sub(r"[^\w.\-]", "_", name)
+    return f"{name}.nrrd"
+
+
+def get_slice_pixels(dcm: FileDataset, settings: ConversionSettings) -> np.ndarray:
+    """Returns the pixel array in modality units (e.g. HU) with the frame axis first."""
+    backends = get_backends(
+        get_transfer_syntax(dcm), settings.decoder_backends, settings.transfer_syntax_decoders
+    )
+    pixel_array = apply_modality_lut(decode_pixel_array(dcm, backends), dcm)
+    if pixel_array.ndim == 2:
+        pixel_array = pixel_array[np.newaxis]
+    return pixel_array
+
+
+def to_volume_dtype(volume: np.ndarray) -> np.ndarray:
+    """Keeps integer voxels as integers after the rescale, like the DICOM volume import."""
+    if np.issubdtype(volume.dtype, np.integer):
+        return volume
+    if np.all(np.mod(volume, 1) == 0):
+        if volume.min() >= np.iinfo(np.int16).min and volume.max() <= np.iinfo(np.int16).max:
+            return volume.astype(np.int16)
+        return volume.astype(np.int32)
+    return volume.astype(np.float32)
+
+
+def get_volume_header(dcms: List[FileDataset]) -> dict:
+    """Builds the NRRD header in the DICOM patient (LPS) space.
+
+    Axes are columns, rows and slices: the first two follow ImageOrientationPatient,
+    the slice axis goes from the first to the last ImagePositionPatient.
+    """
+    first = dcms[0]
+    spacing = get_pixel_spacing(first)
+    orientation = get_orientation(first)
+    if orientation is None:
+        orientation = np.eye(3)
+    directions = [orientation[0] * spacing[0], orientation[1] * spacing[1]]
+
+    origin = get_position(first)
+    last_position = get_position(dcms[-1])
+    if len(dcms) > 1 and origin is not None and last_position is not None:
+        directions.append((last_position - origin) / (len(dcms) - 1))
+    else:
+        slice_spacing = spacing[2]
+        if slice_spacing == 1.0 and first.get("SliceThickness") is not None:
+            slice_spacing = abs(float(first.SliceThickness))
+        directions.append(orientation[2] * slice_spacing)
+
+    header = {
+        "dimension": 3,
+        "space": "left-posterior-superior",
+        "space directions": np.array(directions),
+        "kinds": ["domain", "domain", "domain"],
+    }
+    if origin is not None:
+        header["space origin"] = origin
+    return header
+
+
+def convert_series(image_paths: List[str], settings: ConversionSettings) -> VolumeResult:
+    """Stacks slices of the series (sorted by the caller) into a single 3D NRRD volume."""
+    start = time.perf_counter()
+    dcms = [pydicom.dcmread(path, defer_size=PIXEL_DATA_DEFER_SIZE) for path in image_paths]
+    first = dcms[0]
+    tags, meta = extract_dcm_tags(first, settings)
+    name = get_volume_name(first, image_paths[0])
+    result = VolumeResult(
+        image_paths=image_paths,
+        path=join(dirname(image_paths[0]), name),
+        name=name,
+        tags=tags,
+        meta=meta,
+    )
+    try:
+        result.group_tag_value = str(first[settings.group_tag_name].value)
+    except:
+        result.group_tag_value = None
+    result.timings[HEADER_PARSE] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    shape = (int(first.Rows), int(first.Columns))
+    slices = []
+    for path, dcm in zip(image_paths, dcms):
+        if (int(dcm.Rows), int(dcm.Columns)) != shape:
+            raise ValueError(f"Slice '{path}' size differs from the rest of the series")
+        slices.append(get_slice_pixels(dcm, settings))
+    # (slices, rows, columns) -> (columns, rows, slices), nrrd is written in Fortran order
+    volume = to_volume_dtype(np.concatenate(slices, axis=0)).transpose(2, 1, 0)
+    result.timings[PIXEL_DECODE] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    header = get_volume_header(dcms)
+    header["encoding"] = settings.nrrd_encoding
+    write_nrrd(result.path, volume, header, settings.nrrd_compression_level)
+    result.timings[NRRD_WRITE] = time.perf_counter() - start
+    return result
@@ -0,0 +1,68 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(ROOT_DIR, "src")
+BENCHMARKS_DIR = os.path.join(ROOT_DIR, "benchmarks")
+# modules of src that do not import sly_globals can be imported by the tests directly
+sys.path[:0] = [SRC_DIR, BENCHMARKS_DIR]
+
+from corpus import generate_corpus  # pylint: disable=wrong-import-position
+
+
+@pytest.fixture(scope="session")
+def corpus_dir(tmp_path_factory) -> str:
+    path = str(tmp_path_factory.mktemp("corpus"))
+    generate_corpus(path, "small")
+    return path
+
+
+@pytest.fixture
+def run_import(corpus_dir, tmp_path):
+    """Runs the whole import against the stand-in API in a new process, returns the report.
+
+    The app reads its settings when sly_globals is imported, so every import needs a process.
+    """
+
+    def run(
+        kind: str = "studies",
+        source: str = "local",
+        env: dict = None,
+        fail: dict = None,
+        reimport: bool = False,
+        projects: bool = False,
+        corpus: str = None,
+        resume: bool = False,
+    ) -> dict:
+        """`corpus` is a directory with the `kind` subdirectory to import instead of the
+        generated corpus, with `projects` the report has the projects on the server.
+        `fail` values are COUNT or COUNT@AFTER, see run_import.py."""
+        report_path = str(tmp_path / "report.json")
+        args = [
+            sys.executable,
+            os.path.join(BENCHMARKS_DIR, "run_import.py"),
+            f"--corpus={corpus or corpus_dir}",
+            f"--kind={kind}",
+            f"--source={source}",
+            f"--output={report_path}",
+        ]
+        for name, value in (env or {}).items():
+            args.append(f"--env={name}={value}")
+        for method, count in (fail or {}).items():
+            args.append(f"--fail={method}={count}")
+        if reimport:
+            args.append("--reimport")
+        if projects:
+            args.append("--projects")
+        if resume:
+            args.append("--resume")
+        process = subprocess.run(args, cwd=str(tmp_path), capture_output=True, text=True)
+        assert process.returncode == 0, process.stdout[-3000:] + process.stderr[-3000:]
+        with open(report_path) as file:
+            return json.load(file)
+
+    return run
@@ -0,0 +1,42 @@
+import hashlib
+
+from conversion_cache import ConversionCache, hash_file
+from converter import ConversionResult, ConversionSettings
+from dicom_index import DicomIndexEntry
+
+
+def create_entry(path: str, size: int = 16, sop_instance_uid: str = "1.2.3") -> DicomIndexEntry:
+    return DicomIndexEntry(
+        path=path,
+        header=None,
+        size=size,
+        group_tag_value=None,
+        frames=1,
+        sop_instance_uid=sop_instance_uid,
+    )
+
+
+def test_hit_is_confirmed_by_the_source_hash(tmp_path):
+    settings = ConversionSettings(group_tag_name="StudyInstanceUID")
+    cache = ConversionCache(str(tmp_path / "cache"), 1024 * 1024, settings)
+    source, image = tmp_path / "a.dcm", tmp_path / "a.dcm.nrrd"
+    source.write_bytes(b"0" * 16)
+    image.write_bytes(b"nrrd")
+    # the fingerprint is taken from the index, the source file is not read
+    key = cache.get_key(create_entry(str(tmp_path / "missing.dcm")))
+    assert key == cache.get_key(create_entry(str(source)))
+    assert key != cache.get_key(create_entry(str(source), sop_instance_uid="1.2.4"))
+    assert not cache.contains(key)
+
+    result = ConversionResult(image_path=str(source), paths=[str(image)], names=[image.name])
+    result.img_sizes = [[2, 2]]
+    cache.put(key, hash_file(str(source)), result)
+    image.unlink()
+    assert cache.get(str(source), key, hash_file(str(source))).names == [image.name]
+    assert image.read_bytes() == b"nrrd"
+
+    # same size and SOPInstanceUID, other content
+    other_hash = hashlib.sha1(b"1" * 16).hexdigest()
+    assert cache.get(str(source), key, other_hash) is None
+    assert not cache.contains(key)
+    assert (cache.hits, cache.misses) == (1, 1)
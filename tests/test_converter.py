@@ -0,0 +1,259 @@
+import hashlib
+import math
+import os
+import shutil
+import time
+import tracemalloc
+
+import nrrd
+import numpy as np
+import pydicom
+import pytest
+import supervisely as sly
+from pydicom.uid import JPEG2000Lossless
+
+from converter import (
+    PIXEL_DATA_DEFER_SIZE,
+    ConversionEngine,
+    ConversionSettings,
+    convert_dicom,
+    extract_dcm_tags,
+    get_nrrd_header,
+    get_raw_element,
+)
+from corpus import (
+    CT_IMAGE_STORAGE,
+    DX_IMAGE_STORAGE,
+    ENHANCED_CT_IMAGE_STORAGE,
+    SAGITTAL,
+    get_pixels,
+    new_dataset,
+    save,
+    set_functional_groups,
+    set_plane,
+    write_multiframe,
+    write_pillow_encoded,
+    write_series,
+)
+
+COS_45 = math.sqrt(0.5)
+# sagittal plane tilted by 45 degrees: the slice normal is as close to x as to z
+OBLIQUE = (0.0, COS_45, COS_45, 0.0, -COS_45, COS_45)
+
+
+def get_sitk_header(path: str) -> dict:
+    """Sizes and spacing of the header built by the previous SimpleITK-based converter."""
+    _, meta = sly.volume.read_dicom_serie_volume([path], False)
+    dimensions, spacing = meta["dimensionsIJK"], meta["spacing"]
+    return {
+        "sizes": [dimensions["x"], dimensions["y"]],
+        "space directions": [[spacing[0], 0], [0, spacing[1]]],
+    }
+
+
+def convert_corpus_copy(corpus_dir: str, dst_dir: str, workers: int) -> dict:
+    """Converts a copy of the studies and multi-frame corpora, returns the results by file."""
+    for kind in ("studies", "multiframe"):
+        shutil.copytree(os.path.join(corpus_dir, kind), os.path.join(dst_dir, kind))
+    paths = sorted(
+        os.path.join(root, name) for root, _, names in os.walk(dst_dir) for name in names
+    )
+    settings = ConversionSettings(
+        group_tag_name="StudyInstanceUID", extract_tags=True, add_all_tags=True
+    )
+    engine = ConversionEngine(settings, workers=workers)
+    results = {}
+    try:
+        for path, result in engine.convert(paths):
+            assert not isinstance(result, Exception), repr(result)
+            hashes = []
+            for image_path in result.paths:
+                with open(image_path, "rb") as file:
+                    hashes.append(hashlib.sha256(file.read()).hexdigest())
+            results[os.path.relpath(path, dst_dir)] = {
+                "names": result.names,
+                "hashes": hashes,
+                "img_sizes": result.img_sizes,
+                "tags": result.tags,
+                "meta": result.meta,
+                "group_tag_value": result.group_tag_value,
+            }
+    finally:
+        engine.shutdown()
+    return results
+
+
+def convert_and_record_time(path: str, settings: ConversionSettings):
+    """Converts the file slowly enough to overlap with other conversions, saves the time
+    it ran next to the file."""
+    start = time.time()
+    time.sleep(0.3)
+    result = convert_dicom(path, settings)
+    with open(f"{path}.time", "w") as file:
+        file.write(f"{start} {time.time()}")
+    return result
+
+
+def get_concurrency(paths: list) -> dict:
+    """Largest number of conversions running at once with each of the paths."""
+    times = {}
+    for path in paths:
+        with open(f"{path}.time") as file:
+            times[path] = tuple(map(float, file.read().split()))
+    return {
+        path: sum(1 for other in times.values() if other[0] < end and start < other[1])
+        for path, (start, end) in times.items()
+    }
+
+
+def write_single_frame(path: str, sop_class_uid: str, orientation, imager_spacing: bool) -> str:
+    ds = new_dataset(sop_class_uid, get_pixels(40, 24))
+    if imager_spacing:
+        set_plane(ds, orientation, (0.0, 0.0, 0.0), pixel_spacing=None)
+        ds.ImagerPixelSpacing = [0.3, 0.4]
+    else:
+        set_plane(ds, orientation, (0.0, 0.0, 0.0))
+    return save(ds, path)
+
+
+def write_enhanced(path: str, orientation) -> str:
+    ds = new_dataset(ENHANCED_CT_IMAGE_STORAGE, get_pixels(40, 24, frames=6))
+    normal = np.cross(orientation[:3], orientation[3:])
+    set_functional_groups(ds, orientation, [tuple(normal * 2.0 * i) for i in range(6)])
+    return save(ds, path)
+
+
+@pytest.mark.parametrize(
+    "write",
+    [
+        lambda path: write_single_frame(path, CT_IMAGE_STORAGE, OBLIQUE, False),
+        lambda path: write_single_frame(path, CT_IMAGE_STORAGE, SAGITTAL, False),
+        lambda path: write_single_frame(path, DX_IMAGE_STORAGE, SAGITTAL, True),
+        lambda path: write_single_frame(path, CT_IMAGE_STORAGE, SAGITTAL, True),
+        lambda path: write_enhanced(path, SAGITTAL),
+        lambda path: write_enhanced(path, OBLIQUE),
+    ],
+    ids=[
+        "oblique",
+        "sagittal",
+        "imager_spacing_dx",
+        "imager_spacing_ct",
+        "enhanced_sagittal",
+        "enhanced_oblique",
+    ],
+)
+def test_nrrd_header_matches_simpleitk(tmp_path, write):
+    path = write(str(tmp_path / "image.dcm"))
+    expected = get_sitk_header(path)
+
+    header = get_nrrd_header(pydicom.dcmread(path))
+
+    assert header["sizes"] == expected["sizes"]
+    assert np.allclose(header["space directions"], expected["space directions"])
+
+
+def test_conversion_does_not_read_written_files(tmp_path, monkeypatch):
+    paths = write_series(str(tmp_path), slices=1, size=16)
+    paths.append(write_multiframe(str(tmp_path / "multiframe.dcm"), frames=8, size=16))
+    paths.append(
+        write_multiframe(str(tmp_path / "rle.dcm"), frames=8, size=16, compressed=True)
+    )
+    reads = []
+    monkeypatch.setattr(nrrd, "read_header", lambda *args, **kwargs: reads.append(args))
+    monkeypatch.setattr(nrrd, "read", lambda *args, **kwargs: reads.append(args))
+    settings = ConversionSettings(group_tag_name="StudyInstanceUID", nrrd_encoding="raw")
+
+    results = [convert_dicom(path, settings) for path in paths]
+
+    monkeypatch.undo()
+    assert reads == []
+    assert [len(result.paths) for result in results] == [1, 8, 8]
+    for result in results:
+        for path, img_size in zip(result.paths, result.img_sizes):
+            # annotation sizes are (width, height), NRRD sizes are in Fortran order
+            assert list(nrrd.read_header(path)["sizes"]) == img_size
+
+
+def test_process_pool_output_is_identical_to_serial_conversion(corpus_dir, tmp_path):
+    serial = convert_corpus_copy(corpus_dir, str(tmp_path / "serial"), workers=1)
+    pooled = convert_corpus_copy(corpus_dir, str(tmp_path / "pooled"), workers=3)
+
+    assert len(serial) > 0
+    assert pooled == serial
+
+
+def test_conversions_are_admitted_within_the_memory_budget(corpus_dir, tmp_path):
+    src_dir = os.path.join(corpus_dir, "studies")
+    paths = sorted(
+        os.path.join(root, name) for root, _, names in os.walk(src_dir) for name in names
+    )[:7]
+    paths = [shutil.copy(path, str(tmp_path / f"{i}.dcm")) for i, path in enumerate(paths)]
+    # two conversions fit the budget, the one in the middle is larger than the budget
+    costs = [40] * len(paths)
+    costs[3] = 1000
+    engine = ConversionEngine(
+        ConversionSettings(group_tag_name="StudyInstanceUID"), workers=4, memory_budget=100
+    )
+    try:
+        results = list(engine.map(convert_and_record_time, paths, costs))
+    finally:
+        engine.shutdown()
+
+    assert [path for path, _ in results] == paths
+    for _, result in results:
+        assert not isinstance(result, Exception), repr(result)
+        assert len(result.paths) == 1
+    concurrency = get_concurrency(paths)
+    assert concurrency[paths[3]] == 1
+    assert max(concurrency.values()) == 2
+
+
+@pytest.mark.parametrize("compressed", [False, True], ids=["uncompressed", "rle"])
+def test_multiframe_conversion_does_not_copy_the_volume(tmp_path, compressed):
+    frames, size = 200, 64
+    volume_bytes = frames * size * size * 2
+    path = write_multiframe(str(tmp_path / "multiframe.dcm"), frames, size, compressed)
+    settings = ConversionSettings(group_tag_name="StudyInstanceUID", nrrd_encoding="raw")
+
+    tracemalloc.start()
+    result = convert_dicom(path, settings)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(result.paths) == frames
+    # uncompressed frames are memory-mapped, RLE frames are decoded one at a time
+    # next to the encoded pixel data
+    assert peak < (volume_bytes if compressed else volume_bytes / 4)
+
+
+def test_tag_extraction_does_not_read_pixel_data(tmp_path):
+    path = write_multiframe(str(tmp_path / "enhanced.dcm"), frames=8, size=256, enhanced=True)
+    dcm = pydicom.dcmread(path, defer_size=PIXEL_DATA_DEFER_SIZE)
+    settings = ConversionSettings(
+        group_tag_name="StudyInstanceUID", extract_tags=True, add_all_tags=True
+    )
+
+    tags, meta = extract_dcm_tags(dcm, settings)
+
+    # the deferred value is still unread: it is read from the file on first access
+    assert get_raw_element(dcm, "PixelData").value is None
+    assert "Pixel Data" not in meta
+    assert "Per-frame Functional Groups Sequence" not in meta
+    assert meta["Study Instance UID"] == str(dcm.StudyInstanceUID)
+    assert tags == list(meta.items())
+
+
+def test_jpeg2000_frames_are_decoded_one_by_one_with_the_configured_backend(tmp_path):
+    frames, size = 4, 32
+    path = write_pillow_encoded(str(tmp_path / "j2k.dcm"), frames, size, JPEG2000Lossless)
+    settings = ConversionSettings(
+        group_tag_name="StudyInstanceUID", nrrd_encoding="raw", decoder_backends=("pillow",)
+    )
+
+    result = convert_dicom(path, settings)
+
+    expected = get_pixels(size, size, frames).astype(np.int32) + 1024
+    assert len(result.paths) == frames
+    for frame_path, pixels in zip(result.paths, expected):
+        # frames are written as (columns, rows)
+        assert np.array_equal(nrrd.read(frame_path)[0], pixels.T)
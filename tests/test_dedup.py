@@ -0,0 +1,31 @@
+import shutil
+
+from checkpoint import ANNOTATED, DISCOVERED, ImportCheckpoint
+from corpus import write_series
+from dedup import KEEP_FIRST, Deduplicator
+from dicom_index import DicomIndex
+
+
+def test_copies_of_instances_imported_before_resume_are_duplicates(tmp_path):
+    write_series(str(tmp_path / "a"), slices=2, size=16)
+    shutil.copytree(str(tmp_path / "a"), str(tmp_path / "b"))
+    index = DicomIndex().scan(str(tmp_path))
+    entries = sorted(index, key=lambda entry: entry.path)
+    imported, interrupted, copies = entries[0], entries[1], entries[2:]
+
+    checkpoint = ImportCheckpoint(str(tmp_path / "checkpoint.sqlite"))
+    deduplicator = Deduplicator(KEEP_FIRST)
+    assert deduplicator.filter([imported, interrupted]) == [imported, interrupted]
+    checkpoint.mark([imported.path, interrupted.path], DISCOVERED)
+    checkpoint.add_instance_keys(
+        {entry.path: deduplicator.get_key(entry) for entry in (imported, interrupted)}
+    )
+    checkpoint.mark([imported.path], ANNOTATED)
+    checkpoint.close()
+
+    checkpoint = ImportCheckpoint(str(tmp_path / "checkpoint.sqlite"), resume=True)
+    deduplicator = Deduplicator(KEEP_FIRST)
+    deduplicator.add_imported(checkpoint.get_imported_instance_keys())
+    # the interrupted file is imported again, copies of both files are duplicates
+    assert deduplicator.filter([interrupted] + copies) == [interrupted]
+    assert deduplicator.duplicates_count == 2
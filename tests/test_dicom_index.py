@@ -0,0 +1,29 @@
+from converter import estimate_memory
+from corpus import SAGITTAL, write_multiframe, write_series
+from dicom_index import DicomIndex, read_dicom_header
+from volume import estimate_series_memory, get_orientation, get_position, group_series
+
+
+def test_index_keeps_only_the_header_elements_read_after_the_scan(tmp_path):
+    write_series(str(tmp_path / "series"), slices=4, size=16, orientation=SAGITTAL)
+    write_multiframe(str(tmp_path / "enhanced.dcm"), frames=4, size=16, enhanced=True)
+    write_multiframe(str(tmp_path / "rle.dcm"), frames=4, size=16, compressed=True)
+    index = DicomIndex("StudyInstanceUID").scan(str(tmp_path))
+    entries = sorted(index, key=lambda entry: entry.path)
+
+    for entry in entries:
+        header = read_dicom_header(entry.path)
+        assert "PatientName" not in entry.header and "PixelSpacing" not in entry.header
+        assert "PerFrameFunctionalGroupsSequence" not in entry.header
+        assert entry.group_tag_value == header.StudyInstanceUID
+        assert estimate_memory(entry.header, entry.size) == estimate_memory(header, entry.size)
+        assert estimate_series_memory([entry.header]) == estimate_series_memory([header])
+        assert str(get_orientation(entry.header)) == str(get_orientation(header))
+        if entry.frames == 1:
+            # multi-frame files are neither grouped nor sorted, their positions are per frame
+            assert str(get_position(entry.header)) == str(get_position(header))
+
+    # slices are sorted along the normal whatever the input order is
+    groups = group_series(entries[::-1])
+    assert [len(group) for group in groups] == [4, 1, 1]
+    assert [int(entry.header.InstanceNumber) for entry in groups[0]] == [1, 2, 3, 4]
@@ -0,0 +1,231 @@
+import json
+import os
+
+import pydicom
+import pytest
+import supervisely as sly
+
+from conftest import ROOT_DIR
+from corpus import write_series, write_sly_project
+
+
+def get_grouping(project: dict) -> tuple:
+    """Image grouping setting and the name of the grouping tag of the reported project."""
+    tag_names = {tag["id"]: tag["name"] for tag in project["meta"]["tags"]}
+    settings = project["settings"]
+    return settings["groupImages"], tag_names.get(settings["groupImagesByTagId"])
+
+
+def write_study_with_new_tags(corpus_dir: str, slices: int, new_tag_slices: int) -> str:
+    """Single series, only the last slices have the Body Part Examined tag."""
+    paths = write_series(os.path.join(corpus_dir, "studies", "ct"), slices, 16)
+    for path in paths[-new_tag_slices:]:
+        ds = pydicom.dcmread(path)
+        ds.BodyPartExamined = "CHEST"
+        ds.save_as(path)
+    return corpus_dir
+
+
+def write_project_with_unpaired_annotations(corpus_dir: str) -> str:
+    """Every annotation has the name of its image as the description. The annotation of
+    the second image is missing, an annotation without image sorts in its place."""
+    project_dir = write_sly_project(os.path.join(corpus_dir, "sly_project"), 1, 4, 16)
+    ann_dir = os.path.join(project_dir, "ds0", "ann")
+    os.rename(
+        os.path.join(ann_dir, "slice_0001.dcm.json"), os.path.join(ann_dir, "slice_0000a.dcm.json")
+    )
+    for name in os.listdir(ann_dir):
+        path = os.path.join(ann_dir, name)
+        with open(path) as file:
+            ann = json.load(file)
+        ann["description"] = name[: -len(".json")]
+        with open(path, "w") as file:
+            json.dump(ann, file)
+    return corpus_dir
+
+
+def test_archive_import_with_resume_enabled(run_import):
+    # the checkpoint manifest is opened before the archive is unpacked
+    report = run_import("studies", source="archive", env={"modal.state.resume": "true"})
+    assert report["uploaded_images"] == report["input_files"]
+    assert report["uploaded_annotations"] == report["input_files"]
+
+
+def test_interrupted_import_is_resumed_into_the_same_project(run_import):
+    env = {
+        "modal.state.resume": "true",
+        "DATASET_WORKERS": 1,
+        "CONVERT_BATCH_SIZE": 4,
+        "UPLOAD_WORKERS": 1,
+        "UPLOAD_QUEUE_SIZE": 1,
+        "UPLOAD_RETRIES": 0,
+    }
+    # the third batch fails after its images are uploaded and they are not removed
+    fail = {"annotations.bulk.add": "1@2", "images.bulk.remove": 1}
+    report = run_import("studies", source="folder", env=env, fail=fail, resume=True)
+    interrupted = report["interrupted"]
+
+    assert interrupted["images"] > interrupted["annotations"] > 0
+    assert report["api_calls"]["projects.add"] == 1
+    # images of finished batches are not uploaded again, stale images are replaced
+    assert report["stages"]["image_upload"]["count"] == (
+        report["input_files"] - interrupted["annotations"]
+    )
+    assert report["uploaded_images"] == report["input_files"]
+    assert report["uploaded_annotations"] == report["input_files"]
+
+
+def test_folder_is_streamed_from_team_files(run_import):
+    # files are listed and downloaded one by one, each of them is converted once it is downloaded
+    report = run_import("studies", source="folder", env={"modal.state.streamFolder": "true"})
+    assert report["uploaded_images"] == report["input_files"]
+    assert report["uploaded_annotations"] == report["input_files"]
+    assert report["api_calls"]["file-storage.download"] == report["input_files"]
+    assert report["downloaded_mb"] == report["input_mb"]
+
+
+@pytest.mark.parametrize("kind", ["studies", "sly_project"])
+def test_concurrent_datasets_give_the_same_project_as_serial_import(run_import, kind):
+    serial = run_import(kind, env={"DATASET_WORKERS": 1}, projects=True)
+    concurrent = run_import(kind, env={"DATASET_WORKERS": 4}, projects=True)
+    (serial_project,) = serial["projects"]
+    (concurrent_project,) = concurrent["projects"]
+
+    assert len(serial_project["datasets"]) > 1
+    # datasets with image names and annotations
+    assert concurrent_project["datasets"] == serial_project["datasets"]
+    # tag ids are given by the server, tag metas are created in the order files are converted
+    assert get_grouping(concurrent_project) == get_grouping(serial_project)
+    tag_names = [tag["name"] for tag in serial_project["meta"]["tags"]]
+    assert sorted(tag["name"] for tag in concurrent_project["meta"]["tags"]) == sorted(tag_names)
+
+
+def test_annotations_are_paired_with_their_images_by_name(run_import, tmp_path):
+    corpus = write_project_with_unpaired_annotations(str(tmp_path / "corpus"))
+    report = run_import("sly_project", projects=True, corpus=corpus)
+    (project,) = report["projects"]
+    anns = {name[: -len(".nrrd")]: ann for name, ann in project["datasets"]["ds0"].items()}
+
+    assert sorted(anns) == [f"slice_{index:04d}.dcm" for index in range(4)]
+    for image_name, ann in anns.items():
+        tag_names = [tag["name"] for tag in ann["tags"]]
+        if image_name == "slice_0001.dcm":
+            # imported with DICOM tags only
+            assert ann["description"] == ""
+            assert "reviewed" not in tag_names
+        else:
+            assert ann["description"] == image_name
+            assert "reviewed" in tag_names
+        assert "StudyInstanceUID" in tag_names
+
+
+def test_failed_upload_request_is_retried_without_duplicates(run_import):
+    # the failed request adds half of its images, they are removed before the retry
+    report = run_import("studies", env={"DATASET_WORKERS": 1}, fail={"images.bulk.add": 1})
+    assert report["uploaded_images"] == report["input_files"]
+    assert report["uploaded_annotations"] == report["input_files"]
+    assert report["api_calls"]["images.bulk.remove"] >= 1
+
+
+def test_reimport_skips_images_already_in_the_target_datasets(run_import, corpus_dir):
+    # the second import targets the project of the first one and reuses its datasets
+    report = run_import("studies", env={"modal.state.skipExisting": "true"}, reimport=True)
+    assert report["uploaded_images"] == report["input_files"]
+    datasets_count = len(os.listdir(os.path.join(corpus_dir, "studies")))
+    assert report["api_calls"]["datasets.add"] == datasets_count
+
+
+def test_reimport_restores_converted_files_from_the_cache(run_import, tmp_path):
+    env = {"CONVERSION_CACHE_DIR": str(tmp_path / "cache"), "CONVERT_WORKERS": 2}
+    report = run_import("studies", env=env, reimport=True)
+    assert report["uploaded_images"] == 2 * report["input_files"]
+    # the stages are reported for the second import: nothing is converted again
+    assert "header_parse" not in report["stages"]
+    assert report["stages"]["image_upload"]["count"] == report["input_files"]
+
+
+def test_conversion_cache_counts_every_file(run_import, tmp_path):
+    env = {"CONVERSION_CACHE_DIR": str(tmp_path / "cache")}
+    cold = run_import("studies", env=env)
+    assert cold["conversion_cache"] == {"hits": 0, "misses": cold["input_files"]}
+    warm = run_import("studies", env=env)
+    assert warm["conversion_cache"] == {"hits": warm["input_files"], "misses": 0}
+
+
+@pytest.mark.parametrize("kind", ["studies", "sly_project"])
+def test_project_meta_is_pushed_once_for_many_batches(run_import, kind):
+    env = {"CONVERT_BATCH_SIZE": 2, "UPLOAD_BATCH_MAX_IMAGES": 2}
+    report = run_import(kind, env=env)
+    assert report["api_calls"]["annotations.bulk.add"] >= report["input_files"] // 2
+    # the tag metas of the corpus are the same in every batch
+    assert report["api_calls"]["projects.meta.update"] == 1
+    # grouping is pushed with the meta, the meta update updates the project settings
+    assert report["api_calls"]["projects.settings.update"] == 1
+
+
+def test_image_grouping_stays_enabled_when_later_batches_add_tags(run_import, tmp_path):
+    corpus = write_study_with_new_tags(str(tmp_path / "corpus"), slices=8, new_tag_slices=2)
+    # a single upload worker with a short queue: the first batch is uploaded before
+    # the last one is converted, the new tag metas are pushed with the last batch
+    env = {
+        "CONVERT_BATCH_SIZE": 2,
+        "UPLOAD_WORKERS": 1,
+        "UPLOAD_QUEUE_SIZE": 1,
+        "DATASET_WORKERS": 1,
+    }
+    report = run_import("studies", env=env, projects=True, corpus=corpus)
+    assert report["api_calls"]["projects.meta.update"] == 2
+    (project,) = report["projects"]
+    assert get_grouping(project) == (True, "StudyInstanceUID")
+
+
+def test_every_series_is_imported_as_a_volume_with_its_tags(run_import, corpus_dir):
+    report = run_import("studies", env={"modal.state.volumeMode": "true"}, projects=True)
+    (project,) = report["projects"]
+    assert project["type"] == "volumes"
+    studies_dir = os.path.join(corpus_dir, "studies")
+    assert sorted(project["datasets"]) == sorted(os.listdir(studies_dir))
+    for dataset_name, volumes in project["datasets"].items():
+        dataset_dir = os.path.join(studies_dir, dataset_name)
+        # every dataset of the corpus is a single series
+        ds = pydicom.dcmread(os.path.join(dataset_dir, sorted(os.listdir(dataset_dir))[0]))
+        volume_name = f"{ds.SeriesInstanceUID}.nrrd"
+        assert list(volumes) == [volume_name]
+        tags = {tag["name"]: tag["value"] for tag in volumes[volume_name]["tags"]}
+        assert tags["StudyInstanceUID"] == ds.StudyInstanceUID
+        assert tags["Modality"] == ds.Modality
+
+
+def test_convert_only_project_can_be_read(run_import, tmp_path):
+    output_dir = tmp_path / "converted"
+    env = {"modal.state.convertOnly": "true", "CONVERT_OUTPUT_DIR": str(output_dir)}
+    report = run_import("sly_project", env=env)
+    assert report["uploaded_images"] == 0
+
+    (project_name,) = os.listdir(output_dir)
+    project = sly.Project(str(output_dir / project_name), sly.OpenMode.READ)
+    assert project.total_items == report["input_files"]
+    assert project.meta.project_settings.multiview_enabled
+    assert project.meta.project_settings.multiview_tag_name == "StudyInstanceUID"
+    assert project.meta.get_tag_meta("reviewed") is not None
+
+
+def test_nrrd_encoding_trades_upload_size(run_import):
+    raw = run_import("multiframe", env={"NRRD_ENCODING": "raw"})
+    gzip = run_import("multiframe", env={"NRRD_ENCODING": "gzip", "NRRD_COMPRESSION_LEVEL": 1})
+    assert raw["uploaded_images"] == gzip["uploaded_images"]
+    assert gzip["uploaded_mb"] < raw["uploaded_mb"]
+
+
+def test_import_with_modal_template_defaults(run_import):
+    # modal state values are passed as strings, null values are empty
+    with open(os.path.join(ROOT_DIR, "config.json")) as file:
+        state = json.load(file)["modal_template_state"]
+    env = {
+        f"modal.state.{name}": value if isinstance(value, str) else json.dumps(value)
+        for name, value in state.items()
+    }
+    env.update({name: "" for name, value in env.items() if value == "null"})
+    report = run_import("studies", env=env)
+    assert report["uploaded_images"] == report["input_files"]
+    assert report["api_calls"]["projects.add"] == 1
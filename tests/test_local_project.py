@@ -0,0 +1,16 @@
+import os
+
+from local_project import LocalProject
+
+
+def test_dataset_ids_are_not_reused_after_removal(tmp_path):
+    project = LocalProject(str(tmp_path / "project"))
+    first = project.create_dataset("ds")
+    second = project.create_dataset("ds")
+    project.remove_dataset(first.id)
+
+    third = project.create_dataset("ds")
+
+    assert third.id not in (first.id, second.id)
+    assert project.datasets_count == 2
+    assert sorted(os.listdir(project.project_dir)) == sorted([second.name, third.name])
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+
+from checkpoint import ANNOTATED, CONVERTED, UPLOADED, ImportCheckpoint
+from pipeline import BatchSizeController, SourceImages, UploadBatch, UploadPipeline
+
+
+def create_batch(tmp_path, source: str, count: int) -> UploadBatch:
+    batch = UploadBatch(dataset_id=1, source_images=[SourceImages(source, count)])
+    for index in range(count):
+        path = tmp_path / f"{source}_{index}.nrrd"
+        path.write_bytes(b"0" * 16)
+        batch.paths.append(str(path))
+        batch.names.append(path.name)
+        batch.metas.append({})
+        batch.anns.append({})
+    return batch
+
+
+def test_sources_are_uploaded_once_all_parts_are_uploaded(tmp_path):
+    first_part_started = threading.Event()
+    last_part_uploaded = threading.Event()
+    events = []
+
+    def upload(batch: UploadBatch) -> None:
+        if batch.names[0].endswith("_0.nrrd"):
+            first_part_started.set()
+            # the last part finishes first
+            assert last_part_uploaded.wait(10)
+        events.append(("part", batch.names[0]))
+        if batch.names[-1].endswith("_3.nrrd"):
+            last_part_uploaded.set()
+
+    controller = BatchSizeController(
+        max_images=1, max_bytes=1024, min_images=1, min_bytes=1, initial_images=1
+    )
+    pipeline = UploadPipeline(
+        upload,
+        workers=4,
+        max_queued=4,
+        controller=controller,
+        on_uploaded=lambda sources: events.append(("uploaded", sources)),
+    )
+    pipeline.put(create_batch(tmp_path, "multiframe.dcm", 4))
+    pipeline.close()
+
+    assert first_part_started.is_set()
+    assert len(events) == 5
+    assert events[-1] == ("uploaded", [SourceImages("multiframe.dcm", 4)])
+
+
+def test_sources_are_removed_once_all_parts_are_processed(tmp_path):
+    batch = create_batch(tmp_path, "multiframe.dcm", 4)
+    source = tmp_path / "multiframe.dcm"
+    source.write_bytes(b"0" * 16)
+    batch.sources = [str(source)]
+    done = []
+    batch.on_done = lambda: done.append(source.exists())
+    other_paths = batch.paths[1:]
+    source_exists = []
+
+    def upload(part: UploadBatch) -> None:
+        if part.names[0].endswith("_0.nrrd"):
+            # the other parts are processed first
+            deadline = time.monotonic() + 10
+            while any(os.path.exists(path) for path in other_paths):
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            time.sleep(0.1)
+            source_exists.append(source.exists())
+
+    controller = BatchSizeController(
+        max_images=1, max_bytes=1024, min_images=1, min_bytes=1, initial_images=1
+    )
+    pipeline = UploadPipeline(upload, workers=4, max_queued=4, controller=controller)
+    pipeline.put(batch)
+    pipeline.close()
+
+    assert source_exists == [True]
+    assert done == [False]
+
+
+def test_batch_size_follows_upload_timings_within_limits():
+    mb = 1024 * 1024
+    controller = BatchSizeController(
+        max_images=100,
+        max_bytes=64 * mb,
+        min_images=2,
+        min_bytes=mb,
+        target_seconds=10,
+        initial_images=10,
+        initial_bytes=8 * mb,
+    )
+    sizes = []
+    # fast requests grow the batch up to the upper limits
+    for _ in range(20):
+        images, nbytes = controller.limits()
+        controller.observe(images, nbytes, seconds=1, ok=True)
+        sizes.append(controller.limits())
+    assert sizes[0] == (15, 12 * mb)
+    assert sizes == sorted(sizes)
+    assert controller.limits() == (100, 64 * mb)
+
+    # slow requests shrink it to the target time at the smoothed throughput, down to the
+    # lower limits
+    controller.observe(100, 64 * mb, seconds=40, ok=True)
+    assert controller.limits()[0] == 25
+    for _ in range(20):
+        images, nbytes = controller.limits()
+        controller.observe(images, nbytes, seconds=1000, ok=True)
+    assert controller.limits() == (2, mb)
+
+    # requests on target keep the size, failed ones halve it
+    controller = BatchSizeController(max_images=100, max_bytes=64 * mb, target_seconds=10)
+    controller.observe(100, 64 * mb, seconds=8, ok=True)
+    assert controller.limits() == (100, 64 * mb)
+    controller.observe(100, 64 * mb, seconds=8, ok=False)
+    assert controller.limits() == (50, 32 * mb)
+    for _ in range(10):
+        controller.observe(100, 64 * mb, seconds=8, ok=False)
+    assert controller.limits() == (1, mb)
+    assert controller.errors == 11
+
+
+def test_checkpoint_state_only_moves_forward(tmp_path):
+    checkpoint = ImportCheckpoint(str(tmp_path / "checkpoint.sqlite"))
+    checkpoint.mark(["a.dcm"], CONVERTED)
+    checkpoint.mark_uploaded("a.dcm", [1])
+    checkpoint.mark(["a.dcm"], ANNOTATED)
+    # a late part of the same source
+    checkpoint.mark_uploaded("a.dcm", [2])
+    checkpoint.mark(["a.dcm"], UPLOADED)
+    checkpoint.close()
+
+    checkpoint = ImportCheckpoint(str(tmp_path / "checkpoint.sqlite"), resume=True)
+    assert checkpoint.is_done("a.dcm")
+    assert checkpoint.pop_stale_image_ids() == []
@@ -0,0 +1,24 @@
+import os
+
+from pydicom.uid import generate_uid
+
+from converter import ConversionSettings
+from corpus import write_multiframe, write_series
+from dicom_index import DicomIndex
+from volume import convert_series, group_series
+
+SETTINGS = ConversionSettings(group_tag_name="StudyInstanceUID", nrrd_encoding="raw")
+
+
+def test_multiframe_files_of_a_series_get_unique_volume_names(tmp_path):
+    series_uid = generate_uid()
+    for name in ("a.dcm", "b.dcm"):
+        write_multiframe(str(tmp_path / name), frames=4, size=16, series_uid=series_uid)
+    write_series(str(tmp_path), slices=3, size=16, prefix="slice")
+
+    groups = group_series(list(DicomIndex().scan(str(tmp_path))))
+    results = [convert_series([entry.path for entry in group], SETTINGS) for group in groups]
+
+    assert sorted(len(group) for group in groups) == [1, 1, 3]
+    assert len({result.name for result in results}) == 3
+    assert all(os.path.isfile(result.path) for result in results)